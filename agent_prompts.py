@@ -1,42 +1,39 @@
+import os
+import inspect
+import tool_schema
+
+PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt.md")
+
+def tool_metadata(registry, exposed=None):
+    """
+    {name: {'parameters': {name: 'type = default'}, 'description': ...}} for a tool registry,
+    from the functions' signatures and docstrings. `exposed` limits a tool's parameters.
+    """
+    metadata = {}
+    for name, func in registry.items():
+        parameters = {}
+        for parameter in inspect.signature(func).parameters.values():
+            if exposed and name in exposed and parameter.name not in exposed[name]:
+                continue
+            annotation = parameter.annotation
+            spec = annotation.__name__ if isinstance(annotation, type) and annotation is not parameter.empty else ""
+            if parameter.default is not parameter.empty:
+                spec += f" = {parameter.default!r}" if spec else f"={parameter.default!r}"
+            parameters[parameter.name] = spec
+        metadata[name] = {'parameters': parameters, 'description': tool_schema.description(name, func)}
+    return metadata
+
 def generate_tool_descriptions(tool_metadata):
     """Formats the tool metadata into a string for the system prompt."""
     descriptions = []
     for name, details in tool_metadata.items():
-        param_str = ", ".join(f"'{k}': '{v}'" for k, v in details['parameters'].items())
-        descriptions.append(f"- {name}({param_str}): {details['description']}")
+        param_str = ", ".join(f"{k}: {v}" if v and not v.startswith("=") else f"{k}{v}"
+                              for k, v in details['parameters'].items())
+        descriptions.append(f"- `{name}({param_str})`: {details['description']}")
     return "\n".join(descriptions)
 
-SYSTEM_PROMPT_TEMPLATE = """You are a highly capable AI Agent. Your primary purpose is to assist users by performing tasks.
-
-You have access to a set of tools to interact with a file system. You must operate within a secure, sandboxed workspace.
-
-**YOUR TASK:**
-Based on the user's request, you must break down the problem into a sequence of steps. For each step, decide if you need to use a tool.
-
-**RESPONSE FORMAT:**
-You MUST respond in one of two ways:
-
-1.  **If you need to use a tool:**
-    Your response must contain a JSON block with the tool call. The format is:
-    ```json
-    {
-      "thought": "Your reasoning for choosing this tool and parameters.",
-      "tool_call": {
-        "name": "tool_name",
-        "parameters": {
-          "param1": "value1",
-          "param2": "value2"
-        }
-      }
-    }
-    ```
-
-2.  **If you have completed the task or have sufficient information:**
-    Provide a final, comprehensive answer to the user. Do NOT include a JSON block.
-
-**AVAILABLE TOOLS:**
-{{tools}}
-
-Begin the task by analyzing the user's request.
-"""
-
+def build_system_prompt(registry, exposed=None, path=PROMPT_PATH):
+    """The system prompt from prompt.md, with {{tools}} replaced by the registry's tool list."""
+    with open(path, "r", encoding="utf-8") as f:
+        template = f.read()
+    return template.replace("{{tools}}", generate_tool_descriptions(tool_metadata(registry, exposed)))
@@ -0,0 +1,77 @@
+import json
+import zlib
+from datetime import datetime
+from sqlalchemy import insert
+from models import db, AgentEvent
+
+# Event contents above this many bytes are stored zlib-compressed.
+COMPRESS_THRESHOLD = 1024
+TRACED_EVENT_TYPES = ('usage', 'thought', 'tool_call', 'tool_output', 'final_answer', 'error')
+
+def encode_content(text):
+    """Returns (stored_bytes, compressed, original_size) for an event's content."""
+    raw = text.encode('utf-8')
+    if len(raw) > COMPRESS_THRESHOLD:
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            return packed, True, len(raw)
+    return raw, False, len(raw)
+
+class TraceRecorder:
+    """
+    Buffers one loop run's events and writes each turn with a single batched INSERT.
+    A turn starts at its 'usage' event, so the previous turn is flushed and committed
+    then. The caller flushes the final turn and commits it together with the AI message.
+    `message` may still be pending in the session; it is inserted with the first batch.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self.seq = 0
+        self.turn = 0
+        self.model = None
+        self._pending = []
+
+    def add(self, event):
+        event_type = event.get('type')
+        if event_type not in TRACED_EVENT_TYPES:
+            return
+        if event_type == 'usage':
+            if self._pending:
+                self.flush()
+                db.session.commit()
+            self.turn = event.get('turn', self.turn + 1)
+            self.model = event.get('model_used') or self.model
+            content = json.dumps({k: v for k, v in event.items() if k not in ('type', 'turn', 'model_used')})
+        else:
+            content = str(event.get('content', ''))
+
+        arguments = None
+        if event_type == 'tool_call' and '(' in content:
+            arguments = content.split('(', 1)[1].rsplit(')', 1)[0]
+        stored, compressed, size = encode_content(content)
+        self.seq += 1
+        self._pending.append({
+            'message_id': None,
+            'seq': self.seq,
+            'turn': self.turn or None,
+            'type': event_type,
+            'tool_name': event.get('tool_name'),
+            'arguments': arguments,
+            'duration_ms': event.get('duration_ms'),
+            'output_size': size,
+            'model': event.get('model_used') or self.model,
+            'content': stored,
+            'compressed': compressed,
+            'created_at': datetime.utcnow(),
+        })
+
+    def flush(self):
+        """Adds the buffered turn to the current transaction as one executemany INSERT."""
+        if self._pending:
+            if self.message.id is None:
+                db.session.flush()
+            for row in self._pending:
+                row['message_id'] = self.message.id
+            db.session.execute(insert(AgentEvent), self._pending)
+            self._pending = []
@@ -0,0 +1,271 @@
+import os
+import csv
+import json
+import itertools
+import numpy as np
+from cache import LRUCache
+from file_scan import sniff_delimiter
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:  # Parquet support is optional; CSV and JSONL are parsed without it
+    pyarrow = None
+
+BATCH_ROWS = 100_000
+MAX_FILE_BYTES = int(os.environ.get('ANALYSIS_MAX_FILE_BYTES', 512 * 1024 * 1024))
+MAX_GROUPS_SHOWN = 50
+MISSING_TOKENS = ['', 'NA', 'N/A', 'NaN', 'nan', 'null', 'NULL', 'None']
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max', 'std')
+
+_tables = LRUCache(max_entries=int(os.environ.get('ANALYSIS_CACHE_TABLES', 4)), ttl=float('inf'))
+
+class Table:
+    """
+    A dataset parsed into columns. Numeric columns are float64 arrays with NaN for
+    missing values; all other columns are object arrays of str with None for missing.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.rows = len(next(iter(columns.values()))) if columns else 0
+
+    def is_numeric(self, name):
+        return self.columns[name].dtype == np.float64
+
+    def numeric_names(self):
+        return [name for name in self.columns if self.is_numeric(name)]
+
+    def column(self, name):
+        if name not in self.columns:
+            raise ValueError(f"Unknown column '{name}'. Columns: {', '.join(self.columns)}")
+        return self.columns[name]
+
+# --- Parsing ---
+def _finish_text_batches(batches):
+    """Turns batches of raw strings into one float64 column if every value parses, else a text column."""
+    values = np.concatenate(batches) if batches else np.array([], dtype=str)
+    missing = np.isin(values, MISSING_TOKENS)
+    try:
+        return np.where(missing, 'nan', values).astype(np.float64)
+    except ValueError:
+        values = values.astype(object)
+        values[missing] = None
+        return values
+
+def _parse_csv_batch(lines, delimiter, width):
+    """
+    Parses a batch of CSV lines into a 2-D array of str with numpy's C parser. Batches it
+    rejects (e.g. rows with a different number of fields) go through the csv module.
+    """
+    try:
+        batch = np.loadtxt(lines, delimiter=delimiter, dtype=str, quotechar='"', ndmin=2, comments=None)
+        if batch.shape[1] == width:
+            return batch
+    except ValueError:
+        pass
+    rows = [row for row in csv.reader(lines, delimiter=delimiter) if row]
+    return np.array([row[:width] + [''] * (width - len(row)) for row in rows], dtype=str).reshape(-1, width)
+
+def _read_csv(path):
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        delimiter = sniff_delimiter(f)
+        header = next(csv.reader([f.readline()], delimiter=delimiter), None)
+        if header is None:
+            return Table({})
+        names = [name or f"column_{index + 1}" for index, name in enumerate(header)]
+        batches = [[] for _ in names]
+        while True:
+            lines = list(itertools.islice(f, BATCH_ROWS))
+            if not lines:
+                break
+            lines = [line for line in lines if line.strip()]
+            if not lines:
+                continue
+            batch = _parse_csv_batch(lines, delimiter, len(names))
+            for index, column in enumerate(batches):
+                column.append(batch[:, index])
+    return Table({name: _finish_text_batches(column) for name, column in zip(names, batches)})
+
+def _read_jsonl(path):
+    columns = {}
+    rows = 0
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                record = {'value': record}
+            for key, value in record.items():
+                column = columns.setdefault(key, [None] * rows)
+                column.append(value)
+            rows += 1
+            for column in columns.values():
+                if len(column) < rows:
+                    column.append(None)
+    table = {}
+    for name, values in columns.items():
+        present = [value for value in values if value is not None]
+        if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+            table[name] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        else:
+            table[name] = np.array([None if value is None else value if isinstance(value, str) else json.dumps(value)
+                                    for value in values], dtype=object)
+    return Table(table)
+
+def _from_arrow(arrow_table):
+    columns = {}
+    for name, column in zip(arrow_table.column_names, arrow_table.columns):
+        if pyarrow.types.is_integer(column.type) or pyarrow.types.is_floating(column.type):
+            columns[name] = column.cast(pyarrow.float64()).to_numpy()
+        else:
+            columns[name] = np.array([None if value is None else str(value) for value in column.to_pylist()], dtype=object)
+    return Table(columns)
+
+def load_table(path):
+    """
+    Parses a CSV/TSV, JSONL or Parquet file into a Table. Parsed tables are cached on
+    (path, mtime, size), so repeated questions about an unchanged file skip parsing.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+    if stat.st_size > MAX_FILE_BYTES:
+        raise ValueError(f"File is {stat.st_size} bytes, above the {MAX_FILE_BYTES}-byte limit for in-memory analysis. "
+                         "Use analysis_type 'csv' for streaming per-column statistics instead.")
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.parquet', '.pq'):
+        if pyarrow is None:
+            raise ValueError("Parquet files need the optional 'pyarrow' package.")
+        table = _from_arrow(pyarrow.parquet.read_table(path))
+    elif extension in ('.jsonl', '.ndjson'):
+        table = _read_jsonl(path)
+    elif pyarrow is not None:
+        with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+            delimiter = sniff_delimiter(f)
+        table = _from_arrow(pyarrow.csv.read_csv(
+            path, parse_options=pyarrow.csv.ParseOptions(delimiter=delimiter),
+            convert_options=pyarrow.csv.ConvertOptions(null_values=MISSING_TOKENS, strings_can_be_null=True)))
+    else:
+        table = _read_csv(path)
+    _tables.set(key, table)
+    return table
+
+# --- Analyses ---
+def _fmt(value):
+    return "-" if value is None or (isinstance(value, float) and np.isnan(value)) else f"{value:.6g}"
+
+def _format_rows(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    lines = ["  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [header, *rows]]
+    return "\n".join(lines)
+
+def _selected_numeric(table, columns):
+    names = [name.strip() for name in columns.split(',') if name.strip()] if columns else table.numeric_names()
+    for name in names:
+        table.column(name)
+        if not table.is_numeric(name):
+            raise ValueError(f"Column '{name}' is not numeric.")
+    if not names:
+        raise ValueError("The file has no numeric columns.")
+    return names
+
+def profile(table):
+    lines = [f"{table.rows} rows, {len(table.columns)} columns"]
+    for name, values in table.columns.items():
+        if table.is_numeric(name):
+            present = values[~np.isnan(values)]
+            if present.size:
+                q25, q50, q75 = np.quantile(present, [0.25, 0.5, 0.75])
+                std = present.std(ddof=1) if present.size > 1 else 0.0
+                stats = (f"mean {_fmt(present.mean())}, std {_fmt(std)}, min {_fmt(present.min())}, "
+                         f"p25 {_fmt(q25)}, median {_fmt(q50)}, p75 {_fmt(q75)}, max {_fmt(present.max())}")
+            else:
+                stats = "no values"
+            lines.append(f"- {name} (numeric): {present.size} present, {values.size - present.size} missing; {stats}")
+        else:
+            present = values[np.not_equal(values, None)]
+            distinct, counts = np.unique(present.astype(str), return_counts=True) if present.size else ([], np.array([]))
+            top = np.argsort(counts)[::-1][:5]
+            top_values = ", ".join(f"{str(distinct[index])!r} ({counts[index]})" for index in top)
+            lines.append(f"- {name} (text): {present.size} present, {values.size - present.size} missing; "
+                         f"{len(distinct)} distinct; top: {top_values or '-'}")
+    return "\n".join(lines)
+
+def group_by(table, by, columns=None, aggregate="mean"):
+    """Aggregates numeric columns per distinct value of `by`, vectorised with bincount and reduceat."""
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate '{aggregate}'. Use one of: {', '.join(AGGREGATES)}")
+    keys = table.column(by)
+    if not table.is_numeric(by):
+        keys = np.where(np.equal(keys, None), "(missing)", keys).astype(str)
+    names = [name for name in _selected_numeric(table, columns) if name != by]
+    groups, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    sizes = np.bincount(inverse, minlength=len(groups))
+
+    results = {}
+    for name in names:
+        values = table.columns[name]
+        valid = ~np.isnan(values)
+        group_ids, present = inverse[valid], values[valid]
+        count = np.bincount(group_ids, minlength=len(groups))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if aggregate == 'count':
+                result = count.astype(np.float64)
+            elif aggregate in ('sum', 'mean', 'std'):
+                total = np.bincount(group_ids, weights=present, minlength=len(groups))
+                mean = total / count
+                if aggregate == 'sum':
+                    result = total
+                elif aggregate == 'mean':
+                    result = mean
+                else:
+                    squares = np.bincount(group_ids, weights=(present - mean[group_ids]) ** 2, minlength=len(groups))
+                    result = np.where(count > 1, np.sqrt(squares / np.maximum(count - 1, 1)), np.nan)
+            else:
+                order = np.argsort(group_ids, kind='stable')
+                sorted_ids, sorted_values = group_ids[order], present[order]
+                starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if sorted_ids.size else np.array([], dtype=int)
+                reducer = np.minimum if aggregate == 'min' else np.maximum
+                result = np.full(len(groups), np.nan)
+                if starts.size:
+                    result[sorted_ids[starts]] = reducer.reduceat(sorted_values, starts)
+        results[name] = result
+
+    order = np.argsort(sizes, kind='stable')[::-1][:MAX_GROUPS_SHOWN]
+    header = [by, 'rows'] + [f"{aggregate}({name})" for name in names]
+    rows = [[str(groups[index]), int(sizes[index])] + [_fmt(results[name][index]) for name in names] for index in order]
+    note = f"\n[showing the {MAX_GROUPS_SHOWN} largest of {len(groups)} groups]" if len(groups) > MAX_GROUPS_SHOWN else ""
+    return _format_rows(header, rows) + note
+
+def quantiles(table, columns=None, probabilities="0.05,0.25,0.5,0.75,0.95"):
+    qs = [float(q) for q in probabilities.split(',')] if isinstance(probabilities, str) else list(probabilities)
+    if any(q < 0 or q > 1 for q in qs):
+        raise ValueError("Quantiles must be between 0 and 1.")
+    names = _selected_numeric(table, columns)
+    matrix = np.column_stack([table.columns[name] for name in names])
+    with np.errstate(invalid='ignore'):
+        values = np.nanquantile(matrix, qs, axis=0) if matrix.size else np.full((len(qs), len(names)), np.nan)
+    header = ['column'] + [f"q{q:g}" for q in qs]
+    return _format_rows(header, [[name] + [_fmt(value) for value in values[:, index]] for index, name in enumerate(names)])
+
+def correlation(table, columns=None):
+    """Pearson correlation matrix over the rows where all selected columns are present."""
+    names = _selected_numeric(table, columns)
+    if len(names) < 2:
+        raise ValueError("Correlation needs at least two numeric columns.")
+    matrix = np.column_stack([table.columns[name] for name in names])
+    complete = matrix[~np.isnan(matrix).any(axis=1)]
+    if complete.shape[0] < 2:
+        raise ValueError("Fewer than two rows have values in every selected column.")
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = np.corrcoef(complete, rowvar=False)
+    rows = [[name] + [f"{value:.3f}" if not np.isnan(value) else "-" for value in corr[index]] for index, name in enumerate(names)]
+    return f"Pearson correlation over {complete.shape[0]} complete rows:\n" + _format_rows([''] + names, rows)
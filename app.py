@@ -1,21 +1,44 @@
 import os
-import requests
-import re
-import ast
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import json
+import time
+import threading
+import functools
+from flask import Flask, Blueprint, Response, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
 from dotenv import load_dotenv
 from models import db, User, Conversation, Message
+from db_config import database_uri, engine_options
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import click
 from chat_routes import api_bp
-# MODIFIED: Import the specific tool registry from the tools file
-from tools import SUB_TOOL_REGISTRY
-
+from job_queue import job_queue
+from model_router import ModelRouter, NoModelAvailable
+from cache import LLMCache
+from agent_trace import TraceRecorder
+import message_search
+import instrumentation
+import fast_router
+import agent_prompts
+import tool_schema
+import task_store
+import workspaces
+import rate_limit
 load_dotenv()
 
 # --- System Prompt & Agent Configuration ---
-with open("prompt.md", "r", encoding="utf-8") as f:
-    SYSTEM_PROMPT = f.read()
+# Built once per process, on first use, from prompt.md (next to this file) and the live tool
+# registry, so the tool list cannot drift from the code. The agent loop and the registry live
+# in tools.py, which also starts the sandbox pool; it is imported only when an agent runs.
+# The dispatcher only sees autonomous_loop's task argument.
+DISPATCHER_TOOL_PARAMETERS = {'autonomous_loop': ['initial_prompt']}
+
+@functools.lru_cache(maxsize=None)
+def system_prompt():
+    from tools import MASTER_TOOL_REGISTRY
+    return agent_prompts.build_system_prompt(MASTER_TOOL_REGISTRY, exposed=DISPATCHER_TOOL_PARAMETERS)
+
+@functools.lru_cache(maxsize=None)
+def dispatcher_prompt():
+    return fast_router.dispatcher_prompt(system_prompt())
 
 # USER-DEFINED MODEL LIST (UNCHANGED AS PER REQUEST)
 AGENT_MODELS = [
@@ -42,196 +65,567 @@ AGENT_MODELS = [
 ]
 
 # --- API Config ---
-GEMINI_API_URL_TEMPLATE = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
-API_KEY = os.environ.get('API_KEY')
-if not API_KEY:
-    raise ValueError("API_KEY not found in .env file. Please ensure it is set correctly.")
+_llm_client = None
+_llm_client_lock = threading.Lock()
 
-# --- Flask Application Setup ---
-app = Flask(__name__, template_folder='templates')
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a-default-secret-key-for-dev-only')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def get_llm_client():
+    """
+    The process's pooled Gemini client, created on first use so that importing the app
+    (CLI commands, worker boot) needs neither API_KEY nor the HTTP stack. GEMINI_API_BASE
+    can point it at a local stub server.
+    """
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is None:
+            api_key = os.environ.get('API_KEY')
+            if not api_key:
+                raise ValueError("API_KEY not found in .env file. Please ensure it is set correctly.")
+            from llm_client import GeminiClient
+            _llm_client = GeminiClient.from_env(api_key)
+        return _llm_client
+
+# Tracks per-model health so failing models stop costing every request a timeout.
+model_router = ModelRouter(
+    AGENT_MODELS,
+    failure_threshold=int(os.environ.get('MODEL_FAILURE_THRESHOLD', 3)),
+    base_cooldown=float(os.environ.get('MODEL_BASE_COOLDOWN', 30)),
+    max_cooldown=float(os.environ.get('MODEL_MAX_COOLDOWN', 900)),
+)
+LLM_HEDGING = os.environ.get('LLM_HEDGING', '').lower() in ('1', 'true', 'yes')
+# Total seconds one LLM call may take across every model it falls back to (0 disables).
+LLM_DEADLINE = float(os.environ.get('LLM_DEADLINE', 90))
+LLM_CONTEXT_CACHE = os.environ.get('LLM_CONTEXT_CACHE', '').lower() in ('1', 'true', 'yes')
+
+@functools.lru_cache(maxsize=None)
+def gemini_tools(loop=False):
+    """
+    With TOOL_CALLING=native, the functionDeclarations sent to Gemini: every tool to the
+    dispatcher, and to loop turns only the sub-tools run_tool_call can execute. Else None.
+    """
+    if not tool_schema.NATIVE:
+        return None
+    from tools import MASTER_TOOL_REGISTRY, SUB_TOOL_REGISTRY
+    if loop:
+        return tool_schema.gemini_tools(SUB_TOOL_REGISTRY)
+    return tool_schema.gemini_tools(MASTER_TOOL_REGISTRY, exposed=DISPATCHER_TOOL_PARAMETERS)
+# Opt-in response cache for dispatcher calls; LLM_CACHE_DB adds a persistent SQLite tier.
+llm_cache = LLMCache(
+    max_entries=int(os.environ.get('LLM_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('LLM_CACHE_TTL', 3600)),
+    db_path=os.environ.get('LLM_CACHE_DB'),
+) if os.environ.get('LLM_CACHE', '').lower() in ('1', 'true', 'yes') else None
+ADMIN_USERS = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
 
-db.init_app(app)
+# --- Flask Application Setup ---
+main_bp = Blueprint('main', __name__, cli_group=None)
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'index'
-app.register_blueprint(api_bp, url_prefix='/api')
+login_manager.login_view = 'main.index'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def create_app(config=None):
+    """
+    Builds the Flask app. Tools (with the sandbox pool), the system prompt, the Gemini
+    client and heavy libraries (numpy, pyarrow, requests) load on first use, so a worker
+    is ready to serve as soon as this returns.
+    """
+    app = Flask(__name__, template_folder='templates')
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a-default-secret-key-for-dev-only')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+    app.config['JOB_PER_USER_LIMIT'] = int(os.environ.get('JOB_PER_USER_LIMIT', 1))
+    app.config['JOB_MAX_QUEUED_PER_USER'] = int(os.environ.get('JOB_MAX_QUEUED_PER_USER', 10))
+    app.config.update(config or {})
+    if not os.environ.get('API_KEY'):
+        print("Warning: API_KEY is not set; agent requests will fail until it is.")
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(main_bp)
+    app.register_blueprint(api_bp, url_prefix='/api')
+    # Background runs use the same pipeline as /ask, minus token streaming.
+    job_queue.init_app(app, runner=lambda job: run_agent(job.prompt, job.conversation_id, user_id=job.user_id))
+    # Request, LLM, tool, DB and loop timings for /metrics; TRACE_LOG adds a JSON line per request.
+    instrumentation.init_app(app)
+    return app
+
+_app = None
+
+def __getattr__(name):
+    """`app` is created on first access, so `from app import app`, `flask run` and `gunicorn app:app` keep working."""
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
 # --- Standard Routes (Unchanged) ---
-@app.route('/')
+@main_bp.route('/')
 def index():
-    if current_user.is_authenticated: return redirect(url_for('chat'))
+    if current_user.is_authenticated: return redirect(url_for('main.chat'))
     return render_template('index.html')
 
-@app.route('/login', methods=['POST'])
+@main_bp.route('/login', methods=['POST'])
 def login():
     username = request.form.get('username')
     password = request.form.get('password')
     user = User.query.filter_by(username=username).first()
     if user and user.check_password(password):
         login_user(user)
-        return redirect(url_for('chat'))
+        return redirect(url_for('main.chat'))
     else:
         flash('Invalid username or password.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
-@app.route('/register', methods=['POST'])
+@main_bp.route('/register', methods=['POST'])
 def register():
     username = request.form.get('username')
     password = request.form.get('password')
     if User.query.filter_by(username=username).first():
         flash('Username already exists.', 'warning')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     new_user = User(username=username)
     new_user.set_password(password)
     db.session.add(new_user)
     db.session.commit()
     flash('Registration successful! Please log in.', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/logout')
+@main_bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/chat')
+@main_bp.route('/chat')
 @login_required
 def chat():
     return render_template('chat.html')
 
 # --- Core Agent Logic ---
 
-def call_agent_llm(prompt):
-    """Calls the Gemini API with the full, prioritized model list."""
-    for model in AGENT_MODELS:
-        api_url = GEMINI_API_URL_TEMPLATE.format(model=model, api_key=API_KEY)
-        payload = {"contents": [{"parts": [{"text": prompt}]}]}
-        headers = {'Content-Type': 'application/json'}
-        try:
-            print(f"Attempting to call model: {model}...")
-            response = requests.post(api_url, json=payload, headers=headers, timeout=40)
-            response.raise_for_status()
-            print(f"Success with model: {model}")
-            return response.json()['candidates'][0]['content']['parts'][0]['text'], model
-        except Exception as e:
-            print(f"Model {model} failed: {e}")
-    return None, None
+def build_payload(model, prompt, system_instruction=None, tools=None):
+    """
+    Builds a generateContent body. `prompt` is either a plain string or a multi-turn
+    `contents` list. The system instruction is sent via the cached-content API when
+    LLM_CONTEXT_CACHE is enabled and the model accepts it, and inline otherwise. With
+    TOOL_CALLING=native the tools (`tools`, else gemini_tools()) are also declared as
+    Gemini functionDeclarations.
+    """
+    contents = [{"role": "user", "parts": [{"text": prompt}]}] if isinstance(prompt, str) else prompt
+    payload = {"contents": contents}
+    tools = tools or gemini_tools()
+    if tools:
+        payload["tools"] = tools
+        payload["toolConfig"] = {"functionCallingConfig": {"mode": "AUTO"}}
+    if system_instruction:
+        # Cached content cannot be combined with request-level tools, so native tool calling sends the prompt inline.
+        cache_name = get_llm_client().cached_content(model, system_instruction) if LLM_CONTEXT_CACHE and not tools else None
+        if cache_name:
+            payload["cachedContent"] = cache_name
+        else:
+            payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    return payload
+
+def _prompt_chars(prompt, system_instruction):
+    """Prompt size for the LLM spans, counted without serialising the payload."""
+    if isinstance(prompt, str):
+        size = len(prompt)
+    else:
+        size = sum(len(part.get('text', '')) for content in prompt for part in content.get('parts', []))
+    return size + len(system_instruction or "")
 
-def autonomous_loop(initial_prompt: str, llm_caller: callable, system_prompt: str):
+def _cached_response(prompt, system_instruction):
+    """Returns (text, model) from the response cache for any currently usable model, or (None, None)."""
+    keys = {LLMCache.make_key(model, prompt, system_instruction): model for model in model_router.available_models()}
+    key, text = llm_cache.lookup(list(keys))
+    return (text, keys[key]) if key else (None, None)
+
+def _deadline():
+    return time.monotonic() + LLM_DEADLINE if LLM_DEADLINE > 0 else None
+
+def call_agent_llm(prompt, system_instruction=None, usage=None, use_cache=False, tools=None, user_id=None):
     """
-    NEW: This function contains the agent's internal reasoning loop.
-    It is invoked for complex tasks requiring multiple tool uses.
+    Calls the Gemini API, walking the model chain in the order the router currently prefers,
+    within LLM_DEADLINE seconds in total.
+    If a `usage` dict is passed it is filled with the answering response's usageMetadata.
+    With LLM_HEDGING, a losing request that also completes is charged to `user_id`'s
+    token budget (or only logged without one). `tools` replaces gemini_tools() as the
+    declared functions (see build_payload).
+    With use_cache (and LLM_CACHE enabled) identical requests are answered from the
+    response cache; tool loops leave it off because their turns are not repeatable.
     """
-    history = [f"User task: {initial_prompt}"]
-    response_events = []
-    max_turns = 7
+    use_cache = use_cache and llm_cache is not None
+    if use_cache:
+        text, model = _cached_response(prompt, system_instruction)
+        if text is not None:
+            return text, model
 
-    for turn in range(max_turns):
-        full_prompt = system_prompt + "\n\n**Internal Monologue History:**\n" + "\n".join(history)
-        
-        llm_response, model_used = llm_caller(full_prompt)
-        if not llm_response:
-            response_events.append({'type': 'error', 'content': 'Agent failed to respond during loop.'})
-            break
-
-        tool_match = re.search(r'<tool_code>(.*?)</tool_code>', llm_response, re.DOTALL)
-        
-        if tool_match:
-            thought = llm_response.split('<tool_code>')[0].strip()
-            if thought: response_events.append({'type': 'thought', 'content': thought})
-            
-            tool_call_str = tool_match.group(1).strip()
-            response_events.append({'type': 'tool_call', 'content': tool_call_str})
-            
-            try:
-                func_name = tool_call_str.split('(', 1)[0]
-                args_str = tool_call_str[len(func_name)+1:-1]
-                args = ast.literal_eval(f"({args_str},)") if args_str else ()
-                
-                tool_func = SUB_TOOL_REGISTRY.get(func_name)
-                if tool_func: tool_output = tool_func(*args)
-                else: tool_output = f"Error: Tool '{func_name}' not found."
-            except Exception as e:
-                tool_output = f"Error executing tool: {e}"
+    client = get_llm_client()
+    deadline = _deadline()
+    attempts = []
+    def attempt(model):
+        attempts.append(model)
+        with instrumentation.llm_span(model, len(attempts), 'generate', _prompt_chars(prompt, system_instruction)) as span:
+            response_json = client.generate(model, build_payload(model, prompt, system_instruction, tools), deadline)
+            text = tool_schema.response_text(response_json)
+            instrumentation.record_llm(span, len(text), response_json.get('usageMetadata', {}))
+        if not text:
+            # A blocked prompt or a MAX_TOKENS/SAFETY finish with no parts; let the next model try.
+            candidate = (response_json.get('candidates') or [{}])[0]
+            reason = candidate.get('finishReason') or response_json.get('promptFeedback', {}).get('blockReason')
+            raise ValueError(f"Empty response from model {model} (finish reason: {reason or 'unknown'})")
+        # Each attempt returns its own usage: with hedging two may run at once.
+        return text, response_json.get('usageMetadata', {})
+    def discarded(result, model):
+        prompt_tokens, response_tokens = result[1].get('promptTokenCount', 0), result[1].get('candidatesTokenCount', 0)
+        print(f"Discarded hedged reply from {model}: {prompt_tokens} prompt and {response_tokens} response tokens")
+        if user_id is not None:
+            rate_limit.limiter.charge(user_id, prompt_tokens, response_tokens)
+    try:
+        (text, response_usage), model = model_router.call(attempt, hedge=LLM_HEDGING, deadline=deadline,
+                                                          on_discarded=discarded)
+    except NoModelAvailable:
+        return None, None
+    if usage is not None:
+        usage.update(response_usage)
+    if use_cache and text:
+        llm_cache.set(LLMCache.make_key(model, prompt, system_instruction), text)
+    return text, model
 
-            response_events.append({'type': 'tool_output', 'content': str(tool_output)})
-            history.append(f"AI Thought: {llm_response}")
-            history.append(f"Tool Output: {tool_output}")
-        else:
-            response_events.append({'type': 'final_answer', 'content': llm_response, 'model_used': model_used})
-            break
-    else:
-        response_events.append({'type': 'error', 'content': 'Agent exceeded maximum turns.'})
+def stream_agent_llm(prompt, system_instruction=None, usage=None, use_cache=False, tools=None):
+    """
+    Streams a Gemini response via streamGenerateContent, yielding (text_chunk, model) tuples.
+    Falls back through the model chain like call_agent_llm, but only while nothing has been
+    yielded yet; a model that fails mid-stream ends the response with what was received.
+    A cached response is yielded as a single chunk.
+    """
+    use_cache = use_cache and llm_cache is not None
+    if use_cache:
+        text, model = _cached_response(prompt, system_instruction)
+        if text is not None:
+            yield text, model
+            return
 
-    return response_events
+    client = get_llm_client()
+    prompt_chars = _prompt_chars(prompt, system_instruction)
+    deadline = _deadline()
+    for attempt, model in enumerate(model_router.available_models(), start=1):
+        if deadline is not None and time.monotonic() >= deadline:
+            print("LLM deadline passed; not trying further models.")
+            return
+        started = time.monotonic()
+        chunks, chunk_usage = [], {}
+        try:
+            print(f"Attempting to stream model: {model}...")
+            with instrumentation.llm_span(model, attempt, 'stream', prompt_chars) as span:
+                for chunk in client.stream(model, build_payload(model, prompt, system_instruction, tools), deadline):
+                    if 'usageMetadata' in chunk:
+                        chunk_usage.update(chunk['usageMetadata'])
+                    text = tool_schema.response_text(chunk)
+                    if text:
+                        if not chunks:
+                            model_router.record_success(model, time.monotonic() - started)
+                        chunks.append(text)
+                        yield text, model
+                instrumentation.record_llm(span, sum(len(chunk) for chunk in chunks), chunk_usage)
+            if usage is not None:
+                usage.update(chunk_usage)
+            if chunks:
+                print(f"Success with model: {model}")
+                if use_cache:
+                    llm_cache.set(LLMCache.make_key(model, prompt, system_instruction), "".join(chunks))
+                return
+            model_router.record_failure(model, error="Empty response")
+        except Exception as e:
+            print(f"Model {model} failed: {e}")
+            if chunks:
+                return
+            model_router.record_failure(model, getattr(e, 'status_code', None), e)
 
-@app.route('/ask', methods=['POST'])
-@login_required
-def ask():
+def start_conversation(user_id, prompt, conversation_id=None):
     """
-    MODIFIED: This route is now a high-level dispatcher.
-    It makes one LLM call to decide if a task is simple or needs the autonomous loop.
+    Creates the conversation if needed, stores the user's message and returns the conversation id.
+    Both rows go in one transaction; a flush assigns the new conversation's id.
     """
-    data = request.json
-    prompt = data.get('prompt')
-    conversation_id = data.get('conversation_id')
-    
     if not conversation_id:
         title = (prompt[:35] + '...') if len(prompt) > 35 else prompt
-        new_conv = Conversation(user_id=current_user.id, title=title)
+        new_conv = Conversation(user_id=user_id, title=title)
         db.session.add(new_conv)
-        db.session.commit()
+        db.session.flush()
         conversation_id = new_conv.id
     
     user_message = Message(conversation_id=conversation_id, sender='user', content=prompt)
     db.session.add(user_message)
     db.session.commit()
+    return conversation_id
 
-    full_prompt = SYSTEM_PROMPT + f"\n\n**User Request:**\n{prompt}"
-    
-    llm_response, model_used = call_agent_llm(full_prompt)
-    if not llm_response:
-        return jsonify({'events': [{'type': 'error', 'content': 'Agent dispatcher failed.'}]}), 500
+def run_agent(prompt, conversation_id, stream_tokens=False, user_id=None):
+    """
+    Runs one user request and yields events as soon as they are produced.
+    The dispatcher makes one LLM call to decide if a task is simple or needs the autonomous
+    loop; the AI's reply is persisted at the end. With stream_tokens, raw LLM output is also
+    yielded as 'token' events. DISPATCH_MODE (see fast_router) can skip the dispatcher call
+    for clearly multi-step tasks, or reuse a dispatcher reply that already calls tools as
+    the loop's first turn.
+    """
+    import tools
+    llm_response, model_used, first_turn = None, None, None
+    if user_id is None:
+        user_id = db.session.get(Conversation, conversation_id).user_id
+    rate_limit.limiter.charge(user_id, runs=1)
+    if fast_router.route(prompt) == 'loop':
+        fast_router.record('local', 'loop', 'local_route', model_router.typical_latency())
+        start_loop = True
+    else:
+        full_prompt = dispatcher_prompt() + f"\n\n**User Request:**\n{prompt}"
+        usage = {}
+        try:
+            if stream_tokens:
+                chunks = []
+                for chunk, model_used in stream_agent_llm(full_prompt, usage=usage, use_cache=True):
+                    chunks.append(chunk)
+                    yield {'type': 'token', 'content': chunk}
+                llm_response = "".join(chunks)
+            else:
+                llm_response, model_used = call_agent_llm(full_prompt, usage=usage, use_cache=True, user_id=user_id)
+        except Exception as e:
+            db.session.rollback()
+            yield {'type': 'error', 'content': f"Agent dispatcher failed: {e}", 'fatal': True}
+            return
+        # Cached replies report no usage and cost nothing.
+        rate_limit.limiter.charge(user_id, usage.get('promptTokenCount', 0), usage.get('candidatesTokenCount', 0))
+        if not llm_response:
+            yield {'type': 'error', 'content': 'Agent dispatcher failed.', 'fatal': True}
+            return
 
-    tool_match = re.search(r'<tool_code>(.*?)</tool_code>', llm_response, re.DOTALL)
-    response_events = []
+        tool_names = [call.name for call in tool_schema.extract_calls(llm_response, count=False)[0]]
+        start_loop = True
+        if tool_names[:1] == ['autonomous_loop']:
+            fast_router.record('llm', 'loop')
+        elif fast_router.REUSE_DISPATCH and tool_names and all(name in tools.SUB_TOOL_REGISTRY for name in tool_names):
+            # The dispatcher already started on the tools; its reply is the loop's first turn.
+            first_turn = llm_response
+            fast_router.record('llm', 'loop', 'reused_dispatch', model_router.typical_latency())
+        else:
+            start_loop = False
+            fast_router.record('llm', 'direct')
 
-    if tool_match and 'autonomous_loop' in tool_match.group(1):
+    if start_loop:
         # LLM decided the task is complex. Delegate to the autonomous loop.
+        # The AI message is inserted with the first turn's trace, which references it.
+        ai_message = Message(conversation_id=conversation_id, sender='ai', content="", model_used=model_used)
+        db.session.add(ai_message)
+        trace = TraceRecorder(ai_message)
+        yield {'type': 'loop_start'}
+        # Tools run in this context (and copies of it): it picks the conversation's workspace,
+        # and e.g. lets execute_python keep a per-conversation session.
+        tools.TOOL_CONTEXT.set({'user_id': user_id, 'conversation_id': conversation_id})
+        final_answer = "Loop finished."
+        turns, outcome = 0, 'error'
+        # The run keeps its workspace from being reaped, by any process, until it ends.
+        with instrumentation.span('loop') as loop_span, workspaces.get(user_id, conversation_id).in_use():
+            try:
+                for event in tools.autonomous_loop(
+                    initial_prompt=prompt, 
+                    llm_caller=functools.partial(call_agent_llm, tools=gemini_tools(loop=True), user_id=user_id),
+                    system_prompt=system_prompt(),
+                    llm_streamer=functools.partial(stream_agent_llm, tools=gemini_tools(loop=True)) if stream_tokens else None,
+                    first_response=first_turn,
+                    first_model=model_used
+                ):
+                    if event['type'] == 'final_answer':
+                        final_answer = event['content']
+                        outcome = 'answered'
+                    elif event['type'] == 'usage':
+                        turns = event['turn']
+                        ai_message.model_used = ai_message.model_used or event['model_used']
+                        # A reused dispatcher reply was charged as the dispatcher call.
+                        balance = rate_limit.limiter.charge(
+                            user_id, 0 if event['reused'] else event['prompt_tokens'],
+                            0 if event['reused'] else event['response_tokens'], turns=1)
+                    trace.add(event)
+                    yield event
+                    if event['type'] == 'usage' and balance <= 0:
+                        # Out of LLM tokens: stop before the next turn rather than overdraw further.
+                        final_answer = "Stopped: the LLM token budget for your account is used up."
+                        outcome = 'budget'
+                        error = {'type': 'error', 'content': final_answer}
+                        trace.add(error)
+                        yield error
+                        break
+                ai_message.content = final_answer
+            except Exception as e:
+                _rollback_keeping(ai_message, content=f"Error: {e}")
+                yield {'type': 'error', 'content': f"Failed to execute loop: {e}"}
+                trace.add({'type': 'error', 'content': f"Failed to execute loop: {e}"})
+            instrumentation.record_loop(loop_span, turns, outcome)
         try:
-            loop_events = autonomous_loop(
-                initial_prompt=prompt, 
-                llm_caller=call_agent_llm, 
-                system_prompt=SYSTEM_PROMPT
-            )
-            response_events.append({'type': 'loop_event', 'content': loop_events})
-            final_answer = next((e['content'] for e in loop_events if e['type'] == 'final_answer'), "Loop finished.")
-            ai_message = Message(conversation_id=conversation_id, sender='ai', content=final_answer, model_used=model_used)
+            trace.flush()
         except Exception as e:
-            response_events.append({'type': 'error', 'content': f"Failed to execute loop: {e}"})
-            ai_message = Message(conversation_id=conversation_id, sender='ai', content=f"Error: {e}", model_used=model_used)
+            # The reply matters more than its trace: save the message without it.
+            print(f"Failed to save the loop trace: {e}")
+            _rollback_keeping(ai_message, content=ai_message.content)
+        yield {'type': 'loop_end', 'message_id': ai_message.id}
     else:
         # LLM decided the task is simple. Return the direct answer.
-        response_events.append({'type': 'final_answer', 'content': llm_response})
+        yield {'type': 'final_answer', 'content': llm_response, 'model_used': model_used}
         ai_message = Message(conversation_id=conversation_id, sender='ai', content=llm_response, model_used=model_used)
+        db.session.add(ai_message)
 
-    db.session.add(ai_message)
     db.session.commit()
-        
-    return jsonify({'events': response_events, 'conversation_id': conversation_id})
+
+def _rollback_keeping(message, **values):
+    """
+    Rolls the session back but keeps `message` in it with `values` set, so the reply is
+    still saved: a rollback expunges a message that was still pending and expires one
+    that was already inserted.
+    """
+    db.session.rollback()
+    if message not in db.session:
+        db.session.add(message)
+    for name, value in values.items():
+        setattr(message, name, value)
+
+def _sse(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+@main_bp.route('/ask', methods=['POST'])
+@login_required
+def ask():
+    """
+    Runs the agent for a prompt. With {"stream": true} in the body (or an
+    'Accept: text/event-stream' header) events are pushed as Server-Sent Events
+    while they are produced; otherwise they are collected into one JSON reply.
+    With {"background": true} the run is queued and a job id returned at once;
+    progress is then available from /api/jobs/<id>.
+    """
+    data = request.json
+    prompt = data.get('prompt')
+    conversation_id = data.get('conversation_id')
+    stream = data.get('stream') or request.accept_mimetypes.best == 'text/event-stream'
+    user_id = current_user.id
+    try:
+        rate_limit.limiter.check_request(user_id)
+        # Background runs are paced by the job queue's workers instead.
+        slot = None if data.get('background') else rate_limit.admission.acquire()
+    except rate_limit.RateLimited as e:
+        return _rate_limited(e)
+
+    if slot is None:
+        conversation_id = start_conversation(user_id, prompt, conversation_id)
+        job = job_queue.enqueue(user_id, conversation_id, prompt)
+        if job is None:
+            return jsonify({'error': 'Too many queued jobs.', 'conversation_id': conversation_id}), 429
+        return jsonify({'job_id': job.id, 'conversation_id': conversation_id, 'status': job.status}), 202
+
+    streaming = False
+    try:
+        conversation_id = start_conversation(user_id, prompt, conversation_id)
+        if stream:
+            def generate():
+                yield _sse({'type': 'conversation', 'conversation_id': conversation_id})
+                for event in run_agent(prompt, conversation_id, stream_tokens=True, user_id=user_id):
+                    yield _sse(event)
+                yield _sse({'type': 'done'})
+            response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+            # The slot is held until the stream ends or the client goes away.
+            response.call_on_close(slot.release)
+            streaming = True
+            return response
+
+        response_events = []
+        loop_events = None
+        for event in run_agent(prompt, conversation_id, user_id=user_id):
+            if event.get('fatal'):
+                return jsonify({'events': [{'type': 'error', 'content': event['content']}]}), 500
+            elif event['type'] == 'loop_start':
+                loop_events = []
+                response_events.append({'type': 'loop_event', 'content': loop_events})
+            elif event['type'] == 'loop_end':
+                loop_events = None
+            elif event['type'] == 'tool_progress':
+                continue  # live output is only useful while streaming
+            elif loop_events is not None:
+                loop_events.append(event)
+            else:
+                response_events.append(event)
+
+        return jsonify({'events': response_events, 'conversation_id': conversation_id})
+    finally:
+        if not streaming:
+            slot.release()
+
+def _rate_limited(error):
+    """A 429 (per-user limit) or 503 (server busy) reply with a Retry-After header."""
+    response = jsonify({'error': str(error), 'reason': error.reason, 'retry_after': error.retry_after})
+    response.status_code = error.status_code
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+# --- Admin Routes ---
+@main_bp.route('/admin/models')
+@login_required
+def model_health():
+    """Exposes the model router's health stats and current fallback order."""
+    if ADMIN_USERS and current_user.username not in ADMIN_USERS:
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(model_router.snapshot())
+
+@main_bp.route('/admin/cache')
+@login_required
+def cache_stats():
+    """Hit/miss counters for the LLM response cache and the memoised file tools."""
+    if ADMIN_USERS and current_user.username not in ADMIN_USERS:
+        return jsonify({'error': 'Forbidden'}), 403
+    import tools
+    return jsonify({
+        'llm': llm_cache.stats() if llm_cache is not None else {'enabled': False},
+        'tools': {name: tools.SUB_TOOL_REGISTRY[name].cache.stats() for name in ('read_file', 'list_directory')},
+    })
+
+@main_bp.route('/admin/usage')
+@login_required
+def usage_stats():
+    """Per-user request and LLM token counters (heaviest users first) and agent run admission."""
+    if ADMIN_USERS and current_user.username not in ADMIN_USERS:
+        return jsonify({'error': 'Forbidden'}), 403
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    return jsonify({'users': rate_limit.limiter.store.top_usage(limit), 'admission': rate_limit.admission.snapshot()})
+
+@main_bp.route('/metrics')
+def metrics():
+    """Prometheus metrics. Open to scrapers unless METRICS_TOKEN is set, then a bearer token is required."""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return jsonify({'error': 'Forbidden'}), 403
+    return Response(instrumentation.render_metrics(), mimetype='text/plain; version=0.0.4')
 
 # --- Database Command ---
-@app.cli.command("init-db")
+@main_bp.cli.command("init-db")
 def init_db_command():
     db.create_all()
+    # create_all() skips tables that already exist, so add any indexes they are missing.
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    message_search.install(db.engine)
     click.echo("Initialized the database.")
 
+@main_bp.cli.command("migrate-todos")
+def migrate_todos_command():
+    """Imports every workspace's legacy tasks.json into the task store."""
+    store = task_store.get_store()
+    paths = [workspaces.SHARED_WORKSPACE] + workspaces.all_paths()
+    imported = sum(store.migrate_json(workspaces.scope_of(path), os.path.join(path, "tasks.json")) for path in paths)
+    click.echo(f"Migrated {imported} todos from {len(paths)} workspaces.")
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,90 @@
+"""
+Benchmark of analyze_data's analysis engine against the old line-split approach.
+
+A CSV with --rows rows (numeric and text columns) is generated in a temporary
+directory. The script then times:
+  - line_split: the old analyze_data approach (read(), split('\n'), split()), plus a
+    per-line split(',') pass computing a per-group mean, the kind of ad-hoc code the
+    agent used to write through execute_python.
+  - engine_cold: parse plus profile and group-by with analysis_engine.
+  - engine_warm: the same questions again, answered from the parsed-table cache.
+
+    python benchmarks/bench_analysis.py --rows 1000000
+
+Results are printed as JSON.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import analysis_engine
+
+def _write_csv(path, rows):
+    regions = ["north", "south", "east", "west", "central"]
+    rng = random.Random(42)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("id,region,units,price,discount\n")
+        for index in range(rows):
+            discount = "" if index % 17 == 0 else f"{rng.random() * 0.3:.3f}"
+            f.write(f"{index},{regions[index % 5]},{rng.randint(1, 500)},{rng.random() * 100:.2f},{discount}\n")
+
+def _line_split(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    lines = content.split('\n')
+    summary = (len(lines), len(content), len(content.split()))
+    totals, counts = {}, {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        fields = line.split(',')
+        totals[fields[1]] = totals.get(fields[1], 0.0) + float(fields[3])
+        counts[fields[1]] = counts.get(fields[1], 0) + 1
+    return summary, {key: totals[key] / counts[key] for key in totals}
+
+def _engine(path):
+    table = analysis_engine.load_table(path)
+    return analysis_engine.profile(table), analysis_engine.group_by(table, 'region', 'price', 'mean')
+
+def _measure(func, path, reset=None):
+    """Times one run, then repeats it under tracemalloc (which slows Python code down) for peak memory."""
+    if reset:
+        reset()
+    started = time.perf_counter()
+    func(path)
+    elapsed = time.perf_counter() - started
+    if reset:
+        reset()
+    tracemalloc.start()
+    func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(elapsed, 3), 'peak_mb': round(peak / 1024 / 1024, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'data.csv')
+        _write_csv(path, args.rows)
+        result = {
+            'rows': args.rows,
+            'file_mb': round(os.path.getsize(path) / 1024 / 1024, 1),
+            'pyarrow': analysis_engine.pyarrow is not None,
+            'line_split': _measure(_line_split, path),
+            'engine_cold': _measure(_engine, path, reset=analysis_engine._tables.clear),
+            'engine_warm': _measure(_engine, path),
+        }
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark and check of web_fetch against a local HTTP server.
+
+The server serves article pages padded with <head> boilerplate, navigation and scripts
+(with ETag and Last-Modified, and 304 replies to conditional requests), one very large
+page and pages behind a fixed latency. The benchmark times:
+
+  - the old fetch_url (requests.get, first 2000 characters of the raw body) against a
+    cold web_fetch.fetch, and how much of each result is article text;
+  - a fresh cache hit and a revalidation (304) of the same page;
+  - the large page, which web_fetch stops downloading at FETCH_MAX_BYTES;
+  - --batch slow pages fetched one after another and with fetch_many.
+
+    python benchmarks/bench_fetch.py --batch 8 --latency-ms 200
+
+Results are printed as JSON (milliseconds).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+ARTICLE_WORD = "insight"
+ARTICLE = "<main><h1>Findings</h1>" + "".join(
+    f"<p>Paragraph {index}: the {ARTICLE_WORD} here is the part of the page a reader wants.</p>" for index in range(200)
+) + "</main>"
+BOILERPLATE = ("<head><title>Findings</title>" + "<meta name='x' content='y'>" * 40
+               + "<style>" + "body{margin:0}" * 400 + "</style><script>" + "var a=1;" * 2000 + "</script></head>")
+PAGE = f"<!doctype html><html>{BOILERPLATE}<body><nav>{'<a href=/>Home</a>' * 100}</nav>{ARTICLE}" \
+       f"<footer>{'Copyright ' * 50}</footer></body></html>".encode()
+LAST_MODIFIED = formatdate(usegmt=True)
+
+def _handler(settings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            settings['requests'] += 1
+            if self.path.startswith('/slow'):
+                time.sleep(settings['latency'])
+            if self.path.startswith('/large'):
+                body = PAGE * settings['large_copies']
+            else:
+                body = PAGE
+            etag = f'"{len(body)}"'
+            if self.headers.get('If-None-Match') == etag:
+                settings['not_modified'] += 1
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', LAST_MODIFIED)
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client stopped reading at its byte cap
+
+    return Handler
+
+def _ms(func):
+    started = time.perf_counter()
+    result = func()
+    return round((time.perf_counter() - started) * 1000, 2), result
+
+def _content_share(text):
+    """Fraction of the text made up of article paragraphs."""
+    article = sum(len(line) for line in text.splitlines() if ARTICLE_WORD in line)
+    return round(article / max(1, len(text)), 3)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=8, help="slow pages to fetch sequentially and in parallel")
+    parser.add_argument('--latency-ms', type=float, default=200, help="server latency of the slow pages")
+    parser.add_argument('--large-mb', type=float, default=20, help="approximate size of the large page")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_fetch_')
+    os.environ['FETCH_CACHE_DB'] = os.path.join(directory, 'fetch-cache.db')
+    import requests
+    import web_fetch
+
+    settings = {'latency': args.latency_ms / 1000, 'requests': 0, 'not_modified': 0,
+                'large_copies': max(1, int(args.large_mb * 2**20 / len(PAGE)))}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(settings))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    results = {}
+
+    legacy_ms, legacy = _ms(lambda: requests.get(f"{base}/article", timeout=10).text[:2000])
+    cold_ms, page = _ms(lambda: web_fetch.fetch(f"{base}/article"))
+    results['single_page'] = {
+        'legacy_ms': legacy_ms, 'legacy_content_share': _content_share(legacy),
+        'cold_ms': cold_ms, 'content_share': _content_share(page.text[:2000]),
+        'downloaded_bytes': page.size, 'text_chars': len(page.text),
+    }
+
+    hit_ms, page = _ms(lambda: web_fetch.fetch(f"{base}/article"))
+    assert page.source == 'cached', page.source
+    web_fetch.FETCH_CACHE_TTL = 0
+    web_fetch.get_cache().refresh(f"{base}/article", 0)
+    revalidate_ms, page = _ms(lambda: web_fetch.fetch(f"{base}/article"))
+    assert page.source == 'revalidated' and settings['not_modified'] == 1, page.source
+    results['cache'] = {'fresh_hit_ms': hit_ms, 'revalidated_ms': revalidate_ms}
+
+    large_bytes = len(PAGE) * settings['large_copies']
+    legacy_large_ms, _ = _ms(lambda: requests.get(f"{base}/large", timeout=60).text[:2000])
+    large_ms, page = _ms(lambda: web_fetch.fetch(f"{base}/large", use_cache=False))
+    assert page.truncated and page.size <= web_fetch.FETCH_MAX_BYTES
+    results['large_page'] = {'page_bytes': large_bytes, 'legacy_ms': legacy_large_ms,
+                             'capped_ms': large_ms, 'downloaded_bytes': page.size}
+
+    urls = [f"{base}/slow/{index}" for index in range(args.batch)]
+    sequential_ms, _ = _ms(lambda: [web_fetch.fetch(url, use_cache=False) for url in urls])
+    parallel_ms, pages = _ms(lambda: web_fetch.fetch_many(urls, use_cache=False))
+    assert all(isinstance(result, web_fetch.Page) for _, result in pages)
+    results['batch'] = {'pages': args.batch, 'latency_ms': args.latency_ms,
+                        'sequential_ms': sequential_ms, 'fetch_many_ms': parallel_ms}
+
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
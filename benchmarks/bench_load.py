@@ -0,0 +1,237 @@
+"""
+Offline load test of the Flask app against the stub Gemini server (stub_gemini.py).
+
+The app is imported with API_KEY and GEMINI_API_BASE pointing at an in-process stub
+and a fresh SQLite database in a temporary directory. --concurrency virtual users,
+each with its own logged-in test client, then run every scenario in turn:
+  - ask:        POST /ask answered directly by the dispatcher (one LLM call)
+  - ask_stream: the same over Server-Sent Events (streamGenerateContent)
+  - loop:       POST /ask that the dispatcher hands to autonomous_loop; the stub's
+                script makes it run tool calls over several turns. --dispatch-mode
+                sets the app's DISPATCH_MODE, to measure the dispatch shortcuts
+  - history:    GET /api/history
+
+    python benchmarks/bench_load.py --concurrency 8 --requests 50 --latency-ms 200
+    python benchmarks/bench_load.py --output after.json --compare before.json
+
+Each scenario reports p50/p95/p99 latency (ms), requests/s, errors, SQL statements and
+stub LLM calls per request, and process RSS. Results are JSON, tagged with the git
+commit, so runs can be compared across commits (--compare prints the deltas).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stub_gemini
+
+SCENARIOS = ('ask', 'ask_stream', 'loop', 'history')
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024, 1)
+    except (OSError, ValueError, AttributeError):
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+class QueryCounter:
+    """Counts SQL statements executed on an engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+def _request(client, scenario, index):
+    """Issues one scenario request; returns True if it succeeded."""
+    if scenario == 'history':
+        return client.get('/api/history?limit=20').status_code == 200
+    if scenario == 'ask_stream':
+        # Closing the response ends the stream the way a WSGI server does when the client is done.
+        with client.post('/ask', json={'prompt': f"What is the answer to benchmark question {index}?", 'stream': True}) as response:
+            body = response.get_data(as_text=True)
+        return response.status_code == 200 and '"final_answer"' in body
+    if scenario == 'loop':
+        prompt = f"{stub_gemini.LOOP_MARKER} Read notes.txt and then write a summary of it to summary.md ({index})"
+    else:
+        prompt = f"What is the answer to benchmark question {index}?"
+    response = client.post('/ask', json={'prompt': prompt})
+    if response.status_code != 200:
+        return False
+    events = response.get_json()['events']
+    if scenario == 'loop':
+        return any(event['type'] == 'loop_event' and any(inner['type'] == 'final_answer' for inner in event['content'])
+                   for event in events)
+    return any(event['type'] == 'final_answer' for event in events)
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))] * 1000, 2)
+
+def run_scenario(scenario, clients, requests_per_user, queries, stub):
+    queries_before, llm_before = queries.count, stub.stats()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def user(args):
+        nonlocal errors
+        user_index, client = args
+        for index in range(requests_per_user):
+            started = time.perf_counter()
+            try:
+                ok = _request(client, scenario, user_index * requests_per_user + index)
+            except Exception as e:
+                print(f"{scenario} request failed: {e}", file=sys.stderr)
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        list(executor.map(user, enumerate(clients)))
+    elapsed = time.perf_counter() - started
+
+    total = len(clients) * requests_per_user
+    llm_after = stub.stats()
+    latencies.sort()
+    return {
+        'scenario': scenario,
+        'requests': total,
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+        'requests_per_s': round(total / elapsed, 1),
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'p99_ms': _percentile(latencies, 99),
+        'sql_per_request': round((queries.count - queries_before) / total, 1),
+        'llm_calls_per_request': round(sum(llm_after[key] - llm_before[key] for key in ('generate', 'stream')) / total, 2),
+        'llm_failures': llm_after['failed'] - llm_before['failed'],
+        'rss_mb': _rss_mb(),
+    }
+
+def compare(current, previous):
+    """Prints the change in latency and throughput per scenario against an earlier result file."""
+    before = {entry['scenario']: entry for entry in previous['scenarios']}
+    print(f"Compared with {previous.get('commit') or 'previous run'}:", file=sys.stderr)
+    for entry in current['scenarios']:
+        old = before.get(entry['scenario'])
+        if not old:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_s', 'sql_per_request'):
+            if old.get(key) and entry.get(key) is not None:
+                changes.append(f"{key} {old[key]} -> {entry[key]} ({(entry[key] - old[key]) / old[key] * 100:+.1f}%)")
+        print(f"  {entry['scenario']}: " + ", ".join(changes), file=sys.stderr)
+
+def run(args, scenarios):
+    server, stub, base_url = stub_gemini.start(**stub_gemini.settings_from_args(args))
+    directory = tempfile.mkdtemp(prefix='bench_load_')
+    os.environ.update({
+        'API_KEY': 'stub',
+        'GEMINI_API_BASE': base_url,
+        'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+        'WORKSPACES_ROOT': os.path.join(directory, 'workspaces'),
+        'DISPATCH_MODE': args.dispatch_mode,
+        'JOB_WORKERS': '0',  # no background jobs in these scenarios
+        # Virtual users send far more than a person would; per-user limits would only measure the limiter.
+        'ASK_RATE_PER_MINUTE': '0',
+        'TOKEN_BUDGET_PER_HOUR': '0',
+    })
+    os.chdir(ROOT)  # the app reads prompt.md and the workspace relative to the working directory
+
+    started = time.perf_counter()
+    from app import app
+    from models import db, User
+    import_seconds = time.perf_counter() - started
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        for index in range(args.concurrency):
+            user = User(username=f"bench{index}")
+            user.set_password('bench')
+            db.session.add(user)
+        db.session.commit()
+        queries = QueryCounter(db.engine)
+
+    clients = []
+    for index in range(args.concurrency):
+        client = app.test_client()
+        client.post('/login', data={'username': f"bench{index}", 'password': 'bench'})
+        clients.append(client)
+
+    result = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'concurrency': args.concurrency,
+        'requests_per_user': args.requests,
+        'dispatch_mode': args.dispatch_mode,
+        'stub': {'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'failure_rate': args.failure_rate},
+        'app_import_seconds': round(import_seconds, 2),
+        'scenarios': [run_scenario(scenario, clients, args.requests, queries, stub) for scenario in scenarios],
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None,
+    }
+    server.shutdown()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=8, help="virtual users running in parallel")
+    parser.add_argument('--requests', type=int, default=25, help="requests per virtual user and scenario")
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS))
+    parser.add_argument('--output', help="also write the JSON result to this file")
+    parser.add_argument('--compare', help="an earlier result file to print deltas against")
+    parser.add_argument('--dispatch-mode', default=os.environ.get('DISPATCH_MODE', 'llm'),
+                        help="the app's DISPATCH_MODE: llm, local, reuse or a combination such as local,reuse")
+    stub_gemini.add_arguments(parser)
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    # The app logs with print(); send that to stderr so stdout carries only the JSON result.
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run(args, scenarios)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
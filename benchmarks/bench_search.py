@@ -0,0 +1,109 @@
+"""
+Benchmark of /api/search's full-text query against a LIKE scan.
+
+Fills a temporary SQLite database with --messages messages spread over --users users
+(Zipf-distributed words, so there are very common and very rare terms). The inserts go
+through the FTS5 triggers, as in production. It then times message_search.search() for
+random users with rare, common, multi-word and prefix queries, plus one LIKE '%term%'
+scan for comparison.
+
+    python benchmarks/bench_search.py --messages 2000000 --users 200
+
+Results are printed as JSON (milliseconds).
+"""
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def _make_app(uri):
+    from flask import Flask
+    from models import db
+    from db_config import engine_options
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    return app
+
+def _fill(db, messages, users, vocabulary, rng):
+    from models import User, Conversation, Message
+    import message_search
+    message_search.install(db.engine)
+    db.session.add_all(User(username=f"user{index}", password_hash="x") for index in range(users))
+    db.session.commit()
+    conversations_per_user = 20
+    db.session.execute(Conversation.__table__.insert(), [
+        {'user_id': user_id, 'title': f"conversation {index}"}
+        for user_id in range(1, users + 1) for index in range(conversations_per_user)])
+    db.session.commit()
+    cumulative = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    conversation_count = users * conversations_per_user
+    batch = 20_000
+    for start in range(0, messages, batch):
+        rows = []
+        for _ in range(min(batch, messages - start)):
+            words = rng.choices(vocabulary, cum_weights=cumulative, k=rng.randint(8, 60))
+            rows.append({'conversation_id': rng.randint(1, conversation_count), 'sender': rng.choice(('user', 'ai')),
+                         'content': " ".join(words)})
+        db.session.execute(Message.__table__.insert(), rows)
+        db.session.commit()
+
+def _time(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {'p50': round(statistics.median(timings), 2), 'p95': round(timings[int(len(timings) * 0.95) - 1], 2),
+            'max': round(timings[-1], 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    vocabulary = [f"w{index}" for index in range(20_000)]
+    with tempfile.TemporaryDirectory() as directory:
+        uri = f"sqlite:///{os.path.join(directory, 'search.db')}"
+        app = _make_app(uri)
+        from models import db
+        import message_search
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            _fill(db, args.messages, args.users, vocabulary, rng)
+            fill_seconds = time.perf_counter() - started
+
+            def query(text):
+                return lambda: message_search.search(db.session, rng.randint(1, args.users), text, limit=20)
+
+            result = {
+                'messages': args.messages,
+                'users': args.users,
+                'fill_seconds': round(fill_seconds, 1),
+                'db_mb': round(os.path.getsize(os.path.join(directory, 'search.db')) / 1024 / 1024, 1),
+                'fts_common_term': _time(query("w1"), args.repeats),
+                'fts_rare_term': _time(query("w15000"), args.repeats),
+                'fts_two_terms': _time(query("w3 w40"), args.repeats),
+                'fts_prefix': _time(query("w12"), args.repeats),
+                'like_scan': _time(lambda: db.session.execute(db.text(
+                    "SELECT message.id FROM message JOIN conversation ON conversation.id = message.conversation_id "
+                    "WHERE conversation.user_id = :user AND message.content LIKE '%w15000%' LIMIT 20"),
+                    {'user': rng.randint(1, args.users)}).all(), max(3, args.repeats // 10)),
+            }
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Cold-start benchmark: how long a fresh worker process takes to import the app, build it
+and answer its first request, plus a `python -X importtime` breakdown of where the
+import time goes.
+
+Each run starts a new interpreter with API_KEY set to a dummy value and a SQLite
+database in a temporary directory, so nothing is cached in-process between runs:
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --output after.json --compare before.json
+    python benchmarks/bench_startup.py --max-import-ms 600   # exits 1 over budget, for CI
+
+The report gives the median and worst of each phase (import, create_app, first request,
+whole process), the modules with the largest cumulative import time, and which heavy
+optional libraries (numpy, pyarrow, requests) and agent modules (tools, sandbox) were
+loaded by start-up. Results are JSON, tagged with the git commit.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+HEAVY_MODULES = ('numpy', 'pyarrow', 'requests', 'analysis_engine', 'llm_client', 'tools', 'sandbox')
+
+# Runs inside the measured interpreter; prints one JSON line with its phase timings.
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+application = module.create_app()
+created = time.perf_counter()
+response = application.test_client().get('/')
+answered = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (answered - created) * 1000,
+    'status': response.status_code,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def parse_importtime(stderr):
+    """{module: (self_us, cumulative_us)} from `-X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+def run_once(directory):
+    env = {**os.environ, 'API_KEY': 'stub', 'JOB_WORKERS': '0',
+           'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'startup.db')}",
+           'WORKSPACES_ROOT': os.path.join(directory, 'workspaces')}
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+                             capture_output=True, text=True, timeout=120)
+    wall_ms = (time.perf_counter() - started) * 1000
+    lines = [line for line in process.stdout.splitlines() if line.startswith('{')]
+    if process.returncode != 0 or not lines:
+        raise RuntimeError(f"start-up run failed:\n{process.stderr[-2000:]}")
+    return {**json.loads(lines[-1]), 'process_ms': wall_ms}, parse_importtime(process.stderr)
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix='bench_startup_')
+    runs, imports = [], []
+    for _ in range(args.runs):
+        result, modules = run_once(directory)
+        runs.append(result)
+        imports.append(modules)
+
+    phases = {}
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms'):
+        values = [result[key] for result in runs]
+        phases[key] = {'median': round(statistics.median(values), 1), 'max': round(max(values), 1)}
+    # Median cumulative time per module across runs; only modules imported by every run.
+    names = set.intersection(*(set(modules) for modules in imports))
+    cumulative = {name: statistics.median(modules[name][1] for modules in imports) / 1000 for name in names}
+    self_time = {name: statistics.median(modules[name][0] for modules in imports) / 1000 for name in names}
+    top = sorted(cumulative, key=cumulative.get, reverse=True)[:args.top]
+    return {
+        'commit': _git_commit(),
+        'runs': args.runs,
+        'python': sys.version.split()[0],
+        'phases': phases,
+        'loaded_heavy_modules': runs[-1]['loaded'],
+        'top_imports': [{'module': name, 'cumulative_ms': round(cumulative[name], 1),
+                         'self_ms': round(self_time[name], 1)} for name in top],
+    }
+
+def compare(current, previous):
+    """Prints the change in each phase's median against an earlier result file."""
+    print(f"Compared with {previous.get('commit') or 'previous run'}:", file=sys.stderr)
+    for key, value in current['phases'].items():
+        old = previous.get('phases', {}).get(key)
+        if old and old['median']:
+            change = (value['median'] - old['median']) / old['median'] * 100
+            print(f"  {key}: {old['median']} -> {value['median']} ({change:+.1f}%)", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument('--top', type=int, default=15, help="modules to list by cumulative import time")
+    parser.add_argument('--output', help="also write the JSON result to this file")
+    parser.add_argument('--compare', help="an earlier --output file to compare against")
+    parser.add_argument('--max-import-ms', type=float, help="exit with status 1 if the median import time is higher")
+    args = parser.parse_args()
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
+    if args.max_import_ms is not None and result['phases']['import_ms']['median'] > args.max_import_ms:
+        print(f"Median import time {result['phases']['import_ms']['median']} ms is over the "
+              f"{args.max_import_ms} ms budget.", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
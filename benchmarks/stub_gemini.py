@@ -0,0 +1,199 @@
+"""
+A local stand-in for the Gemini REST API, for offline benchmarks and load tests.
+
+It serves generateContent and streamGenerateContent (alt=sse) with configurable
+latency, a failure rate and scripted replies, so the app can be driven without
+network access or an API key:
+
+    python benchmarks/stub_gemini.py --port 8765 --latency-ms 300 --failure-rate 0.02
+    GEMINI_API_BASE=http://127.0.0.1:8765 API_KEY=stub python app.py
+
+Replies follow a script (see DEFAULT_SCRIPT, or pass --script file.json):
+  - a dispatcher prompt containing LOOP_MARKER is answered with a <tool_code>
+    autonomous_loop(...) call (or, if the app allows the dispatcher to call tools
+    itself, with the first loop turn), any other prompt with the scripted direct answer;
+  - autonomous-loop turns (whose history starts with "User task:") get
+    loop_turns[n], where n is the number of model turns already in the history;
+    the last entry should be the final answer.
+cachedContents requests are refused, so the app falls back to inline system prompts.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOOP_MARKER = "[loop]"
+# Present in the dispatcher prompt when the app runs with DISPATCH_MODE=reuse.
+REUSE_HINT = "call the sub-tools directly"
+
+DEFAULT_SCRIPT = {
+    'answer': "Here is a short, direct answer to your question. " * 8,
+    'loop_turns': [
+        "Let me look at the workspace first.\n<tool_code>list_directory('.')</tool_code>",
+        "I will check for a notes file.\n<tool_code>search_workspace('notes')</tool_code>",
+        "Final answer: the workspace was inspected and nothing else is needed.",
+    ],
+}
+
+class StubGemini:
+    """Reply script, latency and failure settings, plus request counters shared by the handler threads."""
+
+    def __init__(self, script=None, latency_ms=200, jitter_ms=50, failure_rate=0.0, failure_status=503,
+                 stream_chunks=8, seed=None):
+        self.script = script or DEFAULT_SCRIPT
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.stream_chunks = max(1, stream_chunks)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {'generate': 0, 'stream': 0, 'failed': 0, 'dispatch': 0, 'loop_turns': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def delay(self):
+        with self._lock:
+            seconds = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            failed = self._random.random() < self.failure_rate
+        return seconds, failed
+
+    def reply(self, payload):
+        """The scripted reply text for a generateContent request body."""
+        contents = payload.get('contents', [])
+        first = "".join(part.get('text', '') for part in contents[0].get('parts', [])) if contents else ""
+        if first.startswith("User task:"):
+            self._count('loop_turns')
+            turns = self.script['loop_turns']
+            model_turns = sum(1 for content in contents if content.get('role') == 'model')
+            return turns[min(model_turns, len(turns) - 1)]
+        self._count('dispatch')
+        if LOOP_MARKER in first and REUSE_HINT in first:
+            return self.script['loop_turns'][0]  # DISPATCH_MODE=reuse: start on the tools right away
+        if LOOP_MARKER in first:
+            task = first.rsplit("**User Request:**", 1)[-1].strip()
+            return f"This needs several steps.\n<tool_code>autonomous_loop({json.dumps(task)})</tool_code>"
+        return self.script['answer']
+
+    @staticmethod
+    def response(text, prompt_chars=0):
+        return {
+            'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}, 'finishReason': 'STOP'}],
+            'usageMetadata': {'promptTokenCount': prompt_chars // 4, 'candidatesTokenCount': len(text) // 4,
+                              'totalTokenCount': (prompt_chars + len(text)) // 4},
+        }
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass  # one line per request would swamp a load test
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith('/stats'):
+                self._send_json(200, stub.stats())
+            else:
+                self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)) or 0)
+            match = re.search(r"/models/[^:/]+:(generateContent|streamGenerateContent)", self.path)
+            if match is None:
+                # cachedContents and anything else: refused, as the real API does below its size minimum.
+                self._send_json(400, {'error': {'code': 400, 'message': 'Not supported by the stub server'}})
+                return
+            payload = json.loads(body or b"{}")
+            seconds, failed = stub.delay()
+            if failed:
+                time.sleep(seconds / 4)
+                stub._count('failed')
+                self._send_json(stub.failure_status, {'error': {'code': stub.failure_status, 'message': 'Injected failure'}})
+                return
+            text = stub.reply(payload)
+            prompt_chars = len(body)
+            if match.group(1) == 'generateContent':
+                stub._count('generate')
+                time.sleep(seconds)
+                self._send_json(200, stub.response(text, prompt_chars))
+                return
+
+            stub._count('stream')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            size = -(-len(text) // stub.stream_chunks)
+            pieces = [text[index:index + size] for index in range(0, len(text), size)] or [""]
+            for index, piece in enumerate(pieces):
+                time.sleep(seconds / len(pieces))
+                chunk = stub.response(piece, prompt_chars)
+                if index < len(pieces) - 1:
+                    del chunk['usageMetadata']
+                self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+                self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+def start(port=0, **settings):
+    """
+    Starts a stub server on 127.0.0.1 in a daemon thread and returns (server, stub, base_url).
+    Use base_url as GEMINI_API_BASE; call server.shutdown() to stop it.
+    """
+    stub = StubGemini(**settings)
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub, f"http://127.0.0.1:{server.server_address[1]}"
+
+def add_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=200, help="mean stub latency per LLM call")
+    parser.add_argument('--jitter-ms', type=float, default=50, help="uniform +/- jitter around the latency")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of LLM calls that fail")
+    parser.add_argument('--failure-status', type=int, default=503)
+    parser.add_argument('--stream-chunks', type=int, default=8, help="SSE chunks per streamed reply")
+    parser.add_argument('--script', help="JSON file with 'answer' and 'loop_turns' keys")
+
+def settings_from_args(args):
+    script = None
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as f:
+            script = {**DEFAULT_SCRIPT, **json.load(f)}
+    return {'script': script, 'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+            'failure_rate': args.failure_rate, 'failure_status': args.failure_status,
+            'stream_chunks': args.stream_chunks}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=int(os.environ.get('STUB_GEMINI_PORT', 8765)))
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, _, base_url = start(args.port, **settings_from_args(args))
+    print(f"Stub Gemini API listening on {base_url}; set GEMINI_API_BASE={base_url}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
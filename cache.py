@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+
+class LRUCache:
+    """A thread-safe in-memory LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+def _normalise(prompt):
+    """Collapses whitespace in a prompt string, or in every text part of a contents list."""
+    if isinstance(prompt, str):
+        return " ".join(prompt.split())
+    return [{**content, 'parts': [{**part, 'text': " ".join(part['text'].split())} if 'text' in part else part
+                                  for part in content.get('parts', [])]}
+            for content in prompt]
+
+class LLMCache:
+    """
+    An opt-in cache for LLM responses, keyed on a hash of the normalised prompt, the
+    model and the generation parameters. Entries live in an in-memory LRU with a TTL,
+    and optionally in a SQLite file (`db_path`) so they survive restarts and are shared
+    between worker processes.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, db_path=None):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries, ttl)
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model, prompt, system_instruction=None, params=None):
+        material = json.dumps([model, _normalise(prompt), _normalise(system_instruction or ""), params or {}],
+                              sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def lookup(self, keys):
+        """
+        Returns (key, value) for the first of `keys` that is cached, or (None, None).
+        A lookup counts as one hit or miss however many keys it checks.
+        """
+        for key in keys:
+            value = self.memory.get(key)
+            if value is not None:
+                self.hits += 1
+                return key, value
+        if self._db is not None and keys:
+            placeholders = ",".join("?" * len(keys))
+            with self._db_lock:
+                rows = dict((row[0], row[1:]) for row in self._db.execute(
+                    f"SELECT key, value, expires_at FROM llm_cache WHERE key IN ({placeholders}) AND expires_at > ?",
+                    (*keys, time.time())))
+            for key in keys:
+                if key in rows:
+                    value, expires_at = rows[key]
+                    self.memory.set(key, value, ttl=expires_at - time.time())
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return key, value
+        self.misses += 1
+        return None, None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, value, time.time() + self.ttl))
+            # Opportunistically purge expired rows so the file doesn't grow without bound.
+            self._db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def stats(self):
+        return {'entries': self.memory.stats()['entries'], 'hits': self.hits, 'misses': self.misses,
+                'disk_hits': self.disk_hits, 'disk_enabled': self._db is not None}
+
+def memoize_by_mtime(path_resolver, max_entries=256, max_result_chars=1_000_000):
+    """
+    Memoises a deterministic tool on its arguments plus the (mtime, size) of the path
+    it reads, so any change to that file or directory invalidates the entry.
+    `path_resolver(*args, **kwargs)` returns the absolute path to check. It may raise
+    to skip caching. Errors and results over `max_result_chars` are never cached.
+    """
+    def decorator(func):
+        memo = LRUCache(max_entries, ttl=float('inf'))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                path = path_resolver(*args, **kwargs)
+                stat = os.stat(path)
+            except Exception:
+                return func(*args, **kwargs)
+            key = (path, args, tuple(sorted(kwargs.items())), stat.st_mtime_ns, stat.st_size)
+            result = memo.get(key)
+            if result is None:
+                result = func(*args, **kwargs)
+                if isinstance(result, str) and not result.startswith("Error") and len(result) <= max_result_chars:
+                    memo.set(key, result)
+            return result
+
+        wrapper.cache = memo
+        return wrapper
+    return decorator
@@ -1,21 +1,210 @@
-from flask import Blueprint, jsonify
+import os
+import json
+import time
+import base64
+import binascii
+from datetime import datetime
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
 from flask_login import login_required, current_user
-from models import Conversation, Message
+from sqlalchemy import select, or_, and_
+from models import db, Conversation, Message, AgentJob, JobEvent, AgentEvent
+from job_queue import job_queue, TERMINAL_STATUSES
+import message_search
+import workspaces
+import rate_limit
 
 # A Blueprint for API-related routes for better organization.
 api_bp = Blueprint('api_bp', __name__)
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# A job stream ends with an error event after this many seconds without a new event or
+# status change, e.g. for a job left queued with no worker to run it. Clients may reconnect.
+JOB_STREAM_IDLE_SECONDS = float(os.environ.get('JOB_STREAM_IDLE_SECONDS', 300))
+JOB_STREAM_POLL_SECONDS = 0.5
+
+def _encode_cursor(row):
+    return base64.urlsafe_b64encode(f"{row.created_at.isoformat()}|{row.id}".encode()).decode()
+
+def _decode_cursor(cursor):
+    created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(row_id)
+
+def _page_size():
+    return max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+
+def _paginate(query, model, descending):
+    """
+    Applies keyset pagination on (created_at, id) and returns (rows, next_cursor).
+    ?cursor= continues from a previous page; ?since_id= returns only rows with a higher
+    id (a cheap delta fetch for clients that already hold the list).
+    """
+    since_id = request.args.get('since_id', type=int)
+    if since_id is not None:
+        query = query.filter(model.id > since_id)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            created_at, row_id = _decode_cursor(cursor)
+        except (ValueError, binascii.Error):
+            abort(400, description="Invalid cursor.")
+        if descending:
+            query = query.filter(or_(model.created_at < created_at, and_(model.created_at == created_at, model.id < row_id)))
+        else:
+            query = query.filter(or_(model.created_at > created_at, and_(model.created_at == created_at, model.id > row_id)))
+    order = (model.created_at.desc(), model.id.desc()) if descending else (model.created_at.asc(), model.id.asc())
+    limit = _page_size()
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def _conditional_json(payload, next_cursor):
+    """JSON response with an ETag; an unchanged page answers If-None-Match with 304."""
+    response = jsonify(payload)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
 @api_bp.route('/history', methods=['GET'])
 @login_required
 def get_history():
-    """Fetches all conversation histories for the current user."""
-    conversations = Conversation.query.filter_by(user_id=current_user.id).order_by(Conversation.created_at.desc()).all()
-    return jsonify([conv.to_dict() for conv in conversations])
+    """Fetches a page of the current user's conversations, newest first; X-Next-Cursor points to the next page."""
+    conversations, next_cursor = _paginate(Conversation.query.filter_by(user_id=current_user.id), Conversation, descending=True)
+    return _conditional_json([conv.to_dict() for conv in conversations], next_cursor)
 
 @api_bp.route('/conversation/<int:conversation_id>', methods=['GET'])
 @login_required
 def get_conversation(conversation_id):
-    """Fetches all messages for a specific conversation."""
+    """Fetches a page of messages for a specific conversation, oldest first."""
     conv = Conversation.query.filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
-    messages = Message.query.filter_by(conversation_id=conv.id).order_by(Message.created_at.asc()).all()
-    return jsonify([msg.to_dict() for msg in messages])
+    messages, next_cursor = _paginate(Message.query.filter_by(conversation_id=conv.id), Message, descending=False)
+    return _conditional_json([msg.to_dict() for msg in messages], next_cursor)
+
+@api_bp.route('/conversation/<int:conversation_id>/fork', methods=['POST'])
+@login_required
+def fork_conversation(conversation_id):
+    """
+    Copies a conversation, up to and including {"message_id": ...} if given, into a new
+    one whose workspace is a copy-on-write snapshot of the original's.
+    """
+    conv = Conversation.query.filter_by(id=conversation_id, user_id=current_user.id).first_or_404()
+    up_to = (request.get_json(silent=True) or {}).get('message_id')
+    if up_to is not None and (isinstance(up_to, bool) or not isinstance(up_to, int)):
+        abort(400, description="message_id must be an integer.")
+    query = Message.query.filter_by(conversation_id=conv.id)
+    if up_to is not None:
+        query = query.filter(Message.id <= up_to)
+    fork = Conversation(user_id=current_user.id, title=f"{conv.title} (fork)"[:200])
+    db.session.add(fork)
+    db.session.flush()
+    db.session.add_all([Message(conversation_id=fork.id, sender=msg.sender, content=msg.content,
+                                model_used=msg.model_used, created_at=msg.created_at)
+                        for msg in query.order_by(Message.created_at.asc(), Message.id.asc())])
+    db.session.commit()
+    try:
+        files = workspaces.fork(current_user.id, conv.id, fork.id)
+    except Exception as e:
+        # A fork without its files would look complete but not be; take it back out.
+        workspaces.remove(workspaces.path_for(current_user.id, fork.id))
+        db.session.delete(fork)
+        db.session.commit()
+        abort(500, description=f"Could not copy the workspace: {e}")
+    return jsonify({**fork.to_dict(), 'forked_from': conv.id, 'workspace': files}), 201
+
+@api_bp.route('/usage', methods=['GET'])
+@login_required
+def get_usage():
+    """The current user's request and LLM token counters, and what is left of their limits."""
+    return jsonify(rate_limit.limiter.usage(current_user.id))
+
+@api_bp.route('/search', methods=['GET'])
+@login_required
+def search_messages():
+    """
+    Full-text search over the current user's messages, best match first. Each result
+    has a snippet with the matches wrapped in <mark>. ?cursor= (from X-Next-Cursor)
+    fetches the next page.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        abort(400, description="Missing search query.")
+    limit = _page_size()
+    offset = request.args.get('cursor', 0, type=int)
+    results = message_search.search(db.session, current_user.id, query, limit=limit + 1, offset=offset)
+    next_cursor = str(offset + limit) if len(results) > limit else None
+    return _conditional_json(results[:limit], next_cursor)
+
+@api_bp.route('/message/<int:message_id>/events', methods=['GET'])
+@login_required
+def get_message_events(message_id):
+    """Streams the recorded agent events behind an AI message as NDJSON, for replaying a run."""
+    Message.query.join(Conversation).filter(
+        Message.id == message_id, Conversation.user_id == current_user.id).first_or_404()
+
+    def generate():
+        # yield_per keeps memory flat for long runs instead of loading every event at once.
+        events = db.session.execute(
+            select(AgentEvent).where(AgentEvent.message_id == message_id).order_by(AgentEvent.seq)
+            .execution_options(yield_per=100)).scalars()
+        for event in events:
+            yield json.dumps(event.to_dict()) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# --- Background Jobs ---
+def _events_after(job_id, after_seq):
+    return JobEvent.query.filter(JobEvent.job_id == job_id, JobEvent.seq > after_seq).order_by(JobEvent.seq.asc()).all()
+
+@api_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """Returns a job's status and the events recorded after ?after=<seq>."""
+    job = AgentJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    events = _events_after(job.id, request.args.get('after', 0, type=int))
+    return jsonify({**job.to_dict(), 'events': [event.to_dict() for event in events]})
+
+@api_bp.route('/jobs/<int:job_id>/stream', methods=['GET'])
+@login_required
+def stream_job(job_id):
+    """
+    Streams a job's events as Server-Sent Events until it finishes, or until it has made no
+    progress for JOB_STREAM_IDLE_SECONDS; honours Last-Event-ID on reconnect.
+    """
+    AgentJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    after_seq = request.headers.get('Last-Event-ID', request.args.get('after', 0), type=int)
+
+    def generate():
+        nonlocal after_seq
+        last_status, last_progress = None, time.monotonic()
+        while True:
+            status = db.session.scalar(select(AgentJob.status).where(AgentJob.id == job_id))
+            if status != last_status:
+                last_status, last_progress = status, time.monotonic()
+            # Read events after the status so a finished job's last events are never skipped.
+            for event in _events_after(job_id, after_seq):
+                after_seq, last_progress = event.seq, time.monotonic()
+                yield f"id: {event.seq}\ndata: {json.dumps(event.to_dict())}\n\n"
+            if status in TERMINAL_STATUSES:
+                yield f"data: {json.dumps({'type': 'done', 'status': status})}\n\n"
+                return
+            db.session.commit()  # end the read transaction so the next poll sees new rows
+            if time.monotonic() - last_progress > JOB_STREAM_IDLE_SECONDS:
+                error = {'type': 'error', 'status': status,
+                         'content': f"The job made no progress for {JOB_STREAM_IDLE_SECONDS:g} seconds; "
+                                    f"it is still {status}. Reconnect to keep waiting."}
+                yield f"data: {json.dumps(error)}\n\n"
+                return
+            time.sleep(JOB_STREAM_POLL_SECONDS)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api_bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """Cancels a queued or running job."""
+    job = AgentJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    job_queue.cancel(job)
+    return jsonify(job.to_dict())
@@ -0,0 +1,108 @@
+import hashlib
+import functools
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for budgeting without a tokenizer call."""
+    return (len(text) + 3) // 4
+
+@functools.lru_cache(maxsize=16)
+def prompt_tokens(text: str) -> int:
+    """estimate_tokens for system prompts, which are sent unchanged on every call, so it is cached."""
+    return estimate_tokens(text)
+
+def truncate_middle(text: str, max_chars: int) -> str:
+    """Keeps the head and tail of a long text with an elision marker in between."""
+    if len(text) <= max_chars:
+        return text
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n[... {omitted} characters omitted ...]\n{text[-tail:]}"
+
+class AgentContext:
+    """
+    Holds the autonomous loop's history and renders it as a Gemini multi-turn `contents`
+    array that stays within a token budget.
+    The most recent `recent_turns` turns keep their tool outputs (capped at
+    `max_output_chars`). Older turns keep the model's reasoning but shrink tool outputs
+    to a short excerpt. An output identical to an earlier one is replaced by a
+    back-reference. Over `token_budget`, the full-output window shrinks towards just the
+    latest turn, then the oldest turns are dropped with a note of how many were omitted.
+    """
+
+    def __init__(self, task: str, token_budget: int = 30000, recent_turns: int = 3,
+                 max_output_chars: int = 8000, old_output_chars: int = 400, max_response_chars: int = 4000):
+        self.task = task
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.max_output_chars = max_output_chars
+        self.old_output_chars = old_output_chars
+        self.max_response_chars = max_response_chars
+        self.turns = []  # (llm_response, tool_output, duplicate_of_turn_or_None)
+        self._seen_outputs = {}
+
+    def add_turn(self, llm_response: str, tool_output: str):
+        digest = hashlib.sha1(tool_output.encode('utf-8', 'replace')).hexdigest()
+        duplicate_of = self._seen_outputs.get(digest)
+        if duplicate_of is None:
+            self._seen_outputs[digest] = len(self.turns) + 1
+        self.turns.append((llm_response, tool_output, duplicate_of))
+
+    def _render_turn(self, number, llm_response, tool_output, duplicate_of, recent):
+        if duplicate_of is not None:
+            observation = f"[Same output as turn {duplicate_of}.]"
+        elif recent:
+            observation = truncate_middle(tool_output, self.max_output_chars)
+        else:
+            observation = truncate_middle(tool_output, self.old_output_chars)
+        return [
+            {'role': 'model', 'parts': [{'text': truncate_middle(llm_response, self.max_response_chars)}]},
+            {'role': 'user', 'parts': [{'text': f"Tool Output (turn {number}): {observation}"}]},
+        ]
+
+    def _render(self, recent_turns):
+        first_recent = len(self.turns) - recent_turns
+        return [self._render_turn(index + 1, llm_response, tool_output, duplicate_of, index >= first_recent)
+                for index, (llm_response, tool_output, duplicate_of) in enumerate(self.turns)]
+
+    def build_contents(self):
+        """Returns the history as a `contents` list alternating user/model roles."""
+        task_text = f"User task: {self.task}"
+        # Shrink the full-output window first; only the latest turn is guaranteed its full output.
+        for recent_turns in range(min(self.recent_turns, len(self.turns)), 0, -1):
+            rendered = self._render(recent_turns)
+            tokens = estimate_tokens(task_text) + sum(self._turn_tokens(turn) for turn in rendered)
+            if tokens <= self.token_budget:
+                break
+        else:
+            rendered = self._render(1)
+            tokens = estimate_tokens(task_text) + sum(self._turn_tokens(turn) for turn in rendered)
+
+        dropped = 0
+        # Then drop the oldest turns, always keeping the latest one.
+        while tokens > self.token_budget and len(rendered) - dropped > 1:
+            tokens -= self._turn_tokens(rendered[dropped])
+            dropped += 1
+        if dropped:
+            task_text += f"\n\n[{dropped} earlier turn(s) omitted to fit the context budget.]"
+
+        contents = [{'role': 'user', 'parts': [{'text': task_text}]}]
+        for turn in rendered[dropped:]:
+            contents.extend(turn)
+        return contents
+
+    @staticmethod
+    def _turn_tokens(turn):
+        return sum(estimate_tokens(part['text']) for content in turn for part in content['parts'])
+
+    def full_history_tokens(self, system_prompt: str = "") -> int:
+        """Token estimate of the old approach: system prompt plus the untrimmed history blob."""
+        history = [f"User task: {self.task}"]
+        for llm_response, tool_output, _ in self.turns:
+            history.append(f"AI Thought: {llm_response}")
+            history.append(f"Tool Output: {tool_output}")
+        return prompt_tokens(system_prompt) + estimate_tokens("\n".join(history))
+
+def contents_tokens(contents, system_prompt: str = "") -> int:
+    return prompt_tokens(system_prompt) + sum(
+        estimate_tokens(part.get('text', '')) for content in contents for part in content['parts'])
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_DATABASE_URI = 'sqlite:///database.db'
+
+def database_uri():
+    """Reads DATABASE_URL, accepting the 'postgres://' scheme some hosts still hand out."""
+    uri = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+def engine_options(uri):
+    """
+    SQLAlchemy engine options for the configured backend.
+    SQLite waits on a busy database instead of failing with 'database is locked' (the
+    WAL and synchronous pragmas are applied per connection, see below). PostgreSQL gets
+    a connection pool sized for the worker's threads, with pre-ping and recycling so
+    connections dropped by the server or a proxy are replaced transparently.
+    """
+    if uri.startswith('sqlite'):
+        return {'connect_args': {'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 15))}}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers proceed while a writer commits. synchronous=NORMAL then fsyncs
+    only at checkpoints, which is still crash-safe in WAL mode. SQLITE_JOURNAL_MODE
+    can restore the old rollback-journal behaviour, e.g. for network filesystems.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    journal_mode = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+    if journal_mode.upper() == 'WAL':
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(float(os.environ.get('SQLITE_BUSY_TIMEOUT', 15)) * 1000)}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
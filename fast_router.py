@@ -0,0 +1,96 @@
+import os
+import re
+import instrumentation
+
+# DISPATCH_MODE decides how /ask picks between a direct answer and the autonomous loop:
+#   llm    - the dispatcher LLM call decides (the original behaviour)
+#   local  - a local rule-based classifier sends clearly multi-step tasks straight to the
+#            loop, skipping the dispatcher call; anything else goes to the dispatcher
+#   reuse  - the dispatcher may call sub-tools itself, and that response becomes the
+#            loop's first turn instead of being thrown away
+# Modes combine, e.g. DISPATCH_MODE=local,reuse.
+DISPATCH_MODES = {mode.strip() for mode in os.environ.get('DISPATCH_MODE', 'llm').lower().split(',') if mode.strip()}
+REUSE_DISPATCH = 'reuse' in DISPATCH_MODES
+LOCAL_THRESHOLD = float(os.environ.get('DISPATCH_LOCAL_THRESHOLD', 3))
+
+REUSE_INSTRUCTION = (
+    "\n\n**Dispatch shortcut:** For a multi-step task you may skip `autonomous_loop` and call the sub-tools "
+    "directly in this response. It then becomes the first step of the loop, and you continue from their outputs."
+)
+
+DECISIONS = instrumentation.Counter('agent_dispatch_total', "How /ask requests were routed.", ('decided_by', 'route'))
+CALLS_SAVED = instrumentation.Counter('llm_calls_saved_total', "LLM round trips skipped by the dispatch shortcuts.",
+                                      ('reason',))
+SECONDS_SAVED = instrumentation.Counter('llm_seconds_saved_total',
+                                        "Estimated LLM latency saved, from the model's median latency.", ('reason',))
+
+_FILE_RE = re.compile(r"\b[\w./-]+\.(?:py|txt|md|csv|tsv|json|jsonl|parquet|js|ts|html|css|ya?ml|toml|ini|log|sh|sql|xml)\b", re.I)
+_URL_RE = re.compile(r"https?://\S+", re.I)
+_ACTION_RE = re.compile(
+    r"(?:^|[.;,!?]\s*|\b(?:and|then|please|to)\s+)(create|make|write|save|read|open|list|delete|remove|rename|move|modify|"
+    r"edit|update|append|analy[sz]e|run|execute|fetch|download|scrape|search|grep|find|build|generate|refactor|fix|"
+    r"install|compute|calculate|plot|summari[sz]e|convert|parse|count|compare|research)\b", re.I)
+_SEQUENCE_RE = re.compile(r"\b(?:and then|then|after that|afterwards|finally|next|step by step|first)\b", re.I)
+_WORKSPACE_RE = re.compile(r"\b(?:workspace|folder|directory|directories|files?|script|project|dataset|todo)\b", re.I)
+_QUESTION_RE = re.compile(r"^\s*(?:what|who|when|where|why|which|how|is|are|was|were|can|could|does|do|did|should|"
+                          r"explain|define|describe|tell me|hi|hello|hey|thanks|thank you)\b", re.I)
+
+def classify(prompt):
+    """
+    Scores a request for 'needs tools over several steps'. Returns (route, score, reasons),
+    where route is 'loop' when the score reaches DISPATCH_LOCAL_THRESHOLD and None (let the
+    dispatcher decide) otherwise. It never answers directly: a direct answer needs an LLM
+    call anyway, and that call is the dispatcher's. A false 'loop' is cheap too, since the
+    loop's first turn can answer without tools in the same single call.
+    """
+    score, reasons = 0.0, []
+    if _FILE_RE.search(prompt):
+        score += 2
+        reasons.append('file')
+    if _URL_RE.search(prompt):
+        score += 2
+        reasons.append('url')
+    actions = {match.lower() for match in _ACTION_RE.findall(prompt)}
+    if actions:
+        score += min(len(actions), 2)
+        reasons.append('action:' + '+'.join(sorted(actions)))
+        if _ACTION_RE.match(prompt.lstrip()):
+            score += 1
+            reasons.append('imperative')
+    if _SEQUENCE_RE.search(prompt):
+        score += 1
+        reasons.append('sequence')
+    if _WORKSPACE_RE.search(prompt):
+        score += 1
+        reasons.append('workspace')
+    if "```" in prompt and actions:
+        score += 1
+        reasons.append('code')
+    if _QUESTION_RE.match(prompt) and 'file' not in reasons and 'url' not in reasons:
+        score -= 2
+        reasons.append('question')
+    if len(prompt.split()) < 6:
+        score -= 1
+        reasons.append('short')
+    return ('loop' if score >= LOCAL_THRESHOLD else None), score, reasons
+
+def route(prompt):
+    """'loop' if DISPATCH_MODE includes 'local' and the classifier is confident, else None."""
+    if 'local' not in DISPATCH_MODES:
+        return None
+    decision, score, reasons = classify(prompt)
+    if decision:
+        print(f"Fast router: sending request to the loop (score {score:g}: {', '.join(reasons)})")
+    return decision
+
+def dispatcher_prompt(system_prompt):
+    """The dispatcher's system prompt; in 'reuse' mode it may start on the tools itself."""
+    return system_prompt + REUSE_INSTRUCTION if REUSE_DISPATCH else system_prompt
+
+def record(decided_by, route_taken, saved_reason=None, saved_seconds=None):
+    """Counts a routing decision and, when a shortcut skipped an LLM call, the call and its estimated latency."""
+    DECISIONS.inc(decided_by=decided_by, route=route_taken)
+    if saved_reason:
+        CALLS_SAVED.inc(reason=saved_reason)
+        if saved_seconds:
+            SECONDS_SAVED.inc(saved_seconds, reason=saved_reason)
@@ -0,0 +1,214 @@
+import os
+import re
+import csv
+import math
+import mmap
+import codecs
+import bisect
+import threading
+from cache import LRUCache
+
+CHUNK_BYTES = 1024 * 1024
+MAX_LINE_CHARS = 500
+
+_line_indexes = LRUCache(max_entries=64, ttl=float('inf'))
+_line_indexes_lock = threading.Lock()
+
+def _line_offset(path, mm, line):
+    """
+    Byte offset where 1-based `line` starts, or len(mm) past the end. A cached index
+    holds the number of newlines before each CHUNK_BYTES block, extended only as far
+    as a request needs, so reaching line N scans at most one block line by line.
+    """
+    target = line - 1  # newlines to skip
+    if target <= 0:
+        return 0
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _line_indexes_lock:
+        counts = _line_indexes.get(key)
+        if counts is None:
+            counts = [0]
+            _line_indexes.set(key, counts)
+        while counts[-1] < target and (len(counts) - 1) * CHUNK_BYTES < len(mm):
+            block = len(counts) - 1
+            counts.append(counts[-1] + mm[block * CHUNK_BYTES:(block + 1) * CHUNK_BYTES].count(b"\n"))
+        if counts[-1] < target:
+            return len(mm)
+        block = bisect.bisect_left(counts, target) - 1
+        newlines_before = counts[block]
+    offset = block * CHUNK_BYTES
+    for _ in range(target - newlines_before):
+        offset = mm.find(b"\n", offset) + 1
+    return offset
+
+def read_range(path, start=None, end=None, unit="lines", max_bytes=100_000):
+    """
+    Reads lines start..end (1-based, inclusive) or bytes [start, end) of a file through
+    mmap, so only the requested range is paged in. Returns (text, note); note describes
+    the range shown when the file or range was larger than `max_bytes`.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return "", None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if unit == "bytes":
+            begin = max(0, start or 0)
+            stop = min(size, end if end is not None else size)
+        elif unit == "lines":
+            first = max(1, start or 1)
+            begin = _line_offset(path, mm, first)
+            stop = _line_offset(path, mm, end + 1) if end is not None else size
+        else:
+            raise ValueError("unit must be 'lines' or 'bytes'.")
+        truncated = stop - begin > max_bytes
+        if truncated:
+            stop = begin + max_bytes
+            if unit == "lines":
+                # Cut at a line boundary so the next call can continue from a whole line.
+                newline = mm.rfind(b"\n", begin, stop)
+                if newline != -1:
+                    stop = newline + 1
+        text = mm[begin:stop].decode('utf-8', 'replace')
+
+    if not truncated:
+        return text, None
+    if unit == "lines":
+        shown_to = first + text.count("\n") - 1
+        return text, (f"[showing lines {first}-{shown_to} of a {size}-byte file; "
+                      f"call read_file(path, {shown_to + 1}, <end>) for more]")
+    return text, (f"[showing bytes {begin}-{stop} of {size}; "
+                  f"call read_file(path, {stop}, <end>, \"bytes\") for more]")
+
+def tail(path, lines=20, block_bytes=64 * 1024):
+    """The last `lines` lines, read backwards in blocks so the file is never fully loaded."""
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        data = b""
+        # One extra newline is needed to know the first returned line is complete.
+        while position > 0 and data.count(b"\n") <= lines:
+            step = min(block_bytes, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    kept = data.splitlines()[-lines:] if lines > 0 else []
+    return "\n".join(line.decode('utf-8', 'replace') for line in kept)
+
+def grep(path, pattern, max_matches=50, ignore_case=False):
+    """Returns (matches, more) where matches are (line_number, line) for lines matching `pattern`."""
+    regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    matches = []
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        for number, line in enumerate(f, start=1):
+            if regex.search(line):
+                if len(matches) == max_matches:
+                    return matches, True
+                line = line.rstrip("\r\n")
+                if len(line) > MAX_LINE_CHARS:
+                    line = line[:MAX_LINE_CHARS] + "..."
+                matches.append((number, line))
+    return matches, False
+
+def text_summary(path):
+    """Counts lines, words and characters in one pass over fixed-size chunks."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    lines = words = chars = 0
+    in_word = False
+    last = ""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            text = decoder.decode(chunk, final=not chunk)
+            if text:
+                lines += text.count("\n")
+                chars += len(text)
+                words += len(text.split())
+                # A word split across two chunks was counted twice.
+                if in_word and not text[0].isspace():
+                    words -= 1
+                in_word = not text[-1].isspace()
+                last = text[-1]
+            if not chunk:
+                break
+    if chars and last != "\n":
+        lines += 1
+    return {'lines': lines, 'words': words, 'characters': chars}
+
+class _ColumnStats:
+    """Running per-column statistics in constant memory (Welford's algorithm for the variance)."""
+
+    MAX_DISTINCT = 1000
+
+    def __init__(self, name):
+        self.name = name
+        self.count = self.empty = self.numeric = 0
+        self.mean = self.m2 = 0.0
+        self.min = self.max = None
+        self.distinct = set()
+        self.distinct_overflow = False
+
+    def add(self, value):
+        self.count += 1
+        value = value.strip()
+        if not value:
+            self.empty += 1
+            return
+        if not self.distinct_overflow:
+            self.distinct.add(value)
+            if len(self.distinct) > self.MAX_DISTINCT:
+                self.distinct_overflow = True
+                self.distinct = set()
+        try:
+            number = float(value)
+        except ValueError:
+            return
+        if not math.isfinite(number):
+            return
+        self.numeric += 1
+        delta = number - self.mean
+        self.mean += delta / self.numeric
+        self.m2 += delta * (number - self.mean)
+        self.min = number if self.min is None else min(self.min, number)
+        self.max = number if self.max is None else max(self.max, number)
+
+    def describe(self):
+        distinct = f">{self.MAX_DISTINCT}" if self.distinct_overflow else str(len(self.distinct))
+        parts = [f"non-empty {self.count - self.empty}/{self.count}", f"distinct {distinct}"]
+        if self.numeric:
+            std = math.sqrt(self.m2 / (self.numeric - 1)) if self.numeric > 1 else 0.0
+            parts.append(f"numeric {self.numeric}, min {self.min:.10g}, max {self.max:.10g}, "
+                         f"mean {self.mean:.6g}, std {std:.6g}")
+        return f"- {self.name}: " + ", ".join(parts)
+
+def sniff_delimiter(f):
+    """Guesses a CSV delimiter from the start of an open text file and rewinds it."""
+    try:
+        delimiter = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimiter = ","
+    f.seek(0)
+    return delimiter
+
+def csv_stats(path, delimiter=None):
+    """Streams a CSV (header row first) once and returns (row_count, [_ColumnStats])."""
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        delimiter = delimiter or sniff_delimiter(f)
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return 0, []
+        columns = [_ColumnStats(name or f"column_{index + 1}") for index, name in enumerate(header)]
+        rows = 0
+        for row in reader:
+            if not row:
+                continue
+            rows += 1
+            for index, value in enumerate(row):
+                if index >= len(columns):
+                    columns.append(_ColumnStats(f"column_{index + 1}"))
+                    columns[index].count = rows - 1
+                    columns[index].empty = rows - 1
+                columns[index].add(value)
+            for column in columns[len(row):]:
+                column.add("")
+    return rows, columns
@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Seconds; covers fast DB statements up to slow multi-turn agent runs.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+TRACE_LOG = os.environ.get('TRACE_LOG')
+TRACE_LOG_MIN_MS = float(os.environ.get('TRACE_LOG_MIN_MS', 0))
+
+# The spans of the request being served, or None outside a request. Tool threads run in
+# copies of the request's context, so their spans land in the same trace; the trace's
+# 'lock' guards every change to it, as each metric's lock does for its values.
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+# --- Metrics ---
+REGISTRY = []
+
+class _Metric:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _label_text(self, key, extra=None):
+        pairs = list(zip(self.labels, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter(_Metric):
+    """A monotonically increasing count per label set."""
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{self._label_text(key)} {value}" for key, value in sorted(values.items())]
+        return lines
+
+class Histogram(_Metric):
+    """Bucketed observations per label set, rendered as a Prometheus histogram."""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: list(entry) for key, entry in self._values.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._label_text(key, ('le', f'{bound:g}'))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._label_text(key, ('le', '+Inf'))} {entry[-1]}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {entry[-2]:.6f}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {entry[-1]}")
+        return lines
+
+REQUEST_SECONDS = Histogram('app_request_duration_seconds', "HTTP request duration, including streamed bodies.",
+                            ('endpoint', 'method', 'status'))
+LLM_SECONDS = Histogram('llm_call_duration_seconds', "Duration of each LLM API attempt.", ('model', 'mode', 'outcome'))
+LLM_TOKENS = Counter('llm_tokens_total', "Tokens reported in the responses' usageMetadata.", ('model', 'kind'))
+TOOL_SECONDS = Histogram('tool_duration_seconds', "Duration of each tool execution.", ('tool', 'outcome'))
+TOOL_OUTPUT_BYTES = Histogram('tool_output_bytes', "Size of each tool's output.", ('tool',), buckets=SIZE_BUCKETS)
+DB_STATEMENT_SECONDS = Histogram('db_statement_duration_seconds', "Duration of each SQL statement.", ('operation',))
+DB_COMMIT_SECONDS = Histogram('db_commit_duration_seconds', "Session commit duration, including the flush.")
+LOOP_SECONDS = Histogram('agent_loop_duration_seconds', "Duration of autonomous loop runs.", ('outcome',))
+LOOP_TURNS = Histogram('agent_loop_turns', "LLM turns per autonomous loop run.", buckets=(1, 2, 3, 4, 5, 6, 8, 10))
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Spans ---
+class Span:
+    """One timed operation; set attributes with span.set(...) while it runs."""
+    __slots__ = ('kind', 'attributes', 'started', 'duration', 'error')
+
+    def __init__(self, kind, attributes):
+        self.kind = kind
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self, trace_started):
+        entry = {'kind': self.kind, 'start_ms': round((self.started - trace_started) * 1000, 1),
+                 'duration_ms': round(self.duration * 1000, 1), **self.attributes}
+        if self.error:
+            entry['error'] = self.error
+        return entry
+
+@contextmanager
+def span(kind, **attributes):
+    """
+    Times the block. The span is added to the current request's trace (if any); the
+    caller records it in the matching histogram, so each kind keeps its own labels.
+    """
+    current = Span(kind, attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.started
+        trace = _current_trace.get()
+        if trace is not None:
+            with trace['lock']:
+                trace['spans'].append(current)
+
+@contextmanager
+def llm_span(model, attempt, mode, prompt_chars):
+    """Times one LLM API attempt; finish it with record_llm() once the response is in."""
+    outcome = 'error'
+    with span('llm', model=model, attempt=attempt, mode=mode, prompt_chars=prompt_chars) as current:
+        try:
+            yield current
+            outcome = 'ok'
+        finally:
+            LLM_SECONDS.observe(time.perf_counter() - current.started, model=model, mode=mode, outcome=outcome)
+
+def record_llm(current, response_chars, usage):
+    current.set(response_chars=response_chars, prompt_tokens=usage.get('promptTokenCount'),
+                response_tokens=usage.get('candidatesTokenCount'))
+    for kind, field in (('prompt', 'promptTokenCount'), ('response', 'candidatesTokenCount')):
+        if usage.get(field):
+            LLM_TOKENS.inc(usage[field], model=current.attributes['model'], kind=kind)
+
+@contextmanager
+def tool_span(name):
+    """Times one tool execution; call .set(output=...) with its result."""
+    failed = True
+    with span('tool', tool=name) as current:
+        try:
+            yield current
+            failed = False
+        finally:
+            output = current.attributes.pop('output', None)
+            outcome = 'error' if failed or (isinstance(output, str) and output.startswith("Error")) else 'ok'
+            size = len(output.encode('utf-8', 'replace')) if isinstance(output, str) else 0
+            current.set(outcome=outcome, output_bytes=size)
+            TOOL_SECONDS.observe(time.perf_counter() - current.started, tool=name, outcome=outcome)
+            TOOL_OUTPUT_BYTES.observe(size, tool=name)
+
+def record_loop(current, turns, outcome):
+    current.set(turns=turns, outcome=outcome)
+    LOOP_SECONDS.observe(time.perf_counter() - current.started, outcome=outcome)
+    LOOP_TURNS.observe(turns)
+
+# --- Database ---
+def _on_before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _on_after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    DB_STATEMENT_SECONDS.observe(elapsed, operation=operation)
+    trace = _current_trace.get()
+    if trace is not None:
+        # Statements are summed per request rather than kept as spans; there can be hundreds.
+        with trace['lock']:
+            trace['db_statements'] += 1
+            trace['db_seconds'] += elapsed
+
+def _on_error(context):
+    # A statement that raises never reaches after_cursor_execute; drop its start time.
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+def _on_before_commit(session):
+    session.info['commit_started'] = time.perf_counter()
+
+def _on_after_commit(session):
+    started = session.info.pop('commit_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    DB_COMMIT_SECONDS.observe(elapsed)
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace['lock']:
+            trace['db_commits'] += 1
+            trace['db_commit_seconds'] += elapsed
+
+def _on_after_rollback(session):
+    session.info.pop('commit_started', None)
+
+_database_instrumented = False
+_instrument_lock = threading.Lock()
+
+def instrument_database():
+    """Times every statement on every engine, and every ORM session commit. Later calls do nothing."""
+    global _database_instrumented
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.orm import Session
+    with _instrument_lock:
+        if _database_instrumented:
+            return
+        _database_instrumented = True
+        event.listen(Engine, 'before_cursor_execute', _on_before_execute)
+        event.listen(Engine, 'after_cursor_execute', _on_after_execute)
+        event.listen(Engine, 'handle_error', _on_error)
+        event.listen(Session, 'before_commit', _on_before_commit)
+        event.listen(Session, 'after_commit', _on_after_commit)
+        event.listen(Session, 'after_rollback', _on_after_rollback)
+
+# --- Request traces ---
+_trace_log_lock = threading.Lock()
+
+def _start_trace():
+    trace = {'started': time.perf_counter(), 'spans': [], 'db_statements': 0, 'db_seconds': 0.0,
+             'db_commits': 0, 'db_commit_seconds': 0.0, 'lock': threading.Lock()}
+    _current_trace.set(trace)
+    return trace
+
+def _finish_trace(trace, method, path, endpoint, status):
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    duration = time.perf_counter() - trace['started']
+    REQUEST_SECONDS.observe(duration, endpoint=endpoint or 'unknown', method=method, status=status)
+    if not TRACE_LOG or duration * 1000 < TRACE_LOG_MIN_MS:
+        return
+    with trace['lock']:  # a tool thread may still be finishing a span
+        trace = {**trace, 'spans': list(trace['spans'])}
+    entry = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'method': method,
+        'path': path,
+        'status': status,
+        'duration_ms': round(duration * 1000, 1),
+        'db': {'statements': trace['db_statements'], 'ms': round(trace['db_seconds'] * 1000, 1),
+               'commits': trace['db_commits'], 'commit_ms': round(trace['db_commit_seconds'] * 1000, 1)},
+        'spans': [current.to_dict(trace['started']) for current in trace['spans']],
+    }
+    line = json.dumps(entry, default=str) + "\n"
+    try:
+        with _trace_log_lock, open(TRACE_LOG, 'a', encoding='utf-8') as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Could not write trace log {TRACE_LOG}: {e}")
+
+def init_app(app):
+    """
+    Times every request, instruments the database, and writes one JSON line per request
+    to TRACE_LOG when it is set. A streamed response's trace stays open until the server
+    closes the stream, so an SSE run's LLM and tool spans land in its request's trace.
+    """
+    from flask import request, g
+    instrument_database()
+
+    @app.before_request
+    def _before():
+        if request.endpoint != 'static':
+            g.trace = _start_trace()
+
+    @app.after_request
+    def _after(response):
+        trace = g.get('trace')
+        if trace is not None and response.is_streamed:
+            g.trace = None
+            details = (request.method, request.path, request.endpoint, response.status_code)
+            response.call_on_close(lambda: _finish_trace(trace, *details))
+        elif trace is not None:
+            g.trace_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _teardown(exception):
+        trace = g.pop('trace', None)
+        if trace is not None:
+            _finish_trace(trace, request.method, request.path, request.endpoint,
+                          500 if exception is not None else g.get('trace_status', 500))
@@ -0,0 +1,184 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.orm import aliased
+from models import db, AgentJob, JobEvent
+
+TERMINAL_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+class JobQueue:
+    """
+    A background worker pool for agent runs, backed by the app's own database.
+    Jobs are claimed with a conditional UPDATE, so several gunicorn processes can share
+    one queue. Running jobs are heartbeated. A job whose heartbeat goes stale, for
+    example because its process died, is claimed again and re-run. That is how queued
+    and in-flight work resumes after a restart. Each user has at most
+    `per_user_limit` jobs running at once; the rest wait in the queue.
+    Usage mirrors Flask extensions: create at import time, then call init_app().
+    """
+
+    def __init__(self):
+        self.app = None
+        self.runner = None
+        self.workers = 2
+        self.per_user_limit = 1
+        self.max_queued_per_user = 10
+        self.poll_interval = 0.5
+        self.lease_seconds = 60
+        self._threads = []
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def init_app(self, app, runner, autostart=True):
+        """
+        runner(job) must return an iterable of event dicts. An event with 'fatal'
+        set marks the job failed. Once the workers have started they stay bound to their
+        app; later calls (e.g. a second create_app) leave the queue as it is.
+        """
+        if self._threads:
+            return
+        self.app = app
+        self.runner = runner
+        self.workers = app.config.get('JOB_WORKERS', self.workers)
+        self.per_user_limit = app.config.get('JOB_PER_USER_LIMIT', self.per_user_limit)
+        self.max_queued_per_user = app.config.get('JOB_MAX_QUEUED_PER_USER', self.max_queued_per_user)
+        self.lease_seconds = app.config.get('JOB_LEASE_SECONDS', self.lease_seconds)
+        if autostart and self.workers > 0:
+            self.start()
+
+    def start(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    # --- Producer side (called from request handlers) ---
+    def enqueue(self, user_id, conversation_id, prompt):
+        """Adds a job and returns it, or returns None if the user already has too many queued."""
+        queued = db.session.scalar(select(func.count()).select_from(AgentJob).where(
+            AgentJob.user_id == user_id, AgentJob.status.in_(('queued', 'running'))))
+        if queued >= self.max_queued_per_user:
+            return None
+        job = AgentJob(user_id=user_id, conversation_id=conversation_id, prompt=prompt)
+        db.session.add(job)
+        db.session.commit()
+        self._wakeup.set()
+        return job
+
+    def cancel(self, job):
+        """Cancels a queued job immediately; a running job stops after its current event."""
+        if job.status in TERMINAL_STATUSES:
+            return
+        job.cancel_requested = True
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    # --- Worker side ---
+    def _claim_next(self):
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.lease_seconds)
+        running = aliased(AgentJob)
+        running_count = (select(func.count()).select_from(running)
+                         .where(running.user_id == AgentJob.user_id, running.status == 'running',
+                                running.heartbeat_at >= stale)
+                         .scalar_subquery())
+        claimable = or_(AgentJob.status == 'queued',
+                        and_(AgentJob.status == 'running', AgentJob.heartbeat_at < stale))
+        eligible = and_(claimable, AgentJob.cancel_requested.is_(False), running_count < self.per_user_limit)
+        candidates = db.session.scalars(
+            select(AgentJob.id).where(eligible).order_by(AgentJob.created_at).limit(5)).all()
+        for job_id in candidates:
+            # The conditional UPDATE is the lock: only one worker (in any process) wins it. It
+            # re-checks the per-user limit, which a worker that just won another of this
+            # user's jobs may have used up since the SELECT.
+            result = db.session.execute(
+                update(AgentJob).where(AgentJob.id == job_id, eligible)
+                .values(status='running', started_at=now, heartbeat_at=now, attempts=AgentJob.attempts + 1))
+            db.session.commit()
+            if result.rowcount == 1:
+                return db.session.get(AgentJob, job_id)
+        return None
+
+    def _worker_loop(self):
+        backoff = self.poll_interval
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    job = self._claim_next()
+                    if job is not None:
+                        self._run(job)
+                        continue
+                backoff = self.poll_interval
+            except Exception as e:
+                # e.g. a locked or not yet initialised database: back off instead of spinning.
+                print(f"Job worker error: {e}")
+                backoff = min(backoff * 2, 30)
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+
+    def _run(self, job):
+        job_id = job.id
+        with self._running_lock:
+            self._running.add(job_id)
+        seq = db.session.scalar(select(func.coalesce(func.max(JobEvent.seq), 0)).where(JobEvent.job_id == job_id))
+        if job.attempts > 1:
+            seq += 1
+            db.session.add(JobEvent(job_id=job_id, seq=seq, payload=json.dumps({'type': 'resumed', 'attempt': job.attempts})))
+            db.session.commit()
+
+        status, error = 'succeeded', None
+        events = iter(self.runner(job))
+        try:
+            for event in events:
+                seq += 1
+                db.session.add(JobEvent(job_id=job_id, seq=seq, payload=json.dumps(event)))
+                db.session.commit()
+                if event.get('fatal'):
+                    status, error = 'failed', event.get('content')
+                if db.session.scalar(select(AgentJob.cancel_requested).where(AgentJob.id == job_id)):
+                    status = 'cancelled'
+                    break
+        except Exception as e:
+            db.session.rollback()
+            status, error = 'failed', str(e)
+        finally:
+            close = getattr(events, 'close', None)
+            if close:
+                close()
+            with self._running_lock:
+                self._running.discard(job_id)
+
+        db.session.execute(update(AgentJob).where(AgentJob.id == job_id)
+                           .values(status=status, error=error, finished_at=datetime.utcnow()))
+        db.session.commit()
+
+    def _heartbeat_loop(self):
+        interval = max(1, self.lease_seconds // 4)
+        while not self._stopping.wait(interval):
+            with self._running_lock:
+                job_ids = list(self._running)
+            if not job_ids:
+                continue
+            try:
+                with self.app.app_context():
+                    db.session.execute(update(AgentJob).where(AgentJob.id.in_(job_ids), AgentJob.status == 'running')
+                                       .values(heartbeat_at=datetime.utcnow()))
+                    db.session.commit()
+            except Exception as e:
+                print(f"Job heartbeat error: {e}")
+
+job_queue = JobQueue()
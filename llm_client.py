@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+class GeminiError(Exception):
+    """Raised when a Gemini call fails; carries the HTTP status code when there was one."""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class GeminiClient:
+    """
+    A Gemini REST client that reuses connections across calls through one pooled,
+    keep-alive requests.Session. At most `max_concurrency` requests are in flight, and
+    a call given a `deadline` (a time.monotonic() value) never runs past it, including
+    the wait for a free slot. Pointing `base_url` at a local server lets the client run
+    against a stub API (see benchmarks/stub_gemini.py).
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, max_concurrency=8, timeout=40,
+                 connect_timeout=5, pool_size=16):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._session.headers.update({'Content-Type': 'application/json'})
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+        self._cached_contents = {}
+        self._cache_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, api_key):
+        """Builds a client configured from GEMINI_API_BASE and the LLM_* environment variables."""
+        return cls(
+            api_key,
+            base_url=os.environ.get('GEMINI_API_BASE', DEFAULT_BASE_URL),
+            max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 8)),
+            timeout=float(os.environ.get('LLM_TIMEOUT', 40)),
+            pool_size=int(os.environ.get('LLM_POOL_SIZE', 16)),
+        )
+
+    def _url(self, model, method, query=""):
+        return f"{self.base_url}/models/{model}:{method}?{query}key={self.api_key}"
+
+    def _timeouts(self, deadline):
+        """Returns a (connect, read) timeout tuple that never runs past the deadline."""
+        read_timeout = self.timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise GeminiError("Deadline exceeded before the request was sent.")
+            read_timeout = min(read_timeout, remaining)
+        return (min(self.connect_timeout, read_timeout), read_timeout)
+
+    def _acquire(self, deadline):
+        wait = None if deadline is None else max(0, deadline - time.monotonic())
+        if not self._semaphore.acquire(timeout=wait):
+            raise GeminiError("Deadline exceeded waiting for a free LLM connection slot.")
+
+    def generate(self, model, payload, deadline=None):
+        """POSTs a generateContent request and returns the decoded JSON response."""
+        self._acquire(deadline)
+        try:
+            response = self._session.post(self._url(model, 'generateContent'), json=payload,
+                                          timeout=self._timeouts(deadline))
+        except requests.RequestException as e:
+            raise GeminiError(str(e)) from e
+        finally:
+            self._semaphore.release()
+        if response.status_code >= 400:
+            raise GeminiError(f"{response.status_code} error from model {model}: {response.text[:200]}",
+                              status_code=response.status_code)
+        return response.json()
+
+    def stream(self, model, payload, deadline=None):
+        """Calls streamGenerateContent over SSE and yields each decoded response chunk."""
+        self._acquire(deadline)
+        try:
+            with self._session.post(self._url(model, 'streamGenerateContent', 'alt=sse&'), json=payload,
+                                    timeout=self._timeouts(deadline), stream=True) as response:
+                if response.status_code >= 400:
+                    raise GeminiError(f"{response.status_code} error from model {model}: {response.text[:200]}",
+                                      status_code=response.status_code)
+                for line in response.iter_lines(decode_unicode=True):
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise GeminiError("Deadline exceeded while streaming.")
+                    if line and line.startswith('data:'):
+                        yield json.loads(line[len('data:'):])
+        except requests.RequestException as e:
+            raise GeminiError(str(e)) from e
+        finally:
+            self._semaphore.release()
+
+    def cached_content(self, model, system_instruction, ttl=3600):
+        """
+        Returns the name of a cachedContents resource holding `system_instruction` for
+        `model`, creating it on first use. Returns None if the API refuses (e.g. the
+        prompt is below the model's minimum cacheable size); refusals are remembered
+        until the TTL passes so every call doesn't retry the creation.
+        """
+        key = (model, hashlib.sha256(system_instruction.encode('utf-8')).hexdigest())
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._cached_contents.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+        body = {
+            'model': f"models/{model}",
+            'systemInstruction': {'parts': [{'text': system_instruction}]},
+            'ttl': f"{ttl}s",
+        }
+        name = None
+        try:
+            response = self._session.post(f"{self.base_url}/cachedContents?key={self.api_key}", json=body,
+                                          timeout=self._timeouts(None))
+            if response.status_code < 400:
+                name = response.json().get('name')
+        except requests.RequestException as e:
+            print(f"Could not create cached content for {model}: {e}")
+        with self._cache_lock:
+            # Expire a little early so a cache is never referenced after the server drops it.
+            self._cached_contents[key] = (name, now + ttl * 0.9)
+        return name
+
+    def close(self):
+        self._session.close()
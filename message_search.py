@@ -0,0 +1,131 @@
+import os
+import re
+import html
+from sqlalchemy import DateTime, text
+
+# Highlight markers that cannot occur in chat text; they become <mark> tags after escaping.
+_MARK_START, _MARK_END = "\x02", "\x03"
+TS_CONFIG = os.environ.get('SEARCH_TS_CONFIG', 'english')
+_installed = set()
+
+# --- SQLite: an FTS5 index over message.content, kept in sync by triggers ---
+# The owning user is indexed as a token in its own column, so a query is restricted to
+# one user inside FTS5 itself instead of ranking every user's matches and then filtering.
+# The index stores its own copy of each row (content and owner), so triggers remove a row
+# by rowid alone, even after its conversation has been deleted.
+# Prefix indexes on 2 and 3 characters keep search-as-you-type queries off full term scans.
+_OWNER = "(SELECT 'u' || user_id FROM conversation WHERE id = {row}.conversation_id)"
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+       content, owner, tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+       INSERT INTO message_fts(rowid, content, owner) VALUES (new.id, new.content, {_OWNER.format(row='new')});
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+       DELETE FROM message_fts WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN
+       UPDATE message_fts SET content = new.content WHERE rowid = old.id;
+       END""",
+]
+_SQLITE_BACKFILL = """INSERT INTO message_fts(rowid, content, owner)
+    SELECT message.id, message.content, 'u' || conversation.user_id
+    FROM message JOIN conversation ON conversation.id = message.conversation_id"""
+
+# --- PostgreSQL: a generated tsvector column with a GIN index ---
+_POSTGRES_DDL = [
+    f"""ALTER TABLE message ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('{TS_CONFIG}', coalesce(content, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_message_search_vector ON message USING GIN (search_vector)",
+]
+
+def install(engine):
+    """
+    Creates the search index for the engine's backend if it is missing and backfills it
+    from existing messages. Safe to call repeatedly; `flask init-db` calls it, and
+    search() calls it on first use.
+    """
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'message_fts'")).first()
+            for statement in _SQLITE_DDL:
+                connection.execute(text(statement))
+            if not exists:
+                connection.execute(text(_SQLITE_BACKFILL))
+    elif engine.dialect.name == 'postgresql':
+        with engine.begin() as connection:
+            for statement in _POSTGRES_DDL:
+                connection.execute(text(statement))
+    else:
+        raise RuntimeError(f"Message search is not supported on {engine.dialect.name}.")
+    _installed.add(engine.url)
+
+def _fts_query(query):
+    """
+    Turns free text into a safe FTS5 query: every word is quoted (so operators in user
+    input are literal) and the last one matches as a prefix, for search-as-you-type.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def _highlight(snippet):
+    escaped = html.escape(snippet or "")
+    return escaped.replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+def search(session, user_id, query, limit=20, offset=0):
+    """
+    Ranked full-text search over one user's messages. Returns a list of dicts with the
+    message and conversation ids, sender, conversation title, creation time, rank and
+    an HTML snippet in which matches are wrapped in <mark>.
+    """
+    engine = session.get_bind()
+    if engine.url not in _installed:
+        install(engine)
+
+    if engine.dialect.name == 'sqlite':
+        match = _fts_query(query)
+        if match is None:
+            return []
+        rows = session.execute(text(
+            """SELECT message.id, message.conversation_id, message.sender, message.created_at, conversation.title,
+                      snippet(message_fts, 0, :start, :end, '…', 16) AS snippet, bm25(message_fts) AS rank
+               FROM message_fts
+               JOIN message ON message.id = message_fts.rowid
+               JOIN conversation ON conversation.id = message.conversation_id
+               WHERE message_fts MATCH :match
+               ORDER BY rank LIMIT :limit OFFSET :offset""").columns(created_at=DateTime),
+            {'match': f'owner:"u{int(user_id)}" AND content:({match})', 'start': _MARK_START, 'end': _MARK_END,
+             'limit': limit, 'offset': offset}).all()
+        # bm25() is lower-is-better; flip it so every backend reports higher-is-better.
+        ranks = [-row.rank for row in rows]
+    else:
+        # Rank and page on the index first; only the page's rows pay for ts_headline.
+        rows = session.execute(text(
+            f"""SELECT page.id, page.conversation_id, page.sender, page.created_at, page.title,
+                       ts_headline('{TS_CONFIG}', page.content, page.query,
+                                   'StartSel=' || :start || ', StopSel=' || :end || ', MaxFragments=2, MaxWords=30') AS snippet,
+                       page.rank
+                FROM (SELECT message.id, message.conversation_id, message.sender, message.created_at, message.content,
+                             conversation.title, query, ts_rank(message.search_vector, query) AS rank
+                      FROM message JOIN conversation ON conversation.id = message.conversation_id,
+                           websearch_to_tsquery('{TS_CONFIG}', :query) AS query
+                      WHERE conversation.user_id = :user_id AND message.search_vector @@ query
+                      ORDER BY rank DESC LIMIT :limit OFFSET :offset) AS page
+                ORDER BY page.rank DESC""").columns(created_at=DateTime),
+            {'query': query, 'user_id': user_id, 'start': _MARK_START, 'end': _MARK_END,
+             'limit': limit, 'offset': offset}).all()
+        ranks = [row.rank for row in rows]
+
+    return [{
+        'message_id': row.id,
+        'conversation_id': row.conversation_id,
+        'conversation_title': row.title,
+        'sender': row.sender,
+        'created_at': row.created_at.isoformat(),
+        'rank': round(rank, 4),
+        'snippet': _highlight(row.snippet),
+    } for row, rank in zip(rows, ranks)]
@@ -0,0 +1,206 @@
+import time
+import functools
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class NoModelAvailable(Exception):
+    """Raised when every model in the chain failed for a request."""
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def _report_discarded(on_discarded, model, future):
+    # Done-callback for a hedged request that lost the race; its result is not returned.
+    if future.exception() is None:
+        on_discarded(future.result(), model)
+
+class ModelStats:
+    """Rolling health statistics and circuit-breaker state for one model."""
+
+    def __init__(self, window):
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.outcomes = deque(maxlen=window)   # True/False for the most recent calls
+        self.latencies = deque(maxlen=window)  # seconds, successful calls only
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.cooldown = 0.0
+        self.last_error = None
+
+    def success_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else None
+
+    def to_dict(self, now):
+        latencies = sorted(self.latencies)
+        rate = self.success_rate()
+        return {
+            'state': 'open' if self.open_until > now else ('half_open' if self.cooldown else 'closed'),
+            'successes': self.successes,
+            'failures': self.failures,
+            'rate_limited': self.rate_limited,
+            'server_errors': self.server_errors,
+            'success_rate': round(rate, 3) if rate is not None else None,
+            'latency_p50_ms': round(_percentile(latencies, 50) * 1000) if latencies else None,
+            'latency_p95_ms': round(_percentile(latencies, 95) * 1000) if latencies else None,
+            'latency_p99_ms': round(_percentile(latencies, 99) * 1000) if latencies else None,
+            'consecutive_failures': self.consecutive_failures,
+            'cooldown_s': round(self.cooldown, 1),
+            'retry_in_s': round(max(0.0, self.open_until - now), 1),
+            'last_error': self.last_error,
+        }
+
+class ModelRouter:
+    """
+    Orders a model fallback chain by observed health.
+    A model's circuit opens after `failure_threshold` consecutive failures (immediately
+    for 404s, which mean the model is gone) and stays open for an exponentially growing
+    cooldown. Once the cooldown passes the model is retried (half-open); a success
+    closes the circuit again. Healthy models keep their configured order unless their
+    recent success rate falls behind another model's.
+    """
+
+    def __init__(self, models, failure_threshold=3, base_cooldown=30.0, max_cooldown=900.0,
+                 window=100, min_samples=5, hedge_delay=None):
+        self.models = list(models)
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.min_samples = min_samples
+        self.hedge_delay = hedge_delay
+        self._stats = {model: ModelStats(window) for model in self.models}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='hedge')
+
+    def ordered_models(self):
+        """Returns the chain to try: closed/half-open models first by health, open circuits last."""
+        now = time.monotonic()
+        with self._lock:
+            def sort_key(item):
+                index, model = item
+                stats = self._stats[model]
+                is_open = stats.open_until > now
+                rate = stats.success_rate()
+                # Bucket the success rate so noise doesn't reshuffle comparable models.
+                reliability = int(rate * 10) if rate is not None and len(stats.outcomes) >= self.min_samples else 10
+                return (is_open, stats.open_until if is_open else 0, -reliability, index)
+            return [model for _, model in sorted(enumerate(self.models), key=sort_key)]
+
+    def available_models(self):
+        """Like ordered_models, but skips open circuits unless every circuit is open."""
+        now = time.monotonic()
+        ordered = self.ordered_models()
+        with self._lock:
+            available = [model for model in ordered if self._stats[model].open_until <= now]
+        return available or ordered
+
+    def record_success(self, model, latency):
+        with self._lock:
+            stats = self._stats[model]
+            stats.successes += 1
+            stats.outcomes.append(True)
+            stats.latencies.append(latency)
+            stats.consecutive_failures = 0
+            stats.open_until = 0.0
+            stats.cooldown = 0.0
+
+    def record_failure(self, model, status_code=None, error=None):
+        with self._lock:
+            stats = self._stats[model]
+            stats.failures += 1
+            stats.outcomes.append(False)
+            stats.consecutive_failures += 1
+            stats.last_error = str(error)[:200] if error else None
+            if status_code == 429:
+                stats.rate_limited += 1
+            elif status_code and status_code >= 500:
+                stats.server_errors += 1
+
+            if status_code == 404:
+                stats.cooldown = self.max_cooldown
+            elif stats.consecutive_failures >= self.failure_threshold or stats.cooldown:
+                # A failed half-open probe doubles the cooldown.
+                stats.cooldown = min(self.max_cooldown, stats.cooldown * 2 if stats.cooldown else self.base_cooldown)
+            else:
+                return
+            stats.open_until = time.monotonic() + stats.cooldown
+
+    def _attempt(self, func, model):
+        started = time.monotonic()
+        try:
+            result = func(model)
+        except Exception as e:
+            print(f"Model {model} failed: {e}")
+            self.record_failure(model, getattr(e, 'status_code', None), e)
+            raise
+        self.record_success(model, time.monotonic() - started)
+        return result
+
+    def _hedge_delay_for(self, model):
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        with self._lock:
+            latencies = sorted(self._stats[model].latencies)
+        # Start the backup request once the primary is slower than its usual p95.
+        return _percentile(latencies, 95) if len(latencies) >= self.min_samples else 2.0
+
+    def call(self, func, hedge=False, deadline=None, on_discarded=None):
+        """
+        Calls func(model) down the health-ordered chain and returns (result, model).
+        With hedge=True the second-best model is raced against the first if the first
+        hasn't answered within its usual latency; the first success wins, and a losing
+        request that also succeeds is passed to on_discarded(result, model) when it
+        finishes, so its cost can still be accounted for. No further model is tried once `deadline` (a time.monotonic() value) has passed, so models
+        are not marked failed for lack of time.
+        """
+        chain = self.available_models()
+        if hedge and len(chain) >= 2:
+            primary, backup = chain[0], chain[1]
+            print(f"Attempting to call model: {primary} (hedged with {backup})...")
+            futures = {self._executor.submit(contextvars.copy_context().run, self._attempt, func, primary): primary}
+            done, _ = wait(futures, timeout=self._hedge_delay_for(primary))
+            if not done:
+                futures[self._executor.submit(contextvars.copy_context().run, self._attempt, func, backup)] = backup
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        print(f"Success with model: {futures[future]}")
+                        if on_discarded is not None:
+                            for loser in set(futures) - {future}:
+                                loser.add_done_callback(functools.partial(_report_discarded, on_discarded, futures[loser]))
+                        return future.result(), futures[future]
+            chain = [model for model in chain if model not in futures.values()]
+
+        for model in chain:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise NoModelAvailable("The LLM deadline passed before a model answered.")
+            print(f"Attempting to call model: {model}...")
+            try:
+                result = self._attempt(func, model)
+            except Exception:
+                continue
+            print(f"Success with model: {model}")
+            return result, model
+        raise NoModelAvailable("All models in the chain failed.")
+
+    def typical_latency(self):
+        """Median latency in seconds of the model currently first in line, or None without samples."""
+        model = self.available_models()[0]
+        with self._lock:
+            latencies = sorted(self._stats[model].latencies)
+        return _percentile(latencies, 50)
+
+    def snapshot(self):
+        """Per-model health and the current effective order, for the admin endpoint."""
+        now = time.monotonic()
+        with self._lock:
+            models = {model: stats.to_dict(now) for model, stats in self._stats.items()}
+        return {'order': self.ordered_models(), 'models': models}
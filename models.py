@@ -2,6 +2,8 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import json
+import zlib
 
 db = SQLAlchemy()
 
@@ -26,6 +28,9 @@ class Conversation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan")
 
+    # Serves the keyset-paginated history list (newest first per user).
+    __table_args__ = (db.Index('ix_conversation_user_created', 'user_id', 'created_at', 'id'),)
+
     def to_dict(self):
         return { 'id': self.id, 'title': self.title, 'created_at': self.created_at.isoformat() }
 
@@ -37,6 +42,10 @@ class Message(db.Model):
     content = db.Column(db.Text, nullable=False)
     model_used = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    events = db.relationship('AgentEvent', backref='message', lazy=True, cascade="all, delete-orphan", passive_deletes=True)
+
+    # Serves keyset pagination over a conversation's transcript.
+    __table_args__ = (db.Index('ix_message_conversation_created', 'conversation_id', 'created_at', 'id'),)
 
     def to_dict(self):
         return {
@@ -46,3 +55,86 @@ class Message(db.Model):
             'model_used': self.model_used,
             'created_at': self.created_at.isoformat()
         }
+
+class AgentJob(db.Model):
+    """A queued agent run, executed by the background worker pool."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    events = db.relationship('JobEvent', backref='job', lazy=True, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.Index('ix_agent_job_status_created', 'status', 'created_at'),
+        db.Index('ix_agent_job_user_status', 'user_id', 'status'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'conversation_id': self.conversation_id,
+            'status': self.status,
+            'cancel_requested': self.cancel_requested,
+            'attempts': self.attempts,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class JobEvent(db.Model):
+    """One event produced by a background agent run, stored in order as it happens."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('agent_job.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON-encoded event dict
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('job_id', 'seq'),)
+
+    def to_dict(self):
+        return {'seq': self.seq, **json.loads(self.payload)}
+
+class AgentEvent(db.Model):
+    """One step of an autonomous loop run (thought, tool call/output, usage, answer), linked to the AI message it produced."""
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    turn = db.Column(db.Integer, nullable=True)
+    type = db.Column(db.String(30), nullable=False)
+    tool_name = db.Column(db.String(100), nullable=True)
+    arguments = db.Column(db.Text, nullable=True)
+    duration_ms = db.Column(db.Integer, nullable=True)
+    output_size = db.Column(db.Integer, nullable=True)  # uncompressed size of `content` in bytes
+    model = db.Column(db.String(100), nullable=True)
+    content = db.Column(db.LargeBinary, nullable=False)  # UTF-8, zlib-compressed when `compressed`
+    compressed = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_agent_event_message_seq', 'message_id', 'seq'),
+        db.Index('ix_agent_event_tool', 'tool_name', 'duration_ms'),
+    )
+
+    def to_dict(self):
+        content = zlib.decompress(self.content) if self.compressed else self.content
+        return {
+            'seq': self.seq,
+            'turn': self.turn,
+            'type': self.type,
+            'tool_name': self.tool_name,
+            'arguments': self.arguments,
+            'duration_ms': self.duration_ms,
+            'output_size': self.output_size,
+            'model': self.model,
+            'content': content.decode('utf-8'),
+            'created_at': self.created_at.isoformat(),
+        }
@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import uuid
+import queue
+import signal
+import threading
+import subprocess
+from workspaces import OUTPUTS_DIR
+
+MAX_BYTES = int(os.environ.get('TOOL_OUTPUT_MAX_BYTES', 16 * 1024 * 1024))
+HEAD_BYTES = int(os.environ.get('TOOL_OUTPUT_HEAD_BYTES', 4000))
+TAIL_BYTES = int(os.environ.get('TOOL_OUTPUT_TAIL_BYTES', 4000))
+PROGRESS_BYTES = int(os.environ.get('TOOL_PROGRESS_BYTES', 64 * 1024))
+# Spill files kept per workspace: when a new one starts, older ones are deleted beyond the
+# newest TOOL_OUTPUTS_KEEP, or while they and the new one (at its MAX_BYTES) would exceed TOOL_OUTPUTS_MAX_MB.
+# This cap stands in for the workspace quota, which does not count OUTPUTS_DIR.
+OUTPUTS_KEEP = int(os.environ.get('TOOL_OUTPUTS_KEEP', 20))
+OUTPUTS_MAX_BYTES = int(float(os.environ.get('TOOL_OUTPUTS_MAX_MB', 64)) * 1024 * 1024)
+
+class BoundedOutput:
+    """
+    Captures one output stream in bounded memory. It keeps the first `head_bytes` and
+    the last `tail_bytes`. Once the output outgrows both, everything (up to `max_bytes`)
+    is also spilled to a file under the workspace's .outputs/ directory, so the agent
+    can page through it later. `exceeded` turns true at `max_bytes`; the caller should
+    then kill the producer.
+    """
+
+    def __init__(self, workspace, label, max_bytes=MAX_BYTES, head_bytes=HEAD_BYTES, tail_bytes=TAIL_BYTES,
+                 on_chunk=None):
+        self.workspace = workspace
+        self.label = label
+        self.max_bytes = max_bytes
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.on_chunk = on_chunk
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.exceeded = False
+        self.spill_path = None
+        self._spill = None
+
+    def write(self, data):
+        if self.exceeded:
+            return
+        if self.total + len(data) > self.max_bytes:
+            data = data[:self.max_bytes - self.total]
+            self.exceeded = True
+        self.total += len(data)
+        if self.on_chunk is not None:
+            self.on_chunk(data)
+
+        if len(self.head) < self.head_bytes:
+            take = self.head_bytes - len(self.head)
+            self.head += data[:take]
+            data = data[take:]
+        if self.spill_path is None and len(self.tail) + len(data) > self.tail_bytes:
+            # From here on the middle would be lost, so start spilling; nothing has been dropped yet.
+            self._open_spill()
+        if self._spill is not None:
+            self._spill.write(data)
+        self.tail += data
+        if len(self.tail) > self.tail_bytes:
+            del self.tail[:len(self.tail) - self.tail_bytes]
+
+    def _open_spill(self):
+        directory = os.path.join(self.workspace, OUTPUTS_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self._prune(directory)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}-{self.label}.log"
+        self.spill_path = os.path.join(OUTPUTS_DIR, name)
+        self._spill = open(os.path.join(self.workspace, self.spill_path), 'wb')
+        self._spill.write(self.head)
+        self._spill.write(self.tail)
+
+    def _prune(self, directory):
+        """Deletes the oldest spill files so this one fits within OUTPUTS_KEEP and OUTPUTS_MAX_BYTES."""
+        spills = []
+        for name in os.listdir(directory):
+            try:
+                info = os.lstat(os.path.join(directory, name))
+            except OSError:
+                continue
+            spills.append((info.st_mtime_ns, os.path.join(directory, name), info.st_size))
+        kept = total = 0
+        for _, path, size in sorted(spills, reverse=True):  # newest first
+            if kept < OUTPUTS_KEEP - 1 and total + size + self.max_bytes <= OUTPUTS_MAX_BYTES:
+                kept += 1
+                total += size
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def text(self):
+        """The retained output, with an elision marker where the middle was dropped."""
+        self.close()
+        if self.spill_path is None:
+            return (bytes(self.head) + bytes(self.tail)).decode('utf-8', 'replace')
+        elided = self.total - len(self.head) - len(self.tail)
+        note = f"\n... [{elided} bytes elided; full output ({self.total} bytes) saved to {self.spill_path}] ...\n"
+        if self.exceeded:
+            note += f"[output capped at {self.max_bytes} bytes; the process was stopped]\n"
+        return self.head.decode('utf-8', 'replace') + note + self.tail.decode('utf-8', 'replace')
+
+def progress_forwarder(report, tool_name, stream, budget=PROGRESS_BYTES):
+    """
+    Returns an on_chunk callback that forwards live output to `report(event)` as
+    'tool_progress' events, up to `budget` bytes per stream. Returns None when no
+    reporter is set.
+    """
+    if report is None:
+        return None
+    remaining = [budget]
+
+    def on_chunk(data):
+        if remaining[0] <= 0:
+            return
+        chunk = data[:remaining[0]]
+        remaining[0] -= len(chunk)
+        report({'type': 'tool_progress', 'tool_name': tool_name, 'stream': stream,
+                'content': chunk.decode('utf-8', 'replace')})
+        if remaining[0] <= 0:
+            report({'type': 'tool_progress', 'tool_name': tool_name, 'stream': stream,
+                    'content': "\n[live output truncated; the full output follows when the tool finishes]\n"})
+    return on_chunk
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, AttributeError):
+        process.kill()
+
+# Sets RLIMIT_FSIZE and then execs the command. This runs in the child instead of a
+# preexec_fn, which is unsafe to use from a threaded server. SIGXFSZ is ignored so
+# oversized writes fail with EFBIG; both settings survive exec.
+_FSIZE_WRAPPER = (
+    "import os, sys, signal, resource\n"
+    "limit, hard = int(sys.argv[1]), resource.getrlimit(resource.RLIMIT_FSIZE)[1]\n"
+    "resource.setrlimit(resource.RLIMIT_FSIZE, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))\n"
+    "signal.signal(signal.SIGXFSZ, signal.SIG_IGN)\n"
+    "os.execvp(sys.argv[2], sys.argv[2:])\n"
+)
+
+def _with_file_size_limit(args, shell, fsize_bytes):
+    if shell:
+        args = ['/bin/sh', '-c', args]
+    elif isinstance(args, str):
+        args = [args]
+    return [sys.executable, '-c', _FSIZE_WRAPPER, str(fsize_bytes), *args]
+
+def run_process(args, cwd, timeout, stdout, stderr, shell=False, fsize_bytes=None):
+    """
+    Runs a process, reading its pipes incrementally into the two BoundedOutput objects.
+    The whole process group is killed on timeout or once either stream hits its cap.
+    fsize_bytes, if given, caps the size of any file the process writes (POSIX only).
+    Returns (returncode, timed_out).
+    """
+    if fsize_bytes is not None and os.name == 'posix':
+        args, shell = _with_file_size_limit(args, shell, fsize_bytes), False
+    process = subprocess.Popen(args, shell=shell, cwd=cwd, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    chunks = queue.Queue()
+
+    def drain(name, pipe):
+        fd = pipe.fileno()
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except OSError:  # closed after the process was killed
+                data = b""
+            chunks.put((name, data))
+            if not data:
+                return
+
+    for name, pipe in (('stdout', process.stdout), ('stderr', process.stderr)):
+        threading.Thread(target=drain, args=(name, pipe), daemon=True).start()
+
+    outputs = {'stdout': stdout, 'stderr': stderr}
+    open_streams = 2
+    timed_out = False
+    deadline = time.monotonic() + timeout
+    while open_streams:
+        try:
+            name, data = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            timed_out = True
+            _kill_group(process)
+            break
+        if not data:
+            open_streams -= 1
+            continue
+        outputs[name].write(data)
+        if outputs[name].exceeded:
+            _kill_group(process)
+            break
+    try:
+        returncode = process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        _kill_group(process)
+        returncode = process.wait()
+    process.stdout.close()
+    process.stderr.close()
+    return returncode, timed_out
@@ -0,0 +1,273 @@
+import os
+import math
+import time
+import sqlite3
+import threading
+import instrumentation
+
+# Per-user token buckets (0 disables a limit). /ask requests refill at ASK_RATE_PER_MINUTE
+# up to a burst of ASK_BURST. LLM tokens refill at TOKEN_BUDGET_PER_HOUR up to TOKEN_BURST;
+# a run is charged as it goes and may overdraw, after which the user is refused until the
+# balance is positive again.
+ASK_RATE_PER_MINUTE = float(os.environ.get('ASK_RATE_PER_MINUTE', 10))
+ASK_BURST = float(os.environ.get('ASK_BURST', 20))
+TOKEN_BUDGET_PER_HOUR = float(os.environ.get('TOKEN_BUDGET_PER_HOUR', 1_000_000))
+TOKEN_BURST = float(os.environ.get('TOKEN_BURST', TOKEN_BUDGET_PER_HOUR))
+# Buckets and usage live in memory unless RATE_LIMIT_DB names a SQLite file, which lets
+# every worker process on the host share them.
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB')
+# Admission: at most MAX_INFLIGHT_RUNS agent runs at once in this process. Up to
+# MAX_WAITING_RUNS more wait ADMISSION_WAIT seconds for a slot; the rest are refused.
+MAX_INFLIGHT_RUNS = int(os.environ.get('MAX_INFLIGHT_RUNS', 8))
+MAX_WAITING_RUNS = int(os.environ.get('MAX_WAITING_RUNS', 16))
+ADMISSION_WAIT = float(os.environ.get('ADMISSION_WAIT', 10))
+
+USAGE_FIELDS = ('requests', 'rejected', 'runs', 'turns', 'prompt_tokens', 'response_tokens')
+
+REJECTIONS = instrumentation.Counter('rate_limit_rejections_total', "Requests refused by the rate limiter or "
+                                     "admission control.", ('reason',))
+ADMISSION_WAIT_SECONDS = instrumentation.Histogram('admission_wait_seconds', "Time agent runs waited for a slot.")
+
+class RateLimited(Exception):
+    """A request refused by a limit; retry_after is in whole seconds."""
+    def __init__(self, message, reason, retry_after, status_code=429):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status_code = status_code
+
+def _take(tokens, updated, now, cost, rate, capacity, force):
+    """
+    Refills a bucket and takes `cost` from it if it holds at least max(cost, 1), or in
+    any case with force. Returns (allowed, tokens, seconds until it would be allowed).
+    """
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    needed = max(cost, 1)
+    if force or tokens >= needed:
+        return True, tokens - cost, 0.0
+    return False, tokens, (needed - tokens) / rate
+
+# --- Stores ---
+class MemoryStore:
+    """Buckets and usage counters for this process only."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def take(self, bucket, key, cost, rate, capacity, force=False):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get((bucket, key), (capacity, now))
+            allowed, tokens, retry_after = _take(tokens, updated, now, cost, rate, capacity, force)
+            self._buckets[(bucket, key)] = (tokens, now)
+        return allowed, tokens, retry_after
+
+    def add_usage(self, user_id, **counts):
+        with self._lock:
+            usage = self._usage.setdefault(user_id, dict.fromkeys(USAGE_FIELDS, 0))
+            for field, value in counts.items():
+                usage[field] += value
+            usage['updated'] = time.time()
+
+    def usage(self, user_id):
+        with self._lock:
+            return dict(self._usage.get(user_id) or dict.fromkeys(USAGE_FIELDS, 0))
+
+    def top_usage(self, limit=50):
+        with self._lock:
+            rows = [{'user_id': user_id, **usage} for user_id, usage in self._usage.items()]
+        return sorted(rows, key=lambda row: row['prompt_tokens'] + row['response_tokens'], reverse=True)[:limit]
+
+class SQLiteStore:
+    """Buckets and usage counters in a SQLite file shared by the worker processes on a host."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS bucket (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (name, key)
+            );
+            CREATE TABLE IF NOT EXISTS usage (
+                user_id INTEGER PRIMARY KEY,
+                {", ".join(f"{field} INTEGER NOT NULL DEFAULT 0" for field in USAGE_FIELDS)},
+                updated REAL
+            );
+        """)
+
+    def take(self, bucket, key, cost, rate, capacity, force=False):
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so the read-modify-write is
+            # atomic across processes.
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT tokens, updated FROM bucket WHERE name = ? AND key = ?",
+                                       (bucket, str(key))).fetchone()
+                tokens, updated = (row['tokens'], row['updated']) if row else (capacity, now)
+                allowed, tokens, retry_after = _take(tokens, updated, now, cost, rate, capacity, force)
+                self._db.execute("INSERT OR REPLACE INTO bucket (name, key, tokens, updated) VALUES (?, ?, ?, ?)",
+                                 (bucket, str(key), tokens, now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return allowed, tokens, retry_after
+
+    def add_usage(self, user_id, **counts):
+        columns = ", ".join(counts)
+        updates = ", ".join(f"{field} = {field} + excluded.{field}" for field in counts)
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO usage (user_id, {columns}, updated) VALUES (?, {', '.join('?' * len(counts))}, ?) "
+                f"ON CONFLICT (user_id) DO UPDATE SET {updates}, updated = excluded.updated",
+                (user_id, *counts.values(), time.time()))
+
+    def usage(self, user_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM usage WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return dict.fromkeys(USAGE_FIELDS, 0)
+        return {key: row[key] for key in row.keys() if key != 'user_id'}
+
+    def top_usage(self, limit=50):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM usage ORDER BY prompt_tokens + response_tokens DESC LIMIT ?",
+                                    (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+# --- Per-user limits ---
+class RateLimiter:
+    """
+    Two token buckets per user: one for /ask requests and one for LLM tokens. Requests
+    are checked before a run starts; tokens are charged while it runs, from the
+    responses' usageMetadata.
+    """
+
+    def __init__(self, store, requests_per_minute=ASK_RATE_PER_MINUTE, request_burst=ASK_BURST,
+                 tokens_per_hour=TOKEN_BUDGET_PER_HOUR, token_burst=TOKEN_BURST):
+        self.store = store
+        self.request_rate = requests_per_minute / 60
+        self.request_burst = request_burst
+        self.token_rate = tokens_per_hour / 3600
+        self.token_burst = token_burst
+
+    def check_request(self, user_id):
+        """Counts a request and takes it from the user's buckets; raises RateLimited if it must wait."""
+        try:
+            if self.token_rate > 0:
+                allowed, _, retry_after = self.store.take('tokens', user_id, 0, self.token_rate, self.token_burst)
+                if not allowed:
+                    raise RateLimited("LLM token budget exhausted.", 'tokens', retry_after)
+            if self.request_rate > 0:
+                allowed, _, retry_after = self.store.take('requests', user_id, 1, self.request_rate, self.request_burst)
+                if not allowed:
+                    raise RateLimited("Too many requests.", 'requests', retry_after)
+        except RateLimited as e:
+            REJECTIONS.inc(reason=e.reason)
+            self.store.add_usage(user_id, requests=1, rejected=1)
+            raise
+        self.store.add_usage(user_id, requests=1)
+
+    def charge(self, user_id, prompt_tokens=0, response_tokens=0, turns=0, runs=0):
+        """Records a run, turns and LLM tokens for the user; returns the token balance left (inf when unlimited)."""
+        self.store.add_usage(user_id, prompt_tokens=prompt_tokens, response_tokens=response_tokens,
+                             turns=turns, runs=runs)
+        if self.token_rate <= 0:
+            return math.inf
+        _, balance, _ = self.store.take('tokens', user_id, prompt_tokens + response_tokens, self.token_rate,
+                                        self.token_burst, force=True)
+        return balance
+
+    def usage(self, user_id):
+        """The user's counters, current bucket balances and the configured limits."""
+        balances = {}
+        for name, rate, burst in (('requests', self.request_rate, self.request_burst),
+                                  ('tokens', self.token_rate, self.token_burst)):
+            if rate > 0:
+                _, balance, retry_after = self.store.take(name, user_id, 0, rate, burst)
+                balances[name] = {'available': math.floor(balance), 'capacity': burst,
+                                  'refill_per_minute': rate * 60, 'retry_after': math.ceil(retry_after)}
+        return {'usage': self.store.usage(user_id), 'limits': balances}
+
+# --- Admission control ---
+class Slot:
+    """One admitted run; release() may be called more than once."""
+    __slots__ = ('admission', 'started', 'released')
+
+    def __init__(self, admission):
+        self.admission = admission
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.admission._release(time.monotonic() - self.started)
+
+class Admission:
+    """
+    Caps concurrent agent runs in this process. A run beyond `capacity` queues for up to
+    `wait_seconds`; when the queue is full or the wait times out it is refused with a
+    Retry-After estimated from the average run time.
+    """
+
+    def __init__(self, capacity=MAX_INFLIGHT_RUNS, max_waiting=MAX_WAITING_RUNS, wait_seconds=ADMISSION_WAIT):
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self.average_seconds = 10.0
+        self._condition = threading.Condition()
+
+    def retry_after(self):
+        return self.average_seconds * (self.waiting + 1) / max(1, self.capacity)
+
+    def acquire(self):
+        """Returns a Slot once a run may start; raises RateLimited (503) if it cannot start soon."""
+        if self.capacity <= 0:
+            return Slot(self)
+        started = time.monotonic()
+        with self._condition:
+            if self.in_flight >= self.capacity:
+                if self.waiting >= self.max_waiting:
+                    REJECTIONS.inc(reason='capacity')
+                    raise RateLimited("The server is busy.", 'capacity', self.retry_after(), 503)
+                self.waiting += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self.in_flight < self.capacity, self.wait_seconds)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    REJECTIONS.inc(reason='capacity')
+                    raise RateLimited("The server is busy.", 'capacity', self.retry_after(), 503)
+            self.in_flight += 1
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started)
+        return Slot(self)
+
+    def _release(self, seconds):
+        if self.capacity <= 0:
+            return
+        with self._condition:
+            self.in_flight -= 1
+            self.average_seconds = 0.8 * self.average_seconds + 0.2 * seconds
+            self._condition.notify()
+
+    def snapshot(self):
+        with self._condition:
+            return {'in_flight': self.in_flight, 'waiting': self.waiting, 'capacity': self.capacity,
+                    'average_run_seconds': round(self.average_seconds, 2)}
+
+limiter = RateLimiter(SQLiteStore(RATE_LIMIT_DB) if RATE_LIMIT_DB else MemoryStore())
+admission = Admission()
@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import signal
+import threading
+import subprocess
+
+try:
+    import resource
+except ImportError:  # not available on Windows; limits are then skipped
+    resource = None
+
+_HERE = os.path.abspath(__file__)
+
+# --- Worker side (runs in the sandbox subprocess) ---
+def _worker_main():
+    """
+    Sandbox worker loop. It preloads the requested modules, reports ready, then serves
+    one JSON request per stdin line. Code output goes to the real stdout/stderr file
+    descriptors, so subprocesses spawned by the code are captured too. The end of each
+    run is marked on both streams with a per-run token; the stdout marker is followed
+    by the JSON result.
+    """
+    import io
+    import traceback
+    import importlib
+
+    requests_in = sys.stdin
+    # Limits are set here rather than in a preexec_fn, which is unsafe in the threaded parent.
+    memory_mb = int(os.environ.get('SANDBOX_MEMORY_MB') or 0)
+    if resource is not None and memory_mb:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_mb * 1024 * 1024, memory_mb * 1024 * 1024))
+    if hasattr(signal, 'SIGXFSZ'):
+        # Writes past the per-run file size limit then fail with EFBIG instead of killing the worker.
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    for name in filter(None, os.environ.get('SANDBOX_PRELOAD', '').split(',')):
+        try:
+            importlib.import_module(name.strip())
+        except Exception as e:
+            print(f"Preload of {name} failed: {e}", file=sys.stderr)
+    os.write(1, b"\x00SANDBOX-READY\x00\n")
+
+    namespace = None
+    fsize_hard = resource.getrlimit(resource.RLIMIT_FSIZE)[1] if resource is not None else None
+    for line in requests_in:
+        request = json.loads(line)
+        marker = request['marker'].encode()
+        if namespace is None or not request.get('persistent'):
+            namespace = {'__name__': '__main__', '__builtins__': __builtins__}
+        if resource is not None and request.get('cpu_seconds'):
+            used = resource.getrusage(resource.RUSAGE_SELF)
+            used_seconds = int(used.ru_utime + used.ru_stime) + 1
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            resource.setrlimit(resource.RLIMIT_CPU, (used_seconds + request['cpu_seconds'], hard))
+
+        os.chdir(request['cwd'])
+        scratch = request['scratch']
+        with open(scratch, 'w', encoding='utf-8') as f:
+            f.write(request['code'])
+        if resource is not None and request.get('fsize_bytes') is not None:
+            resource.setrlimit(resource.RLIMIT_FSIZE, (request['fsize_bytes'], fsize_hard))
+        namespace['__file__'] = scratch
+        sys.argv = [scratch]
+        sys.stdin = io.StringIO("")
+        started = time.perf_counter()
+        try:
+            exec(compile(request['code'], scratch, 'exec'), namespace)
+        except SystemExit:
+            pass
+        except BaseException:
+            exc_type, exc_value, tb = sys.exc_info()
+            # Drop this function's frame so the traceback starts in the user's code.
+            traceback.print_exception(exc_type, exc_value, tb.tb_next)
+        exec_ms = (time.perf_counter() - started) * 1000
+        if resource is not None and request.get('fsize_bytes') is not None:
+            resource.setrlimit(resource.RLIMIT_FSIZE, (fsize_hard, fsize_hard))
+        sys.stdin = requests_in
+        try:
+            os.remove(scratch)
+        except OSError:
+            pass
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.write(2, marker)
+        os.write(1, marker + json.dumps({'exec_ms': exec_ms}).encode() + b"\n")
+
+# --- Parent side ---
+READY_MARKER = b"\x00SANDBOX-READY\x00\n"
+
+class SandboxWorker:
+    """One pre-started interpreter process plus reader threads that drain its output pipes."""
+
+    def __init__(self, python, preload, memory_mb, cwd):
+        started = time.perf_counter()
+        env = {**os.environ, 'SANDBOX_PRELOAD': ",".join(preload), 'SANDBOX_MEMORY_MB': str(memory_mb or 0),
+               'PYTHONUNBUFFERED': '1'}
+        self.process = subprocess.Popen(
+            [python, _HERE, '--worker'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=cwd, env=env, start_new_session=True,
+        )
+        self.chunks = queue.Queue()
+        for name, pipe in (('stdout', self.process.stdout), ('stderr', self.process.stderr)):
+            threading.Thread(target=self._drain, args=(name, pipe), daemon=True).start()
+        self.ready = threading.Event()
+        self.spawn_ms = None
+        self._started = started
+        self.last_used = time.monotonic()
+
+    def _drain(self, name, pipe):
+        fd = pipe.fileno()
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                self.chunks.put((name, None))
+                return
+            self.chunks.put((name, data))
+
+    def wait_ready(self, timeout):
+        """Consumes the ready marker; returns False if the worker died or is still loading."""
+        deadline = time.monotonic() + timeout
+        buffer = b""
+        while READY_MARKER not in buffer:
+            try:
+                stream, data = self.chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return False
+            if data is None:
+                return False
+            if stream == 'stdout':
+                buffer += data
+        self.spawn_ms = (time.perf_counter() - self._started) * 1000
+        self.ready.set()
+        return True
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        if self.alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (OSError, AttributeError):
+                self.process.kill()
+        self.process.wait()
+
+    def run(self, code, cwd, scratch, timeout, cpu_seconds, persistent, outputs, fsize_bytes=None):
+        """
+        Runs code, writing its output into outputs['stdout'] and outputs['stderr'] (objects
+        with write(bytes) and an `exceeded` flag, see output_capture.BoundedOutput) as it
+        arrives. fsize_bytes, if given, caps the size of any file the code writes.
+        Returns (exec_ms, stopped); stopped is 'timeout', 'output_cap', 'crashed' or None.
+        """
+        marker = f"\x00SANDBOX-END-{uuid.uuid4().hex}\x00"
+        request = {'code': code, 'cwd': cwd, 'scratch': scratch, 'marker': marker,
+                   'cpu_seconds': cpu_seconds, 'persistent': persistent, 'fsize_bytes': fsize_bytes}
+        self.process.stdin.write((json.dumps(request) + "\n").encode())
+        self.process.stdin.flush()
+        self.last_used = time.monotonic()
+
+        marker_bytes = marker.encode()
+        # Bytes that might be the start of a marker split across reads are held back.
+        pending = {'stdout': bytearray(), 'stderr': bytearray()}
+        finished = {'stdout': False, 'stderr': False}
+        result_line = None
+        deadline = time.monotonic() + timeout
+        while not all(finished.values()) or (result_line is not None and not result_line.endswith(b"\n")):
+            try:
+                stream, data = self.chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return None, 'timeout'
+            if data is None:  # worker died (e.g. hit its memory or CPU limit)
+                finished[stream] = True
+                outputs[stream].write(bytes(pending[stream]))
+                if stream == 'stdout' and result_line is not None:
+                    break
+                continue
+            if finished[stream]:
+                if stream == 'stdout' and result_line is not None:
+                    result_line += data
+                continue
+            buffer = pending[stream]
+            buffer += data
+            index = buffer.find(marker_bytes)
+            if index != -1:
+                outputs[stream].write(bytes(buffer[:index]))
+                finished[stream] = True
+                if stream == 'stdout':
+                    result_line = bytes(buffer[index + len(marker_bytes):])
+                continue
+            keep = len(marker_bytes) - 1
+            if len(buffer) > keep:
+                outputs[stream].write(bytes(buffer[:-keep]))
+                del buffer[:-keep]
+            if outputs[stream].exceeded:
+                return None, 'output_cap'
+        if result_line is None:
+            return None, 'crashed'
+        try:
+            exec_ms = json.loads(result_line.decode()).get('exec_ms')
+        except ValueError:
+            exec_ms = None
+        return exec_ms, None
+
+class SandboxPool:
+    """
+    Keeps `size` pre-started, pre-warmed Python workers (with SANDBOX_PRELOAD modules
+    already imported) so execute_python skips interpreter startup on its critical path.
+    A worker serves one run and is then discarded, so runs never share state; a
+    background thread refills the pool. A run may instead bind to a per-session worker
+    that keeps its globals between calls, like a notebook kernel; runs in one session
+    are serialized. Idle sessions are reaped after `session_ttl` seconds.
+    """
+
+    def __init__(self, size=2, preload=(), memory_mb=1024, cpu_seconds=30, python=None,
+                 max_sessions=8, session_ttl=600, cwd=None):
+        self.size = size
+        self.preload = list(preload)
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self.python = python or sys.executable
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.cwd = cwd or os.getcwd()
+        self._idle = queue.Queue()
+        self._sessions = {}
+        self._session_locks = {}  # session -> Lock held for the length of a run
+        self._sessions_lock = threading.Lock()
+        self._refill = threading.Event()
+        self._refiller = None
+
+    @classmethod
+    def from_env(cls, cwd):
+        return cls(
+            size=int(os.environ.get('SANDBOX_POOL_SIZE', 2)),
+            preload=[name for name in os.environ.get('SANDBOX_PRELOAD', '').split(',') if name],
+            memory_mb=int(os.environ.get('SANDBOX_MEMORY_MB', 1024)),
+            cpu_seconds=int(os.environ.get('SANDBOX_CPU_SECONDS', 30)),
+            python=os.environ.get('SANDBOX_PYTHON'),
+            session_ttl=int(os.environ.get('SANDBOX_SESSION_TTL', 600)),
+            cwd=cwd,
+        )
+
+    def _spawn(self):
+        return SandboxWorker(self.python, self.preload, self.memory_mb, self.cwd)
+
+    def _refill_loop(self):
+        while True:
+            while self._idle.qsize() < self.size:
+                worker = self._spawn()
+                if worker.wait_ready(timeout=120):
+                    self._idle.put(worker)
+                else:
+                    worker.kill()
+                    time.sleep(1)
+            self._reap_sessions()
+            self._refill.wait(timeout=30)
+            self._refill.clear()
+
+    def _ensure_started(self):
+        if self._refiller is None and self.size > 0:
+            self._refiller = threading.Thread(target=self._refill_loop, name="sandbox-refill", daemon=True)
+            self._refiller.start()
+
+    def _acquire(self):
+        """Returns (worker, startup_ms, warm)."""
+        self._ensure_started()
+        started = time.perf_counter()
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker.alive():
+                self._refill.set()
+                return worker, (time.perf_counter() - started) * 1000, True
+            worker.kill()
+        worker = self._spawn()
+        worker.wait_ready(timeout=120)
+        self._refill.set()
+        return worker, (time.perf_counter() - started) * 1000, False
+
+    def _session_worker(self, session):
+        with self._sessions_lock:
+            worker = self._sessions.get(session)
+            if worker is not None and worker.alive():
+                return worker, 0.0, True
+        worker, startup_ms, warm = self._acquire()
+        with self._sessions_lock:
+            self._sessions[session] = worker
+            if len(self._sessions) > self.max_sessions:
+                oldest = min(self._sessions, key=lambda key: self._sessions[key].last_used)
+                self._sessions.pop(oldest).kill()
+        return worker, startup_ms, warm
+
+    def _reap_sessions(self):
+        now = time.monotonic()
+        with self._sessions_lock:
+            expired = [key for key, worker in self._sessions.items() if now - worker.last_used > self.session_ttl
+                       and not self._session_locks.get(key, threading.Lock()).locked()]
+            for key in expired:
+                self._sessions.pop(key).kill()
+                self._session_locks.pop(key, None)
+
+    def run(self, code, cwd, outputs, timeout=30, session=None, fsize_bytes=None):
+        """
+        Runs code in a sandbox worker with `cwd` as its working directory, streaming its
+        output into `outputs` (see SandboxWorker.run). fsize_bytes caps the size of each
+        file the code writes (RLIMIT_FSIZE). Returns a dict with stopped, startup_ms,
+        exec_ms and warm. Runs for the same session wait for each other.
+        """
+        if session is None:
+            return self._run(code, cwd, outputs, timeout, None, fsize_bytes)
+        with self._sessions_lock:
+            lock = self._session_locks.setdefault(session, threading.Lock())
+        with lock:
+            return self._run(code, cwd, outputs, timeout, session, fsize_bytes)
+
+    def _run(self, code, cwd, outputs, timeout, session, fsize_bytes):
+        if session is not None:
+            worker, startup_ms, warm = self._session_worker(session)
+        else:
+            worker, startup_ms, warm = self._acquire()
+        scratch_dir = os.path.join(cwd, ".sandbox")
+        os.makedirs(scratch_dir, exist_ok=True)
+        scratch = os.path.join(scratch_dir, f"run_{uuid.uuid4().hex}.py")
+
+        exec_ms, stopped = worker.run(
+            code, cwd, scratch, timeout, self.cpu_seconds, persistent=session is not None, outputs=outputs,
+            fsize_bytes=fsize_bytes)
+        if stopped or session is None or not worker.alive():
+            worker.kill()
+            if session is not None:
+                with self._sessions_lock:
+                    if self._sessions.get(session) is worker:
+                        del self._sessions[session]
+            if os.path.exists(scratch):
+                os.remove(scratch)
+        return {'stopped': stopped, 'startup_ms': startup_ms, 'exec_ms': exec_ms, 'warm': warm}
+
+if __name__ == '__main__' and '--worker' in sys.argv:
+    _worker_main()
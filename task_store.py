@@ -0,0 +1,152 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+PRIORITIES = ('high', 'medium', 'low')
+STATUSES = ('pending', 'in_progress', 'completed')
+
+class TaskStore:
+    """
+    Todo items in one SQLite file, partitioned by workspace `scope`. Each scope numbers
+    its tasks 1, 2, 3...; the number is assigned in the INSERT itself, so concurrent runs
+    never hand out the same one. Lookups by number and filters by status or priority go
+    through indexes rather than loading every task.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._migrated = set()
+        self._migrate_lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS task (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                task TEXT NOT NULL,
+                priority TEXT NOT NULL DEFAULT 'medium',
+                status TEXT NOT NULL DEFAULT 'pending',
+                created TEXT NOT NULL,
+                updated TEXT
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_task_scope_number ON task (scope, number);
+            CREATE INDEX IF NOT EXISTS ix_task_scope_status ON task (scope, status, number);
+            CREATE INDEX IF NOT EXISTS ix_task_scope_priority ON task (scope, priority, number);
+        """)
+
+    def _write(self, sql, params=()):
+        """
+        Runs one writing statement and returns its rows. BEGIN IMMEDIATE takes the write lock
+        before the statement reads, so a statement that reads then writes (like add's
+        MAX(number) + 1) cannot fail with SQLITE_BUSY_SNAPSHOT when another process wrote
+        in between; a busy lock is waited for up to the connection timeout instead.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(sql, params).fetchall()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def add(self, scope, task, priority='medium', status='pending', created=None, number=None):
+        """Inserts a task and returns its number within the scope."""
+        if number is None:
+            row = self._write(
+                "INSERT INTO task (scope, number, task, priority, status, created) "
+                "SELECT ?, COALESCE(MAX(number), 0) + 1, ?, ?, ?, ? FROM task WHERE scope = ? RETURNING number",
+                (scope, task, priority, status, created or datetime.now().isoformat(), scope))[0]
+        else:
+            row = self._write(
+                "INSERT INTO task (scope, number, task, priority, status, created) VALUES (?, ?, ?, ?, ?, ?) "
+                "RETURNING number", (scope, number, task, priority, status, created or datetime.now().isoformat()))[0]
+        return row['number']
+
+    def update(self, scope, number, **changes):
+        """Changes the given columns (task, priority, status) of one task; returns the updated row or None."""
+        changes = {key: value for key, value in changes.items() if value is not None}
+        assignments = ", ".join(f"{column} = ?" for column in changes)
+        rows = self._write(
+            f"UPDATE task SET {assignments}{', ' if assignments else ''}updated = ? "
+            "WHERE scope = ? AND number = ? RETURNING *",
+            (*changes.values(), datetime.now().isoformat(), scope, number))
+        return rows[0] if rows else None
+
+    def list(self, scope, status=None, priority=None, limit=100):
+        """Tasks in the scope in creation order, optionally only those with a status and/or priority."""
+        query, params = "SELECT * FROM task WHERE scope = ?", [scope]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        if priority:
+            query += " AND priority = ?"
+            params.append(priority)
+        with self._lock:
+            return self._db.execute(query + " ORDER BY number LIMIT ?", (*params, limit)).fetchall()
+
+    def counts(self, scope):
+        """{status: n} for the scope."""
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM task WHERE scope = ? GROUP BY status",
+                                         (scope,)).fetchall())
+
+    def copy_scope(self, source, target):
+        """Copies every task of one scope into another, keeping their numbers (for workspace forks)."""
+        self._write("INSERT OR IGNORE INTO task (scope, number, task, priority, status, created, updated) "
+                    "SELECT ?, number, task, priority, status, created, updated FROM task WHERE scope = ?",
+                    (target, source))
+
+    def drop_scope(self, scope):
+        with self._lock:
+            self._db.execute("DELETE FROM task WHERE scope = ?", (scope,))
+            self._migrated.discard(scope)
+
+    def migrate_json(self, scope, json_path):
+        """
+        Imports a legacy tasks.json into the scope once, then renames it to tasks.json.migrated.
+        Its ids are kept as task numbers; ids duplicated by the old store's races, or that are
+        not positive integers, get new ones. A priority or status the store does not know
+        becomes 'medium' or 'pending'. Returns the number of tasks imported.
+        """
+        if scope in self._migrated:
+            return 0
+        with self._migrate_lock:
+            if scope in self._migrated:
+                return 0
+            imported = 0
+            if os.path.exists(json_path):
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    todos = json.load(f)
+                seen = {row['number'] for row in self.list(scope, limit=-1)}
+                for todo in todos:
+                    number = todo.get('id')
+                    valid = isinstance(number, int) and not isinstance(number, bool) and number > 0
+                    number = number if valid and number not in seen else None
+                    priority = todo.get('priority') if todo.get('priority') in PRIORITIES else 'medium'
+                    status = todo.get('status') if todo.get('status') in STATUSES else 'pending'
+                    seen.add(self.add(scope, todo.get('task', ''), priority, status, todo.get('created'), number))
+                    imported += 1
+                os.replace(json_path, json_path + ".migrated")
+                print(f"Migrated {imported} todos from {json_path}")
+            self._migrated.add(scope)
+            return imported
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """The shared task store at TASKS_DB (default: tasks.db under the workspaces root), opened on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            default = os.path.join(os.environ.get('WORKSPACES_ROOT', 'workspaces'), 'tasks.db')
+            _store = TaskStore(os.environ.get('TASKS_DB', default))
+        return _store
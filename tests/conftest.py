@@ -0,0 +1,53 @@
+"""
+Test setup. Every runtime path (database, workspaces, task store, fetch cache) points into
+one temporary directory, and nothing needs network access or a real API key. The
+environment is set before any app module is imported, because they read it at import time.
+"""
+import os
+import sys
+import tempfile
+import itertools
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))  # stub_gemini
+
+RUNTIME = tempfile.mkdtemp(prefix='agent-tests-')
+os.environ.update({
+    'API_KEY': 'stub',
+    'DATABASE_URL': f"sqlite:///{os.path.join(RUNTIME, 'app.db')}",
+    'WORKSPACES_ROOT': os.path.join(RUNTIME, 'workspaces'),
+    'TASKS_DB': os.path.join(RUNTIME, 'tasks.db'),
+    'FETCH_CACHE_DB': os.path.join(RUNTIME, 'fetch-cache.db'),
+    'JOB_WORKERS': '0',
+    'SANDBOX_POOL_SIZE': '0',
+    'WORKSPACE_REAP_INTERVAL': '0',
+})
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def application():
+    """One app for the session, with its tables created."""
+    import app as module
+    from models import db
+    application = module.create_app({'TESTING': True})
+    with application.app_context():
+        db.create_all()
+    return application
+
+
+@pytest.fixture
+def user_client(application):
+    """A test client logged in as a new user; returns (client, user_id)."""
+    from models import User
+    client = application.test_client()
+    username, password = f"user{next(_usernames)}", 'secret'
+    client.post('/register', data={'username': username, 'password': password})
+    client.post('/login', data={'username': username, 'password': password})
+    with application.app_context():
+        user_id = User.query.filter_by(username=username).first().id
+    return client, user_id
@@ -0,0 +1,131 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import chat_routes
+from job_queue import JobQueue, job_queue
+from models import db, AgentJob, Conversation, JobEvent, User
+
+
+@pytest.fixture
+def queue(application):
+    """A JobQueue bound to the app without worker threads; jobs are claimed by hand."""
+    queue = JobQueue()
+    queue.init_app(application, runner=lambda job: [], autostart=False)
+    with application.app_context():
+        # Start from an empty queue: other tests leave their jobs behind.
+        JobEvent.query.delete()
+        AgentJob.query.delete()
+        db.session.commit()
+    return queue
+
+
+_users = iter(range(1, 10**6))
+
+
+def _conversation(application):
+    """A new user and one of their conversations; returns (user_id, conversation_id)."""
+    with application.app_context():
+        user = User(username=f"jobs{next(_users)}")
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.flush()
+        conversation = Conversation(user_id=user.id, title='Jobs')
+        db.session.add(conversation)
+        db.session.commit()
+        return user.id, conversation.id
+
+
+def test_claims_respect_the_per_user_limit(application, queue):
+    alice, bob = _conversation(application), _conversation(application)
+    with application.app_context():
+        first, second = (queue.enqueue(*alice, f"a{n}").id for n in range(2))
+        bobs = queue.enqueue(*bob, "b").id
+        assert queue._claim_next().id == first
+        assert queue._claim_next().id == bobs  # alice is at her limit of 1
+        assert queue._claim_next() is None
+        db.session.get(AgentJob, first).status = 'succeeded'
+        db.session.commit()
+        assert queue._claim_next().id == second
+
+
+def test_enqueue_caps_queued_jobs_per_user(application, queue):
+    user = _conversation(application)
+    queue.max_queued_per_user = 2
+    with application.app_context():
+        assert queue.enqueue(*user, "1") is not None
+        assert queue.enqueue(*user, "2") is not None
+        assert queue.enqueue(*user, "3") is None
+
+
+def test_stale_running_job_is_reclaimed(application, queue):
+    user = _conversation(application)
+    with application.app_context():
+        job_id = queue.enqueue(*user, "work").id
+        assert queue._claim_next().id == job_id
+        assert queue._claim_next() is None
+        job = db.session.get(AgentJob, job_id)
+        job.heartbeat_at = datetime.utcnow() - timedelta(seconds=queue.lease_seconds + 5)
+        db.session.commit()
+        reclaimed = queue._claim_next()
+        assert reclaimed.id == job_id and reclaimed.attempts == 2
+
+
+def test_concurrent_claims_never_exceed_the_limit(application, queue):
+    user = _conversation(application)
+    with application.app_context():
+        for n in range(6):
+            queue.enqueue(*user, str(n))
+    claimed, barrier = [], threading.Barrier(4)
+
+    def claim():
+        with application.app_context():
+            barrier.wait()
+            job = queue._claim_next()
+            if job is not None:
+                claimed.append(job.id)
+
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(claimed) == 1
+
+
+def test_run_records_events_and_failure(application, queue):
+    user = _conversation(application)
+    queue.runner = lambda job: [{'type': 'token', 'content': 'x'}, {'type': 'error', 'content': 'boom', 'fatal': True}]
+    with application.app_context():
+        job_id = queue.enqueue(*user, "work").id
+        queue._run(queue._claim_next())
+        job = db.session.get(AgentJob, job_id)
+        assert (job.status, job.error) == ('failed', 'boom')
+        assert [event.seq for event in job.events] == [1, 2]
+
+
+def test_cancelling_a_queued_job_is_immediate(application, queue):
+    user = _conversation(application)
+    with application.app_context():
+        job = queue.enqueue(*user, "work")
+        queue.cancel(job)
+        assert job.status == 'cancelled'
+        assert queue._claim_next() is None
+
+
+def test_stream_of_a_stuck_job_ends_with_an_error(user_client, application, monkeypatch):
+    client, user_id = user_client
+    monkeypatch.setattr(chat_routes, 'JOB_STREAM_IDLE_SECONDS', 0.3)
+    monkeypatch.setattr(chat_routes, 'JOB_STREAM_POLL_SECONDS', 0.05)
+    with application.app_context():
+        conversation = Conversation(user_id=user_id, title='Stuck')
+        db.session.add(conversation)
+        db.session.commit()
+        job_id = job_queue.enqueue(user_id, conversation.id, "never runs").id  # no workers in tests
+
+    response = client.get(f'/api/jobs/{job_id}/stream')
+    events = [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).splitlines()
+              if line.startswith('data: ')]
+    assert events[-1]['type'] == 'error' and events[-1]['status'] == 'queued'
@@ -0,0 +1,68 @@
+import time
+import pytest
+import stub_gemini
+from llm_client import GeminiClient, GeminiError
+
+@pytest.fixture
+def stub():
+    server, stub, base_url = stub_gemini.start(latency_ms=20, jitter_ms=0, stream_chunks=4, seed=1)
+    yield stub, GeminiClient('stub', base_url=base_url, max_concurrency=2)
+    server.shutdown()
+
+def _payload(text):
+    return {'contents': [{'role': 'user', 'parts': [{'text': text}]}]}
+
+def _text(response):
+    return "".join(part.get('text', '') for part in response['candidates'][0]['content']['parts'])
+
+def test_generate_returns_the_scripted_reply(stub):
+    stub, client = stub
+    response = client.generate('model-a', _payload("hello"))
+    assert _text(response) == stub_gemini.DEFAULT_SCRIPT['answer']
+    assert response['usageMetadata']['candidatesTokenCount'] > 0
+    assert stub.stats()['generate'] == 1
+
+def test_stream_yields_chunks_that_add_up_to_the_reply(stub):
+    stub, client = stub
+    chunks = list(client.stream('model-a', _payload("hello")))
+    assert len(chunks) == 4
+    assert "".join(_text(chunk) for chunk in chunks) == stub_gemini.DEFAULT_SCRIPT['answer']
+    assert 'usageMetadata' in chunks[-1]
+
+def test_error_status_raises_with_the_status_code(stub):
+    stub, client = stub
+    stub.failure_rate = 1.0
+    with pytest.raises(GeminiError) as error:
+        client.generate('model-a', _payload("hello"))
+    assert error.value.status_code == 503
+
+def test_deadline_bounds_a_slow_call(stub):
+    stub, client = stub
+    stub.latency_ms = 2000
+    started = time.monotonic()
+    with pytest.raises(GeminiError):
+        client.generate('model-a', _payload("hello"), deadline=time.monotonic() + 0.2)
+    assert time.monotonic() - started < 1.5
+
+def test_expired_deadline_fails_before_sending(stub):
+    stub, client = stub
+    with pytest.raises(GeminiError, match="Deadline exceeded"):
+        client.generate('model-a', _payload("hello"), deadline=time.monotonic() - 1)
+    assert stub.stats()['generate'] == 0
+
+def test_call_agent_llm_stops_walking_the_chain_at_the_deadline(stub, monkeypatch):
+    import app
+    stub, client = stub
+    monkeypatch.setattr(app, '_llm_client', client)
+    monkeypatch.setattr(app, 'model_router', app.ModelRouter(app.AGENT_MODELS))
+    usage = {}
+    text, model = app.call_agent_llm("hello", usage=usage)
+    assert text == stub_gemini.DEFAULT_SCRIPT['answer'] and model == app.model_router.available_models()[0]
+    assert usage['candidatesTokenCount'] > 0
+
+    stub.latency_ms = 2000
+    monkeypatch.setattr(app, 'LLM_DEADLINE', 0.3)
+    started = time.monotonic()
+    assert app.call_agent_llm("hello") == (None, None)
+    assert time.monotonic() - started < 1.5
+    assert stub.stats()['generate'] == 2  # the first call and the slow one; no fallback model was tried
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from model_router import ModelRouter, NoModelAvailable
+
+
+def test_falls_through_to_next_model():
+    router = ModelRouter(['a', 'b'])
+
+    def func(model):
+        if model == 'a':
+            raise RuntimeError('down')
+        return model.upper()
+
+    assert router.call(func) == ('B', 'b')
+    assert router.snapshot()['models']['a']['failures'] == 1
+
+
+def test_expired_deadline_stops_the_chain():
+    router = ModelRouter(['a', 'b'])
+    with pytest.raises(NoModelAvailable):
+        router.call(lambda model: model, deadline=time.monotonic() - 1)
+    assert router.snapshot()['models']['a']['failures'] == 0
+
+
+def test_hedged_loser_is_reported_not_returned():
+    router = ModelRouter(['slow', 'fast'], hedge_delay=0.02)
+    discarded, reported = [], threading.Event()
+
+    def func(model):
+        time.sleep(0.2 if model == 'slow' else 0.0)
+        return {'model': model, 'tokens': len(model)}
+
+    def on_discarded(result, model):
+        discarded.append((result, model))
+        reported.set()
+
+    result, model = router.call(func, hedge=True, on_discarded=on_discarded)
+    assert (result, model) == ({'model': 'fast', 'tokens': 4}, 'fast')
+    assert reported.wait(2)
+    assert discarded == [({'model': 'slow', 'tokens': 4}, 'slow')]
+
+
+def test_app_hedging_keeps_winner_usage_and_charges_loser(monkeypatch):
+    import app
+    import rate_limit
+
+    replies = {'slow': {'promptTokenCount': 10, 'candidatesTokenCount': 100},
+               'fast': {'promptTokenCount': 10, 'candidatesTokenCount': 1}}
+
+    class FakeClient:
+        def generate(self, model, payload, deadline=None):
+            time.sleep(0.2 if model == 'slow' else 0.0)
+            return {'candidates': [{'content': {'parts': [{'text': model}]}}],
+                    'usageMetadata': replies[model]}
+
+    charged, reported = [], threading.Event()
+
+    class Limiter:
+        def charge(self, user_id, prompt_tokens=0, response_tokens=0, turns=0, runs=0):
+            charged.append((user_id, prompt_tokens, response_tokens))
+            reported.set()
+
+    monkeypatch.setattr(app, '_llm_client', FakeClient())
+    monkeypatch.setattr(app, 'model_router', ModelRouter(['slow', 'fast'], hedge_delay=0.02))
+    monkeypatch.setattr(app, 'LLM_HEDGING', True)
+    monkeypatch.setattr(rate_limit, 'limiter', Limiter())
+
+    usage = {}
+    assert app.call_agent_llm('hi', usage=usage, user_id=7) == ('fast', 'fast')
+    assert usage == replies['fast']
+    assert reported.wait(2)
+    assert charged == [(7, 10, 100)]
@@ -0,0 +1,54 @@
+import os
+import threading
+
+import pytest
+
+from output_capture import BoundedOutput, run_process
+from sandbox import SandboxPool
+
+posix_only = pytest.mark.skipif(os.name != 'posix', reason="rlimits are POSIX only")
+
+
+def _outputs(tmp_path):
+    return {'stdout': BoundedOutput(str(tmp_path), 'stdout'), 'stderr': BoundedOutput(str(tmp_path), 'stderr')}
+
+
+@posix_only
+def test_run_process_caps_file_size(tmp_path):
+    outputs = _outputs(tmp_path)
+    returncode, timed_out = run_process("head -c 100000 /dev/zero > big.bin; echo done", cwd=str(tmp_path),
+                                        timeout=10, shell=True, fsize_bytes=4096, **outputs)
+    assert not timed_out
+    assert os.path.getsize(tmp_path / 'big.bin') == 4096
+    assert 'done' in outputs['stdout'].text()
+
+
+@posix_only
+def test_run_process_without_limit_runs_argv(tmp_path):
+    outputs = _outputs(tmp_path)
+    returncode, _ = run_process(['echo', 'plain'], cwd=str(tmp_path), timeout=10, **outputs)
+    assert returncode == 0 and 'plain' in outputs['stdout'].text()
+
+
+@posix_only
+def test_worker_applies_memory_limit_itself(tmp_path):
+    pool = SandboxPool(size=0, memory_mb=256, cwd=str(tmp_path))
+    outputs = _outputs(tmp_path)
+    result = pool.run("import resource; print(resource.getrlimit(resource.RLIMIT_AS)[0])", str(tmp_path), outputs)
+    assert result['stopped'] is None
+    assert outputs['stdout'].text().strip() == str(256 * 1024 * 1024)
+
+
+def test_session_runs_are_serialized(tmp_path):
+    pool = SandboxPool(size=0, memory_mb=0, cwd=str(tmp_path))
+    pool.run("count = 0", str(tmp_path), _outputs(tmp_path), session='s')
+    code = "import time\nvalue = count\ntime.sleep(0.2)\ncount = value + 1"
+    threads = [threading.Thread(target=pool.run, args=(code, str(tmp_path), _outputs(tmp_path)),
+                                kwargs={'session': 's'}) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    outputs = _outputs(tmp_path)
+    pool.run("print(count)", str(tmp_path), outputs, session='s')
+    assert outputs['stdout'].text().strip() == '3'
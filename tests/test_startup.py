@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+# Runs in a fresh interpreter so modules imported by other tests do not count.
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app
+application = app.create_app()
+created = time.perf_counter()
+status = application.test_client().get('/').status_code
+print(json.dumps({'ms': (created - started) * 1000, 'status': status,
+                  'loaded': [name for name in ('tools', 'sandbox', 'llm_client', 'requests') if name in sys.modules]}))
+"""
+
+
+def test_import_and_create_app_stay_lazy():
+    result = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=os.environ.copy(),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report['status'] == 200
+    assert report['loaded'] == []
+    # Generous: the point is that no tool registry, sandbox or HTTP stack is built up front.
+    assert report['ms'] < 5000
+
+
+def test_system_prompt_is_built_on_first_use():
+    import app
+    app.system_prompt.cache_clear()
+    prompt = app.system_prompt()
+    assert 'autonomous_loop' in prompt
+    assert app.system_prompt() is prompt
+    assert app.dispatcher_prompt().startswith(app.fast_router.dispatcher_prompt(prompt)[:50])
@@ -0,0 +1,71 @@
+import json
+import threading
+
+import pytest
+
+from task_store import TaskStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'tasks.db')
+
+
+def test_numbers_are_per_scope(db_path):
+    store = TaskStore(db_path)
+    assert [store.add('a', 'one'), store.add('a', 'two'), store.add('b', 'other')] == [1, 2, 1]
+    store.update('a', 2, status='completed')
+    assert [row['task'] for row in store.list('a', status='completed')] == ['two']
+    assert store.counts('a') == {'pending': 1, 'completed': 1}
+
+
+def test_concurrent_adds_get_distinct_numbers(db_path):
+    # Separate connections, as separate processes would have.
+    stores = [TaskStore(db_path) for _ in range(4)]
+    numbers, errors, barrier = [], [], threading.Barrier(8)
+
+    def add_many(store):
+        barrier.wait()
+        for n in range(25):
+            try:
+                numbers.append(store.add('shared', f"task {n}"))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=add_many, args=(stores[index % 4],)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sorted(numbers) == list(range(1, 201))
+
+
+def test_copy_scope_keeps_numbers(db_path):
+    store = TaskStore(db_path)
+    store.add('src', 'one')
+    store.add('src', 'two', priority='high')
+    store.copy_scope('src', 'dst')
+    assert [(row['number'], row['priority']) for row in store.list('dst')] == [(1, 'medium'), (2, 'high')]
+    assert store.add('dst', 'three') == 3
+
+
+def test_migrate_json_sanitises_legacy_tasks(db_path, tmp_path):
+    legacy = tmp_path / 'tasks.json'
+    legacy.write_text(json.dumps([
+        {'id': 1, 'task': 'kept', 'priority': 'high', 'status': 'completed'},
+        {'id': 1, 'task': 'duplicate id'},
+        {'id': True, 'task': 'bool id'},
+        {'id': 0, 'task': 'zero id'},
+        {'id': 'x', 'task': 'string id', 'priority': 'urgent', 'status': 'done'},
+        {'id': 7, 'task': 'gap', 'priority': None},
+    ]))
+    store = TaskStore(db_path)
+    assert store.migrate_json('scope', str(legacy)) == 6
+    rows = {row['task']: row for row in store.list('scope')}
+    assert (rows['kept']['number'], rows['kept']['priority'], rows['kept']['status']) == (1, 'high', 'completed')
+    assert rows['gap']['number'] == 7 and rows['gap']['priority'] == 'medium'
+    assert (rows['string id']['priority'], rows['string id']['status']) == ('medium', 'pending')
+    assert len({row['number'] for row in rows.values()}) == 6
+    assert not legacy.exists() and (tmp_path / 'tasks.json.migrated').exists()
+    assert store.migrate_json('scope', str(legacy)) == 0
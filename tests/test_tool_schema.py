@@ -0,0 +1,79 @@
+import pytest
+
+import tool_schema
+from tool_schema import ToolCallError, extract_calls, parse_call
+
+
+def test_positional_and_keyword_arguments():
+    call = parse_call("write_file('notes.txt', content='hi\\nthere')")
+    assert (call.name, call.args, call.kwargs) == ('write_file', ('notes.txt',), {'content': 'hi\nthere'})
+
+
+def test_json_words_are_converted_at_any_depth():
+    call = parse_call('configure(true, options={"retry": {"enabled": false}, "tags": [null, true]})')
+    assert call.args == (True,)
+    assert call.kwargs == {'options': {'retry': {'enabled': False}, 'tags': [None, True]}}
+
+
+@pytest.mark.parametrize('text', [
+    'read_file({[1]: 2})',          # unhashable key: TypeError from literal_eval
+    'read_file(path)',              # a bare name
+    'read_file(open("x"))',         # a nested call
+    'read_file(' + '[' * 500 + ')',  # nesting the parser refuses
+])
+def test_bad_arguments_raise_tool_call_error(text):
+    with pytest.raises(ToolCallError):
+        parse_call(text)
+
+
+def test_extract_calls_reports_errors_instead_of_raising():
+    calls, errors = extract_calls('<tool_code>read_file({[1]: 2})</tool_code>', count=False)
+    assert calls == [] and len(errors) == 1
+
+
+def test_trailing_text_is_trimmed_unless_strict():
+    assert parse_call("list_directory('.') and then more").args == ('.',)
+    with pytest.raises(ToolCallError):
+        parse_call("list_directory('.') and then more", strict=True)
+
+
+def test_extract_calls_formats():
+    calls, errors = extract_calls("Thinking.\n<tool_code>a(1)</tool_code>\n<tool_code>b(x=2)</tool_code>", count=False)
+    assert [call.name for call in calls] == ['a', 'b'] and errors == []
+    calls, _ = extract_calls("```tool_code\nc('z')\n```", count=False)
+    assert calls[0].name == 'c'
+    calls, _ = extract_calls('```json\n{"tool_call": {"name": "d", "parameters": {"k": 1}}}\n```', count=False)
+    assert (calls[0].name, calls[0].kwargs) == ('d', {'k': 1})
+
+
+def test_unclosed_tag_counts_only_when_a_call_follows():
+    calls, _ = extract_calls("Reading it.\n<tool_code>read_file('a.txt')", count=False)
+    assert calls[0].args == ('a.txt',)
+    calls, errors = extract_calls("Use <tool_code> blocks to call tools.", count=False)
+    assert calls == [] and errors == []
+
+
+def test_response_text_renders_function_calls_and_tolerates_empty_candidates():
+    response = {'candidates': [{'content': {'parts': [
+        {'text': 'Checking.'}, {'functionCall': {'name': 'read_file', 'args': {'path': 'a.txt'}}}]}}]}
+    text = tool_schema.response_text(response)
+    assert parse_call(extract_calls(text, count=False)[0][0].text).kwargs == {'path': 'a.txt'}
+    assert tool_schema.response_text({'candidates': [{'finishReason': 'SAFETY'}]}) == ''
+    assert tool_schema.response_text({'promptFeedback': {'blockReason': 'SAFETY'}}) == ''
+
+
+def test_empty_candidate_falls_through_to_next_model(monkeypatch):
+    import app
+    from model_router import ModelRouter
+
+    class FakeClient:
+        def generate(self, model, payload, deadline=None):
+            if model == 'blocked':
+                return {'candidates': [{'finishReason': 'MAX_TOKENS'}]}
+            return {'candidates': [{'content': {'parts': [{'text': 'answer'}]}}]}
+
+    router = ModelRouter(['blocked', 'ok'])
+    monkeypatch.setattr(app, '_llm_client', FakeClient())
+    monkeypatch.setattr(app, 'model_router', router)
+    assert app.call_agent_llm('hi') == ('answer', 'ok')
+    assert 'MAX_TOKENS' in router.snapshot()['models']['blocked']['last_error']
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import web_fetch
+
+PAGE = b"<html><head><title>Doc</title></head><body><main><p>Hello from the test server.</p></main></body></html>"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    hits = Counter()
+    conditional = Counter()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path
+        Handler.hits[path] += 1
+        if self.headers.get('If-None-Match'):
+            Handler.conditional[path] += 1
+        html = ('Content-Type', 'text/html; charset=utf-8')
+        if path == '/etag':
+            if self.headers.get('If-None-Match') == '"v1"':
+                return self._send(304, headers=[('ETag', '"v1"'), ('Cache-Control', 'max-age=0')])
+            return self._send(200, PAGE, [html, ('ETag', '"v1"'), ('Cache-Control', 'max-age=0')])
+        if path == '/fresh':
+            return self._send(200, PAGE, [html, ('Cache-Control', 'max-age=60')])
+        if path == '/no-store':
+            return self._send(200, PAGE, [html, ('Cache-Control', 'no-store')])
+        if path == '/stray-304':
+            # Like a misbehaving intermediary: 304 unless the client insists on a fresh copy.
+            if self.headers.get('Cache-Control') != 'no-cache':
+                return self._send(304)
+            return self._send(200, PAGE, [html])
+        if path == '/big':
+            return self._send(200, b"x" * 5000, [('Content-Type', 'text/plain'), ('Cache-Control', 'max-age=60')])
+        if path == '/slow':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Cache-Control', 'max-age=60')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for _ in range(6):
+                self.wfile.write(b"a\r\n" + b"0123456789" + b"\r\n")
+                self.wfile.flush()
+                time.sleep(0.15)
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        if path == '/missing':
+            return self._send(404, b"nope", [('Content-Type', 'text/plain')])
+        self._send(500)
+
+
+@pytest.fixture(scope='module')
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    web_fetch.get_cache().clear()
+    Handler.hits.clear()
+    Handler.conditional.clear()
+
+
+def test_fresh_entry_is_served_without_a_request(server):
+    first = web_fetch.fetch(server + '/fresh')
+    assert (first.source, first.title) == ('fetched', 'Doc')
+    assert 'Hello from the test server.' in first.text
+    second = web_fetch.fetch(server + '/fresh')
+    assert second.source == 'cached' and second.text == first.text
+    assert Handler.hits['/fresh'] == 1
+
+
+def test_stale_entry_is_revalidated_with_its_etag(server):
+    assert web_fetch.fetch(server + '/etag').source == 'fetched'
+    again = web_fetch.fetch(server + '/etag')
+    assert again.source == 'revalidated' and 'Hello' in again.text
+    assert Handler.conditional['/etag'] == 1
+
+
+def test_304_without_a_cache_entry_refetches(server):
+    page = web_fetch.fetch(server + '/stray-304')
+    assert page.status == 200 and 'Hello' in page.text
+    assert Handler.hits['/stray-304'] == 2
+
+
+def test_no_store_is_not_cached(server):
+    web_fetch.fetch(server + '/no-store')
+    assert web_fetch.fetch(server + '/no-store').source == 'fetched'
+    assert Handler.hits['/no-store'] == 2
+
+
+def test_body_is_capped_at_max_bytes(server, monkeypatch):
+    monkeypatch.setattr(web_fetch, 'FETCH_MAX_BYTES', 1000)
+    page = web_fetch.fetch(server + '/big')
+    assert page.truncated and page.size == 1000 and len(page.text) == 1000
+    # A size-capped body is complete as far as it goes, so it is cached.
+    assert web_fetch.fetch(server + '/big').source == 'cached'
+
+
+def test_body_cut_off_by_the_deadline_is_not_cached(server, monkeypatch):
+    monkeypatch.setattr(web_fetch, 'FETCH_TIMEOUT', 0.4)
+    page = web_fetch.fetch(server + '/slow')
+    assert page.truncated and 0 < page.size < 60
+    assert web_fetch.fetch(server + '/slow').source == 'fetched'
+    assert Handler.hits['/slow'] == 2
+
+
+def test_http_errors_raise_fetch_error(server):
+    with pytest.raises(web_fetch.FetchError) as error:
+        web_fetch.fetch(server + '/missing')
+    assert error.value.status_code == 404
+    with pytest.raises(web_fetch.FetchError):
+        web_fetch.fetch('ftp://example.com/file')
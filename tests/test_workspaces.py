@@ -0,0 +1,178 @@
+import os
+import time
+import shutil
+
+import pytest
+
+import workspace_index
+import workspaces
+from workspaces import QuotaExceeded
+
+
+@pytest.fixture
+def quota(monkeypatch):
+    monkeypatch.setattr(workspaces, 'QUOTA_BYTES', 1000)
+    monkeypatch.setattr(workspaces, 'QUOTA_FILES', 3)
+
+
+def test_writes_are_charged_and_capped(quota):
+    workspace = workspaces.get(101, 1)
+    workspace.write(os.path.join(workspace.path, 'a.txt'), 'x' * 600)
+    assert workspace.usage() == (600, 1)
+    with pytest.raises(QuotaExceeded):
+        workspace.write(os.path.join(workspace.path, 'b.txt'), 'x' * 500)
+    # Replacing a file is charged the difference.
+    workspace.write(os.path.join(workspace.path, 'a.txt'), 'x' * 900)
+    assert workspace.usage() == (900, 1)
+    assert workspace.room() == 100
+
+
+def test_file_count_limit(quota):
+    workspace = workspaces.get(101, 2)
+    for name in ('a', 'b', 'c'):
+        workspace.write(os.path.join(workspace.path, name), '')
+    with pytest.raises(QuotaExceeded):
+        workspace.write(os.path.join(workspace.path, 'd'), '')
+
+
+def test_internal_files_are_not_charged_or_listed(quota):
+    workspace = workspaces.get(101, 3)
+    workspace.touch(force=True)
+    for directory in (workspaces.OUTPUTS_DIR, workspaces.SANDBOX_DIR):
+        os.makedirs(os.path.join(workspace.path, directory), exist_ok=True)
+        with open(os.path.join(workspace.path, directory, 'big.log'), 'wb') as f:
+            f.write(b'x' * 5000)
+    with open(os.path.join(workspace.path, workspaces.SHARED_MARKER), 'w'):
+        pass
+    with open(os.path.join(workspace.path, 'real.txt'), 'w') as f:
+        f.write('hello')
+    assert workspace.refresh() == (5, 1)
+
+    import tools
+    tools.TOOL_CONTEXT.set({'user_id': 101, 'conversation_id': 3})
+    assert tools.list_directory('.').split('\n') == ['real.txt']
+    assert 'big.log' in tools.list_directory(workspaces.OUTPUTS_DIR)
+
+
+def test_refresh_sees_files_written_by_code(quota):
+    workspace = workspaces.get(101, 4)
+    assert workspace.usage() == (0, 0)
+    os.makedirs(os.path.join(workspace.path, 'sub'))
+    with open(os.path.join(workspace.path, 'sub', 'out.bin'), 'wb') as f:
+        f.write(b'x' * 1200)
+    assert workspace.refresh() == (1200, 1)
+    assert workspace.room() == 0
+    assert 'over its quota' in workspace.over_quota_note()
+
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink', 'auto'])
+def test_fork_snapshots_files_without_sharing_writes(mode):
+    source = workspaces.get(102, 1)
+    source.write(os.path.join(source.path, 'notes.txt'), 'original')
+    source.write(os.path.join(source.path, 'dir', 'data.csv'), 'a,b\n')
+    os.makedirs(os.path.join(source.path, workspaces.SANDBOX_DIR), exist_ok=True)
+    target_id = {'copy': 2, 'hardlink': 3, 'auto': 4}[mode]
+
+    counts = workspaces.fork(102, 1, target_id, mode=mode)
+    target = workspaces.get(102, target_id)
+    assert counts['files'] == 2
+    assert not os.path.exists(os.path.join(target.path, workspaces.SANDBOX_DIR))
+    assert target.usage()[1] == 2
+
+    target.write(os.path.join(target.path, 'notes.txt'), 'changed')
+    target.unshare_links()
+    with open(os.path.join(target.path, 'dir', 'data.csv'), 'a') as f:
+        f.write('c,d\n')
+    with open(os.path.join(source.path, 'notes.txt')) as f:
+        assert f.read() == 'original'
+    with open(os.path.join(source.path, 'dir', 'data.csv')) as f:
+        assert f.read() == 'a,b\n'
+
+
+def test_reap_removes_idle_workspaces_and_forgets_them(monkeypatch):
+    workspace = workspaces.get(103, 1)
+    workspace.touch(force=True)
+    workspace_index.get_index(workspace.path)
+    old = time.time() - 10 * 86400
+    os.utime(os.path.join(workspace.path, workspaces.LAST_USED_FILE), (old, old))
+    monkeypatch.setattr(workspaces, 'IDLE_SECONDS', 86400)
+    monkeypatch.setattr(workspaces, 'MIN_IDLE_SECONDS', 60)
+
+    assert workspaces.reap() >= 1
+    assert not os.path.exists(workspace.path)
+    assert workspace.path not in workspaces._workspaces
+    assert workspace.path not in workspace_index._indexes
+
+
+def test_workspace_reaped_elsewhere_is_recreated():
+    workspace = workspaces.get(103, 2)
+    workspace.write(os.path.join(workspace.path, 'a.txt'), 'abc')
+    shutil.rmtree(workspace.path)  # as if another process reaped it
+    again = workspaces.get(103, 2)
+    assert again is not workspace
+    assert os.path.isdir(again.path) and again.usage() == (0, 0)
+
+
+def test_active_workspace_is_not_reaped(monkeypatch):
+    workspace = workspaces.get(103, 3)
+    monkeypatch.setattr(workspaces, 'IDLE_SECONDS', 0)
+    monkeypatch.setattr(workspaces, 'MIN_IDLE_SECONDS', 0)
+    with workspace.in_use():
+        workspaces.reap(now=time.time() + 10)
+        assert os.path.isdir(workspace.path)
+
+
+def test_fork_route_copies_messages_and_files(user_client, application):
+    from models import db, Conversation, Message
+    client, user_id = user_client
+    with application.app_context():
+        conversation = Conversation(user_id=user_id, title='Original')
+        db.session.add(conversation)
+        db.session.flush()
+        messages = [Message(conversation_id=conversation.id, sender=sender, content=text)
+                    for sender, text in (('user', 'one'), ('ai', 'two'), ('user', 'three'))]
+        db.session.add_all(messages)
+        db.session.commit()
+        conversation_id, second = conversation.id, messages[1].id
+    source = workspaces.get(user_id, conversation_id)
+    source.write(os.path.join(source.path, 'file.txt'), 'data')
+
+    response = client.post(f'/api/conversation/{conversation_id}/fork', json={'message_id': second})
+    assert response.status_code == 201
+    fork = response.get_json()
+    assert fork['workspace']['files'] == 1
+    assert os.path.exists(os.path.join(workspaces.path_for(user_id, fork['id']), 'file.txt'))
+    with application.app_context():
+        assert [m.content for m in Message.query.filter_by(conversation_id=fork['id']).order_by(Message.id)] == \
+            ['one', 'two']
+
+
+@pytest.mark.parametrize('message_id', ['abc', True, 1.5])
+def test_fork_route_rejects_bad_message_id(user_client, application, message_id):
+    from models import db, Conversation
+    client, user_id = user_client
+    with application.app_context():
+        conversation = Conversation(user_id=user_id, title='Original')
+        db.session.add(conversation)
+        db.session.commit()
+        conversation_id = conversation.id
+    response = client.post(f'/api/conversation/{conversation_id}/fork', json={'message_id': message_id})
+    assert response.status_code == 400
+
+
+def test_failed_fork_leaves_no_conversation(user_client, application, monkeypatch):
+    from models import db, Conversation
+    client, user_id = user_client
+    with application.app_context():
+        conversation = Conversation(user_id=user_id, title='Original')
+        db.session.add(conversation)
+        db.session.commit()
+        conversation_id = conversation.id
+
+    def broken_fork(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(workspaces, 'fork', broken_fork)
+    response = client.post(f'/api/conversation/{conversation_id}/fork')
+    assert response.status_code == 500
+    with application.app_context():
+        assert Conversation.query.filter_by(user_id=user_id).count() == 1
@@ -0,0 +1,232 @@
+import os
+import re
+import ast
+import json
+import inspect
+from collections import namedtuple
+import instrumentation
+
+# TOOL_CALLING=native also sends the tools as Gemini functionDeclarations; the model's
+# functionCall parts are then rendered as <tool_code> calls, so either form is accepted.
+TOOL_CALLING = os.environ.get('TOOL_CALLING', 'text').lower()
+NATIVE = TOOL_CALLING == 'native'
+MAX_TRIM_ATTEMPTS = 50
+
+PARSES = instrumentation.Counter(
+    'tool_call_parses_total', "Tool calls parsed from model output. 'recovered' means the old positional-only "
+    "parser would have rejected the call.", ('syntax', 'outcome'))
+FAILED_TURNS = instrumentation.Counter('agent_parse_failed_turns_total',
+                                       "Loop turns in which at least one tool call could not be parsed.")
+
+ToolCall = namedtuple('ToolCall', 'name args kwargs text')
+
+class ToolCallError(ValueError):
+    """A tool call that could not be parsed or does not match the tool's signature."""
+
+# --- Schema ---
+_GEMINI_TYPES = {str: 'STRING', int: 'INTEGER', float: 'NUMBER', bool: 'BOOLEAN', list: 'ARRAY', dict: 'OBJECT'}
+
+_DOC_SECTION_RE = re.compile(r"^\s*(?:Args|Returns|Yields):", re.M)
+
+def description(name, func):
+    """A tool's docstring up to any Args:/Returns: section, on one line."""
+    text = _DOC_SECTION_RE.split(inspect.getdoc(func) or name.replace('_', ' '), 1)[0]
+    return " ".join(text.split())
+
+def function_declaration(name, func, exposed=None):
+    """
+    A Gemini functionDeclaration built from a tool's signature and docstring (up to any
+    Args:/Returns: section). `exposed` limits the declared parameters to those names.
+    """
+    properties, required = {}, []
+    for parameter in inspect.signature(func).parameters.values():
+        if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+            continue
+        if exposed is not None and parameter.name not in exposed:
+            continue
+        annotation = parameter.annotation
+        if annotation is parameter.empty and parameter.default not in (parameter.empty, None):
+            annotation = type(parameter.default)
+        properties[parameter.name] = {'type': _GEMINI_TYPES.get(annotation, 'STRING')}
+        if annotation is list:
+            properties[parameter.name]['items'] = {'type': 'STRING'}
+        if parameter.default is parameter.empty:
+            required.append(parameter.name)
+    declaration = {'name': name, 'description': description(name, func)}
+    if properties:
+        declaration['parameters'] = {'type': 'OBJECT', 'properties': properties, 'required': required}
+    return declaration
+
+def gemini_tools(registry, exposed=None):
+    """
+    The `tools` field of a generateContent request for a {name: function} registry;
+    `exposed` maps tool names to the parameters the model may set.
+    """
+    exposed = exposed or {}
+    return [{'functionDeclarations': [function_declaration(name, func, exposed.get(name))
+                                      for name, func in registry.items()]}]
+
+# --- Native function calls ---
+def render_call(name, args=(), kwargs=None):
+    """Canonical `name(arg, key=value)` text for a call."""
+    parts = [repr(value) for value in args] + [f"{key}={value!r}" for key, value in (kwargs or {}).items()]
+    return f"{name}({', '.join(parts)})"
+
+def response_text(response_json):
+    """
+    The text of the first candidate, with any functionCall parts rendered as <tool_code>
+    blocks so native calls flow through the same parsing, history and traces as text calls.
+    """
+    candidates = response_json.get('candidates') or [{}]
+    parts = candidates[0].get('content', {}).get('parts', [])
+    chunks = []
+    for part in parts:
+        if 'functionCall' in part:
+            call = part['functionCall']
+            chunks.append(f"\n<tool_code>{render_call(call.get('name', ''), kwargs=call.get('args') or {})}</tool_code>")
+        else:
+            chunks.append(part.get('text', ''))
+    return "".join(chunks)
+
+# --- Text calls ---
+_TOOL_CODE_RE = re.compile(r"<tool_code>(.*?)</tool_code>", re.S)
+# A last <tool_code> left open (e.g. cut off by a stop sequence), with no other tag after it.
+_UNCLOSED_RE = re.compile(r"<tool_code>((?:(?!</?tool_code>).)*)\Z", re.S)
+_FENCED_RE = re.compile(r"```(?:tool_code|tool)\s*\n(.*?)```", re.S)
+_JSON_REPLY_RE = re.compile(r"\s*```json\s*\n(.*?)```\s*", re.S)
+_JSON_WORDS = {'true': True, 'false': False, 'null': None}
+
+class _JSONWords(ast.NodeTransformer):
+    """Turns JSON's true/false/null, at any depth, into the Python constants."""
+    def visit_Name(self, node):
+        if node.id in _JSON_WORDS:
+            return ast.copy_location(ast.Constant(_JSON_WORDS[node.id]), node)
+        return node
+
+def _literal(node):
+    try:
+        return ast.literal_eval(_JSONWords().visit(node))
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        # e.g. a name, an unhashable dict key such as {[1]: 2}, or absurd nesting
+        raise ToolCallError(f"argument `{ast.unparse(node)[:120]}` is not a literal value") from None
+
+def _parse_expression(text, trim=True):
+    """Parses `name(...)`, dropping trailing text after the call's closing parenthesis if needed and `trim`."""
+    try:
+        return ast.parse(text, mode='eval').body
+    except (SyntaxError, MemoryError, RecursionError) as e:
+        error = e
+    end = len(text)
+    for _ in range(MAX_TRIM_ATTEMPTS if trim else 0):
+        end = text.rfind(')', 0, end)
+        if end < 0:
+            break
+        try:
+            return ast.parse(text[:end + 1], mode='eval').body
+        except (SyntaxError, MemoryError, RecursionError):
+            continue
+    raise ToolCallError(f"could not parse `{text[:120]}`: {getattr(error, 'msg', 'too deeply nested')}")
+
+def _parse_json_call(text):
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise ToolCallError(f"invalid JSON tool call: {e}") from None
+    if isinstance(data, dict) and isinstance(data.get('tool_call'), dict):
+        data = data['tool_call']
+    if not isinstance(data, dict) or not isinstance(data.get('name'), str):
+        raise ToolCallError("a JSON tool call needs a 'name' and an 'args' (or 'parameters') object")
+    arguments = data.get('args', data.get('parameters')) or {}
+    if not isinstance(arguments, dict):
+        raise ToolCallError("the tool call's arguments must be an object")
+    return ToolCall(data['name'], (), arguments, text)
+
+def parse_call(text, strict=False):
+    """
+    Parses one call, written as `name(positional, key=value)` or as a JSON object, into a
+    ToolCall. With strict=True, text after the call's closing parenthesis is an error.
+    """
+    text = text.strip().strip('`').strip().rstrip(';').strip()
+    if text.startswith('{'):
+        return _parse_json_call(text)
+    node = _parse_expression(text, trim=not strict)
+    if not isinstance(node, ast.Call) or not isinstance(node.func, (ast.Name, ast.Attribute)):
+        raise ToolCallError(f"expected a call like `tool_name(...)`, got `{text[:120]}`")
+    name = node.func.id if isinstance(node.func, ast.Name) else node.func.attr
+    if any(isinstance(arg, ast.Starred) for arg in node.args) or any(kw.arg is None for kw in node.keywords):
+        raise ToolCallError("*args and **kwargs are not supported in tool calls")
+    return ToolCall(name, tuple(_literal(arg) for arg in node.args),
+                    {kw.arg: _literal(kw.value) for kw in node.keywords}, text)
+
+def _legacy_parses(text):
+    """Whether the original split-and-literal_eval parser would have accepted the call."""
+    try:
+        name = text.split('(', 1)[0].strip()
+        arguments = text[len(name) + 1:-1]
+        if arguments:
+            ast.literal_eval(f"({arguments},)")
+        return True
+    except Exception:
+        return False
+
+def extract_calls(text, count=True):
+    """
+    Finds the tool calls in a model response: <tool_code> blocks, else ```tool_code fences,
+    else a ```json block in the {"tool_call": {"name": ..., "parameters": {...}}} format
+    that is the whole reply. A last <tool_code> without its closing tag counts only if
+    nothing but one call follows it. Returns (calls, errors), where errors are (text,
+    message) pairs for blocks that could not be parsed. With count=False the parse is not
+    added to tool_call_parses_total.
+    """
+    closed = list(_TOOL_CODE_RE.finditer(text))
+    blocks = [(match.group(1), 'tool_code') for match in closed if match.group(1).strip()]
+    unclosed = _UNCLOSED_RE.search(text, closed[-1].end() if closed else 0)
+    if unclosed:
+        try:
+            parse_call(unclosed.group(1), strict=True)
+            blocks.append((unclosed.group(1), 'tool_code'))
+        except ToolCallError:
+            pass  # an open tag followed by prose is not a call
+    if not blocks:
+        blocks = [(block, 'fenced') for block in _FENCED_RE.findall(text) if block.strip()]
+    if not blocks:
+        reply = _JSON_REPLY_RE.fullmatch(text)
+        if reply and '"tool_call"' in reply.group(1):
+            blocks = [(reply.group(1), 'json')]
+    calls, errors = [], []
+    for block, syntax in blocks:
+        try:
+            call = parse_call(block)
+        except ToolCallError as e:
+            if count:
+                PARSES.inc(syntax=syntax, outcome='failed')
+            errors.append((block.strip(), str(e)))
+            continue
+        if count:
+            recovered = syntax == 'json' or call.text.startswith('{') or not _legacy_parses(block.strip())
+            PARSES.inc(syntax=syntax, outcome='recovered' if recovered else 'ok')
+        calls.append(call)
+    return calls, errors
+
+def thought(text):
+    """The model's reasoning before its first tool call."""
+    if _JSON_REPLY_RE.fullmatch(text):
+        return ""
+    match = re.search(r"<tool_code>|```(?:tool_code|tool)\s*\n", text)
+    return (text[:match.start()] if match else text).strip()
+
+def guess_name(text):
+    """The tool name of a call that could not be parsed, for traces and metrics."""
+    match = re.match(r"\s*`*\s*([A-Za-z_]\w*)\s*\(", text) or re.search(r'"name"\s*:\s*"(\w+)"', text)
+    return match.group(1) if match else 'unknown'
+
+def bind(call, registry):
+    """Checks a call against the tool's signature and returns (function, BoundArguments)."""
+    func = registry.get(call.name)
+    if func is None:
+        raise ToolCallError(f"Tool '{call.name}' not found in sub-tools.")
+    signature = inspect.signature(func)
+    try:
+        return func, signature.bind(*call.args, **call.kwargs)
+    except TypeError as e:
+        raise ToolCallError(f"{e}. Usage: {call.name}{signature}") from None
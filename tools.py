@@ -1,111 +1,186 @@
 import os
 import re
-import ast
-import subprocess
-import requests
-import json
-from datetime import datetime
+import time
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from context_manager import AgentContext, contents_tokens, estimate_tokens
+from cache import memoize_by_mtime
+import file_scan
+import workspace_index
+import workspaces
+import task_store
+import instrumentation
+import tool_schema
+import web_fetch
+from sandbox import SandboxPool
+from output_capture import BoundedOutput, progress_forwarder, run_process
 
 # --- File Management Tools ---
-WORKSPACE = os.path.abspath("workspace")
+# The shared workspace, for runs without a user; see workspaces.py for per-conversation ones.
+WORKSPACE = workspaces.SHARED_WORKSPACE
+
+# Per-run context for tools ({'user_id': 1, 'conversation_id': 3}), set by the caller of autonomous_loop.
+# It selects the run's workspace and, e.g., lets execute_python keep a per-conversation session.
+TOOL_CONTEXT = contextvars.ContextVar('tool_context', default={})
+# Callable that receives 'tool_progress' events from long-running tools, set by autonomous_loop.
+TOOL_PROGRESS = contextvars.ContextVar('tool_progress', default=None)
+
+def _workspace():
+    return workspaces.for_context(TOOL_CONTEXT.get())
 
 def _secure_path(path: str):
     if os.path.isabs(path): raise ValueError("Absolute paths are not allowed.")
-    full_path = os.path.abspath(os.path.join(WORKSPACE, path))
-    if not full_path.startswith(WORKSPACE): raise ValueError("Path is outside the secure workspace.")
+    root = _workspace().path
+    full_path = os.path.abspath(os.path.join(root, path))
+    if full_path != root and not full_path.startswith(root + os.sep): raise ValueError("Path is outside the secure workspace.")
     return full_path
 
 def create_file(path: str, content: str = ""):
+    """Create (or overwrite) a file with the given content."""
     try:
         full_path = _secure_path(path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, 'w', encoding='utf-8') as f: f.write(content)
+        _workspace().write(full_path, content, 'w')
         return f"Success: File '{path}' created."
     except Exception as e: return f"Error: {e}"
 
 def create_folder(path: str):
+    """Create a folder, including any missing parent folders."""
     try:
         full_path = _secure_path(path)
         os.makedirs(full_path, exist_ok=True)
         return f"Success: Folder '{path}' created."
     except Exception as e: return f"Error: {e}"
 
+@memoize_by_mtime(lambda path=".": _secure_path(path))
 def list_directory(path: str = "."):
+    """List the entries of a workspace directory."""
     try:
         full_path = _secure_path(path)
         if not os.path.isdir(full_path): return f"Error: '{path}' is not a directory."
         items = os.listdir(full_path)
+        if full_path == _workspace().path:
+            items = [name for name in items if name not in workspaces.INTERNAL_NAMES]
         return "\n".join(items) if items else f"Directory '{path}' is empty."
     except Exception as e: return f"Error: {e}"
 
-def read_file(path: str):
+READ_FILE_MAX_BYTES = int(os.environ.get("READ_FILE_MAX_BYTES", 100_000))
+
+@memoize_by_mtime(lambda path, *args, **kwargs: _secure_path(path))
+def read_file(path: str, start: int = None, end: int = None, unit: str = "lines"):
+    """
+    Reads a file, or lines start..end (1-based, inclusive), or bytes [start, end) with
+    unit="bytes". Large files are cut off, with a note on how to read on.
+    """
     try:
         full_path = _secure_path(path)
-        with open(full_path, 'r', encoding='utf-8') as f: return f.read()
+        text, note = file_scan.read_range(full_path, start, end, unit, max_bytes=READ_FILE_MAX_BYTES)
+        return f"{text}\n{note}" if note else text
     except FileNotFoundError: return f"Error: File '{path}' not found."
     except Exception as e: return f"Error: {e}"
 
+def tail_file(path: str, lines: int = 20):
+    """Returns the last `lines` lines of a file without reading the rest of it."""
+    try:
+        return file_scan.tail(_secure_path(path), max(0, min(int(lines), 10_000)))
+    except FileNotFoundError: return f"Error: File '{path}' not found."
+    except Exception as e: return f"Error: {e}"
+
+def grep_file(path: str, pattern: str, max_matches: int = 50, ignore_case: bool = False):
+    """Lists lines matching a regular expression as 'line_number: text', streaming through the file."""
+    try:
+        matches, more = file_scan.grep(_secure_path(path), pattern, max(1, min(int(max_matches), 1000)), ignore_case)
+        if not matches:
+            return f"No lines in '{path}' match {pattern!r}."
+        output = "\n".join(f"{number}: {line}" for number, line in matches)
+        if more:
+            output += f"\n[stopped after {len(matches)} matches]"
+        return output
+    except FileNotFoundError: return f"Error: File '{path}' not found."
+    except re.error as e: return f"Error: Invalid pattern: {e}"
+    except Exception as e: return f"Error: {e}"
+
 def write_to_file(path: str, content: str, mode: str = "a"):
+    """Append to (mode="a") or overwrite (mode="w") a file."""
     if mode not in ['a', 'w']: return "Error: Invalid mode. Use 'a' for append or 'w' for write."
     try:
         full_path = _secure_path(path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, mode, encoding='utf-8') as f: f.write(content)
+        _workspace().write(full_path, content, mode)
         action = "appended to" if mode == "a" else "written to"
         return f"Success: Content {action} file '{path}'."
     except Exception as e: return f"Error: {e}"
 
+def search_workspace(query: str, max_results: int = 10):
+    """
+    Full-text search over the workspace's text files; returns ranked passages with file names and
+    line numbers. Use it to find where something is before reading files one by one.
+    """
+    try:
+        started = time.perf_counter()
+        results = workspace_index.get_index(_workspace().path).search(query, limit=max(1, min(int(max_results), 50)))
+        if not results:
+            return f"No matches for '{query}' in the workspace."
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        blocks = [f"{path} (line {line}, score {score:.2f}):\n{snippet}" for score, path, line, snippet in results]
+        return f"{len(results)} results in {elapsed_ms:.0f} ms:\n\n" + "\n\n".join(blocks)
+    except Exception as e: return f"Error: {e}"
+
 # --- Code Execution Tools ---
-def execute_python(code: str):
-    """Execute Python code in a sandboxed environment."""
+sandbox_pool = SandboxPool.from_env(cwd=WORKSPACE)
+
+def _capture_outputs(tool_name):
+    """Bounded stdout/stderr captures whose live output is forwarded as progress events."""
+    report = TOOL_PROGRESS.get()
+    workspace = _workspace().path
+    return {stream: BoundedOutput(workspace, f"{tool_name}-{stream}", on_chunk=progress_forwarder(report, tool_name, stream))
+            for stream in ('stdout', 'stderr')}
+
+def _format_outputs(outputs, empty_message):
+    output = outputs['stdout'].text()
+    errors = outputs['stderr'].text()
+    if errors:
+        output += f"\nErrors:\n{errors}"
+    return output if output else empty_message
+
+def execute_python(code: str, persistent: bool = False):
+    """
+    Execute Python code in a sandboxed worker process.
+    With persistent=True, variables survive between calls in the same conversation.
+    """
     try:
-        # Create a temporary file for the code
-        temp_file = os.path.join(WORKSPACE, "temp_code.py")
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            f.write(code)
-        
-        # Execute the code
-        result = subprocess.run(
-            ['python3', temp_file], 
-            capture_output=True, 
-            text=True, 
-            timeout=30,
-            cwd=WORKSPACE
-        )
-        
-        # Clean up
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-        
-        output = result.stdout
-        if result.stderr:
-            output += f"\nErrors:\n{result.stderr}"
-        
-        return output if output else "Code executed successfully with no output."
-    except subprocess.TimeoutExpired:
-        return "Error: Code execution timed out after 30 seconds."
+        session = TOOL_CONTEXT.get().get('conversation_id') if persistent else None
+        outputs = _capture_outputs('execute_python')
+        workspace = _workspace()
+        workspace.unshare_links()
+        # No file the code writes may outgrow the space left; what it wrote in total is measured after.
+        result = sandbox_pool.run(code, cwd=workspace.path, outputs=outputs, timeout=30,
+                                  session=f"conversation-{session}" if session is not None else None,
+                                  fsize_bytes=workspace.room())
+        workspace.refresh()
+        output = _format_outputs(outputs, "Code executed successfully with no output.") + workspace.over_quota_note()
+        if result['stopped'] == 'timeout':
+            return f"Error: Code execution timed out after 30 seconds.\nOutput so far:\n{output}"
+        if result['stopped'] == 'crashed':
+            output += "\n[the sandbox process exited unexpectedly, e.g. after hitting its memory or CPU limit]"
+        exec_ms = f"{result['exec_ms']:.1f} ms" if result['exec_ms'] is not None else "n/a"
+        return output + f"\n[sandbox: startup {result['startup_ms']:.1f} ms ({'warm' if result['warm'] else 'cold'}), exec {exec_ms}]"
     except Exception as e:
         return f"Error executing Python code: {e}"
 
 def execute_shell(command: str):
     """Execute shell commands in the workspace."""
     try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=30,
-            cwd=WORKSPACE
-        )
-        
-        output = result.stdout
-        if result.stderr:
-            output += f"\nErrors:\n{result.stderr}"
-        
-        return output if output else "Command executed successfully with no output."
-    except subprocess.TimeoutExpired:
-        return "Error: Command execution timed out after 30 seconds."
+        outputs = _capture_outputs('execute_shell')
+        workspace = _workspace()
+        workspace.unshare_links()
+        _, timed_out = run_process(command, cwd=workspace.path, timeout=30, shell=True,
+                                   fsize_bytes=workspace.room(), **outputs)
+        workspace.refresh()
+        output = _format_outputs(outputs, "Command executed successfully with no output.") + workspace.over_quota_note()
+        if timed_out:
+            return f"Error: Command execution timed out after 30 seconds.\nOutput so far:\n{output}"
+        return output
     except Exception as e:
         return f"Error executing shell command: {e}"
 
@@ -119,160 +194,327 @@ def web_search(query: str, num_results: int = 5):
     except Exception as e:
         return f"Error performing web search: {e}"
 
-def fetch_url(url: str):
-    """Fetch content from a URL."""
+FETCH_BATCH_MAX = 10
+
+def _format_page(page, max_chars, offset=0):
+    """A fetched page's text from `offset`, with notes on how to read on."""
+    title = f" ({page.title})" if page.title else ""
+    if not page.text:
+        return f"Content from {page.url}{title}: no text content ({page.content_type}, {page.size} bytes)."
+    offset = max(0, int(offset))
+    text = page.text[offset:offset + max(200, min(int(max_chars), 20000))]
+    end = offset + len(text)
+    notes = []
+    if end < len(page.text):
+        notes.append(f"[Showing characters {offset}-{end} of {len(page.text)}. "
+                     f"Call fetch_url({page.url!r}, offset={end}) to read on.]")
+    if page.truncated:
+        notes.append(f"[The download stopped at {page.size} bytes; the rest of the page was not fetched.]")
+    return "\n".join([f"Content from {page.url}{title}:", text] + notes)
+
+def fetch_url(url: str, max_chars: int = 4000, offset: int = 0):
+    """
+    Fetch a web page and return its readable text; HTML is reduced to the page's main
+    content. Pages are cached, so a long page can be read in parts with `offset`.
+    """
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return f"Content from {url}:\n{response.text[:2000]}..."
-    except Exception as e:
+        return _format_page(web_fetch.fetch(url), max_chars, offset)
+    except web_fetch.FetchError as e:
         return f"Error fetching URL: {e}"
 
+def fetch_urls(urls: list, max_chars: int = 2000):
+    """Fetch up to 10 web pages in parallel and return the readable text of each."""
+    if isinstance(urls, str):
+        urls = re.split(r"[\s,]+", urls.strip())
+    urls = [url for url in urls if url][:FETCH_BATCH_MAX]
+    if not urls:
+        return "Error: no URLs given."
+    sections = []
+    for url, result in web_fetch.fetch_many(urls):
+        if isinstance(result, web_fetch.FetchError):
+            sections.append(f"Error fetching {url}: {result}")
+        else:
+            sections.append(_format_page(result, max_chars))
+    return "\n\n---\n\n".join(sections)
+
 # --- Data Analysis Tools ---
-def analyze_data(data_path: str, analysis_type: str = "summary"):
-    """Analyze data from a file."""
+def analyze_data(data_path: str, analysis_type: str = "summary", columns: str = "", group_by: str = "",
+                 aggregate: str = "mean", quantiles: str = "0.05,0.25,0.5,0.75,0.95"):
+    """
+    Analyze a data file (CSV/TSV, JSONL or Parquet).
+    analysis_type: "summary" (lines, words, characters), "csv" (streaming per-column statistics for
+    any size of CSV), "profile" (column types, missing values, distributions), "groupby" (aggregate
+    `columns` by `group_by` with count, sum, mean, min, max or std), "quantiles" or "correlation".
+    `columns` is a comma-separated list, default all numeric. Prefer it over writing pandas code.
+    """
     try:
         full_path = _secure_path(data_path)
         if not os.path.exists(full_path):
             return f"Error: File '{data_path}' not found."
-        
-        # Basic file analysis
-        with open(full_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
+
         if analysis_type == "summary":
-            lines = content.split('\n')
-            return f"File analysis for '{data_path}':\n- Lines: {len(lines)}\n- Characters: {len(content)}\n- Words: {len(content.split())}"
-        
-        return f"Analysis type '{analysis_type}' not implemented yet."
+            counts = file_scan.text_summary(full_path)
+            return (f"File analysis for '{data_path}':\n- Lines: {counts['lines']}\n"
+                    f"- Characters: {counts['characters']}\n- Words: {counts['words']}")
+        if analysis_type == "csv":
+            rows, column_stats = file_scan.csv_stats(full_path)
+            return "\n".join([f"CSV analysis for '{data_path}': {rows} rows, {len(column_stats)} columns"]
+                             + [column.describe() for column in column_stats])
+        if analysis_type in ("profile", "groupby", "quantiles", "correlation"):
+            import analysis_engine  # numpy and pyarrow load on the first analysis, not at start-up
+            table = analysis_engine.load_table(full_path)
+            if analysis_type == "profile":
+                result = analysis_engine.profile(table)
+            elif analysis_type == "groupby":
+                if not group_by:
+                    return "Error: The 'groupby' analysis needs a group_by column."
+                result = analysis_engine.group_by(table, group_by, columns, aggregate)
+            elif analysis_type == "quantiles":
+                result = analysis_engine.quantiles(table, columns, quantiles)
+            else:
+                result = analysis_engine.correlation(table, columns)
+            return f"{analysis_type.capitalize()} of '{data_path}':\n{result}"
+
+        return (f"Analysis type '{analysis_type}' not implemented yet. "
+                "Use 'summary', 'csv', 'profile', 'groupby', 'quantiles' or 'correlation'.")
     except Exception as e:
         return f"Error analyzing data: {e}"
 
 # --- Task Management Tools ---
+def _tasks():
+    """The task store and this workspace's scope in it, importing a legacy tasks.json on first use."""
+    workspace, store = _workspace(), task_store.get_store()
+    store.migrate_json(workspace.scope, os.path.join(workspace.path, "tasks.json"))
+    return store, workspace.scope
+
+def _check_choice(name, value, choices):
+    if value is not None and value not in choices:
+        raise ValueError(f"Invalid {name} '{value}'. Use one of: {', '.join(choices)}.")
+
+def _format_todo(todo):
+    status_icon = {"completed": "✓", "in_progress": "◐"}.get(todo["status"], "○")
+    return f"{status_icon} #{todo['number']} [{todo['priority'].upper()}] {todo['task']}"
+
 def create_todo(task: str, priority: str = "medium"):
-    """Create a todo item."""
+    """Create a todo item. priority is "high", "medium" or "low"."""
     try:
-        todo_file = os.path.join(WORKSPACE, "tasks.json")
-        
-        # Load existing todos
-        todos = []
-        if os.path.exists(todo_file):
-            with open(todo_file, 'r', encoding='utf-8') as f:
-                todos = json.load(f)
-        
-        # Add new todo
-        new_todo = {
-            "id": len(todos) + 1,
-            "task": task,
-            "priority": priority,
-            "status": "pending",
-            "created": datetime.now().isoformat()
-        }
-        todos.append(new_todo)
-        
-        # Save todos
-        with open(todo_file, 'w', encoding='utf-8') as f:
-            json.dump(todos, f, indent=2)
-        
-        return f"Todo created: {task} (Priority: {priority})"
+        _check_choice("priority", priority, task_store.PRIORITIES)
+        store, scope = _tasks()
+        number = store.add(scope, task, priority)
+        return f"Todo #{number} created: {task} (Priority: {priority})"
     except Exception as e:
         return f"Error creating todo: {e}"
 
-def list_todos():
-    """List all todo items."""
+def update_todo(todo_id: int, task: str = None, priority: str = None, status: str = None):
+    """Change a todo item's text, priority or status ("pending", "in_progress" or "completed")."""
     try:
-        todo_file = os.path.join(WORKSPACE, "tasks.json")
-        
-        if not os.path.exists(todo_file):
-            return "No todos found."
-        
-        with open(todo_file, 'r', encoding='utf-8') as f:
-            todos = json.load(f)
-        
+        _check_choice("priority", priority, task_store.PRIORITIES)
+        _check_choice("status", status, task_store.STATUSES)
+        store, scope = _tasks()
+        todo = store.update(scope, int(todo_id), task=task, priority=priority, status=status)
+        if todo is None:
+            return f"Error: Todo #{todo_id} not found."
+        return f"Todo updated: {_format_todo(todo)}"
+    except Exception as e:
+        return f"Error updating todo: {e}"
+
+def complete_todo(todo_id: int):
+    """Mark a todo item as completed."""
+    return update_todo(todo_id, status="completed")
+
+def list_todos(status: str = "", priority: str = "", limit: int = 100):
+    """List todo items, optionally only those with a status and/or priority."""
+    try:
+        _check_choice("status", status or None, task_store.STATUSES)
+        _check_choice("priority", priority or None, task_store.PRIORITIES)
+        store, scope = _tasks()
+        todos = store.list(scope, status=status or None, priority=priority or None, limit=max(1, int(limit)))
         if not todos:
             return "No todos found."
-        
-        result = "Current todos:\n"
-        for todo in todos:
-            status_icon = "✓" if todo["status"] == "completed" else "○"
-            result += f"{status_icon} [{todo['priority'].upper()}] {todo['task']}\n"
-        
-        return result
+        counts = store.counts(scope)
+        summary = ", ".join(f"{counts.get(name, 0)} {name.replace('_', ' ')}" for name in task_store.STATUSES)
+        return "\n".join([f"Current todos ({summary}):"] + [_format_todo(todo) for todo in todos])
     except Exception as e:
         return f"Error listing todos: {e}"
 
 # --- Autonomous Loop Tool ---
+# Token budget for the loop's history; older tool outputs are trimmed to fit.
+AGENT_CONTEXT_TOKENS = int(os.environ.get("AGENT_CONTEXT_TOKENS", 30000))
+AGENT_MAX_TURNS = int(os.environ.get("AGENT_MAX_TURNS", 10))
+
 # Registry for sub-tools available *inside* the loop
 SUB_TOOL_REGISTRY = {
     "create_file": create_file,
     "create_folder": create_folder,
     "list_directory": list_directory,
     "read_file": read_file,
+    "tail_file": tail_file,
+    "grep_file": grep_file,
+    "search_workspace": search_workspace,
     "write_to_file": write_to_file,
     "execute_python": execute_python,
     "execute_shell": execute_shell,
     "web_search": web_search,
     "fetch_url": fetch_url,
+    "fetch_urls": fetch_urls,
     "analyze_data": analyze_data,
     "create_todo": create_todo,
+    "update_todo": update_todo,
+    "complete_todo": complete_todo,
     "list_todos": list_todos,
 }
 
-def autonomous_loop(initial_prompt: str, llm_caller: callable, system_prompt: str):
+# Tools that only read state; several calls to them in one turn run concurrently.
+PARALLEL_SAFE_TOOLS = {"read_file", "tail_file", "grep_file", "search_workspace", "list_directory", "fetch_url", "fetch_urls", "analyze_data", "web_search"}
+# Wall-clock limit for one turn's batch of concurrent tool calls.
+TOOL_TURN_TIMEOUT = int(os.environ.get("TOOL_TURN_TIMEOUT", 60))
+_tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
+
+def run_tool_call(tool_call) -> str:
+    """Runs one call, given as a ToolCall or as `name(args...)` text, and returns the tool's output as a string."""
+    try:
+        call = tool_call if isinstance(tool_call, tool_schema.ToolCall) else tool_schema.parse_call(tool_call)
+        tool_func, bound = tool_schema.bind(call, SUB_TOOL_REGISTRY)
+        return str(tool_func(*bound.args, **bound.kwargs))
+    except tool_schema.ToolCallError as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"Error executing tool: {e}"
+
+def _timed_tool_call(call):
+    started = time.perf_counter()
+    with instrumentation.tool_span(call.name) as span:
+        output = run_tool_call(call)
+        span.set(output=output)
+    return output, round((time.perf_counter() - started) * 1000)
+
+def run_tool_calls(tool_calls):
+    """
+    Runs a turn's ToolCalls and returns (output, duration_ms) pairs in order. If every
+    call is to a read-only tool they run concurrently, bounded by TOOL_TURN_TIMEOUT;
+    otherwise they run one after another so writes happen in the order the agent asked for.
+    """
+    if len(tool_calls) < 2 or not all(call.name in PARALLEL_SAFE_TOOLS for call in tool_calls):
+        return [_timed_tool_call(call) for call in tool_calls]
+
+    futures = [_tool_executor.submit(contextvars.copy_context().run, _timed_tool_call, call) for call in tool_calls]
+    done, _ = wait(futures, timeout=TOOL_TURN_TIMEOUT)
+    return [future.result() if future in done
+            else (f"Error: Tool call timed out after {TOOL_TURN_TIMEOUT} seconds.", TOOL_TURN_TIMEOUT * 1000)
+            for future in futures]
+
+def _run_tool_calls_with_progress(tool_calls):
+    """
+    Runs run_tool_calls on a helper thread, yielding the 'tool_progress' events its tools
+    report meanwhile, and returns the results. Use with `yield from`.
+    """
+    events = queue.Queue()
+    context = contextvars.copy_context()
+    context.run(TOOL_PROGRESS.set, events.put)
+    outcome = {}
+
+    def target():
+        try:
+            outcome['results'] = context.run(run_tool_calls, tool_calls)
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            events.put(None)
+
+    threading.Thread(target=target, name="tool-turn", daemon=True).start()
+    while True:
+        event = events.get()
+        if event is None:
+            break
+        yield event
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['results']
+
+def autonomous_loop(initial_prompt: str, llm_caller: callable, system_prompt: str, llm_streamer: callable = None,
+                    first_response: str = None, first_model: str = None):
     """
     Executes a multi-step reasoning loop to accomplish a complex task.
     Args:
         initial_prompt: The user's original, unmodified prompt for the task.
-        llm_caller: A function that can be called to communicate with the LLM.
+        llm_caller: A function called as llm_caller(contents, system_instruction=..., usage={})
+            returning (text, model); it fills `usage` with the response's usageMetadata.
         system_prompt: The master system prompt defining agent behavior.
-    Returns:
-        A list of event dictionaries detailing the agent's process.
+        llm_streamer: Optional generator function with the same arguments yielding
+            (text_chunk, model) tuples. When given, each chunk is also yielded as a 'token' event.
+        first_response: Optional response (from `first_model`) to use as the first turn
+            instead of calling the LLM, e.g. a dispatcher reply that already calls tools.
+    Yields:
+        Event dictionaries detailing the agent's process, as soon as each is produced.
+        Tools that produce output over time also yield 'tool_progress' events while they run.
+        A 'usage' event per turn reports the prompt and response sizes, and the prompt size
+        against the untrimmed history.
     """
-    history = [f"User task: {initial_prompt}"]
-    response_events = []
-    max_turns = 10  # Increased for more complex tasks
+    context = AgentContext(initial_prompt, token_budget=AGENT_CONTEXT_TOKENS)
 
-    for turn in range(max_turns):
-        full_prompt = system_prompt + "\n\n**Internal Monologue History:**\n" + "\n".join(history)
+    for turn in range(AGENT_MAX_TURNS):
+        contents = context.build_contents()
+        usage = {}
         
-        llm_response, model_used = llm_caller(full_prompt)
+        if turn == 0 and first_response:
+            llm_response, model_used = first_response, first_model
+        elif llm_streamer:
+            chunks, model_used = [], None
+            for chunk, model_used in llm_streamer(contents, system_instruction=system_prompt, usage=usage):
+                chunks.append(chunk)
+                yield {'type': 'token', 'content': chunk}
+            llm_response = "".join(chunks)
+        else:
+            llm_response, model_used = llm_caller(contents, system_instruction=system_prompt, usage=usage)
         if not llm_response:
-            response_events.append({'type': 'error', 'content': 'Agent failed to respond during loop.'})
-            break
+            yield {'type': 'error', 'content': 'Agent failed to respond during loop.'}
+            return
+
+        yield {
+            'type': 'usage',
+            'turn': turn + 1,
+            'model_used': model_used,
+            'prompt_tokens': usage.get('promptTokenCount') or contents_tokens(contents, system_prompt),
+            'response_tokens': usage.get('candidatesTokenCount') or estimate_tokens(llm_response),
+            'estimated': 'promptTokenCount' not in usage,
+            'untrimmed_prompt_tokens': context.full_history_tokens(system_prompt),
+            'reused': turn == 0 and bool(first_response),
+        }
 
-        tool_match = re.search(r'<tool_code>(.*?)</tool_code>', llm_response, re.DOTALL)
+        tool_calls, parse_errors = tool_schema.extract_calls(llm_response)
         
-        if tool_match:
-            thought = llm_response.split('<tool_code>')[0].strip()
+        if tool_calls or parse_errors:
+            thought = tool_schema.thought(llm_response)
             if thought: 
-                response_events.append({'type': 'thought', 'content': thought})
+                yield {'type': 'thought', 'content': thought}
             
-            tool_call_str = tool_match.group(1).strip()
-            response_events.append({'type': 'tool_call', 'content': tool_call_str})
+            for call in tool_calls:
+                yield {'type': 'tool_call', 'content': call.text, 'tool_name': call.name}
             
-            try:
-                func_name = tool_call_str.split('(', 1)[0]
-                args_str = tool_call_str[len(func_name)+1:-1]
-                args = ast.literal_eval(f"({args_str},)") if args_str else ()
-                
-                tool_func = SUB_TOOL_REGISTRY.get(func_name)
-                if tool_func: 
-                    tool_output = tool_func(*args)
-                else: 
-                    tool_output = f"Error: Tool '{func_name}' not found in sub-tools."
-            except Exception as e:
-                tool_output = f"Error executing tool: {e}"
-
-            response_events.append({'type': 'tool_output', 'content': str(tool_output)})
-            history.append(f"AI Thought: {llm_response}")
-            history.append(f"Tool Output: {tool_output}")
+            results = (yield from _run_tool_calls_with_progress(tool_calls)) if tool_calls else []
+            for (tool_output, duration_ms), call in zip(results, tool_calls):
+                yield {'type': 'tool_output', 'content': tool_output, 'tool_name': call.name, 'duration_ms': duration_ms}
+            # Calls that could not be parsed are reported back so the model can fix them on the next turn.
+            observations = [(call.text, output) for call, (output, _) in zip(tool_calls, results)]
+            if parse_errors:
+                tool_schema.FAILED_TURNS.inc()
+                for text, message in parse_errors:
+                    error = f"Error: could not parse this tool call: {message}"
+                    yield {'type': 'tool_call', 'content': text, 'tool_name': tool_schema.guess_name(text)}
+                    yield {'type': 'tool_output', 'content': error, 'tool_name': tool_schema.guess_name(text), 'duration_ms': 0}
+                    observations.append((text, error))
+
+            if len(observations) == 1:
+                observation = observations[0][1]
+            else:
+                observation = "\n\n".join(f"[{index}] {call}\n{output}" for index, (call, output)
+                                           in enumerate(observations, start=1))
+            context.add_turn(llm_response, observation)
         else:
-            response_events.append({'type': 'final_answer', 'content': llm_response, 'model_used': model_used})
-            break
-    else:
-        response_events.append({'type': 'error', 'content': 'Agent exceeded maximum turns.'})
+            yield {'type': 'final_answer', 'content': llm_response, 'model_used': model_used}
+            return
 
-    return response_events
+    yield {'type': 'error', 'content': 'Agent exceeded maximum turns.'}
 
 # Master registry for tools callable from the main dispatcher
 MASTER_TOOL_REGISTRY = {
@@ -0,0 +1,343 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+
+# requests is imported by get_session() on the first fetch, so processes that never
+# fetch a page skip the import.
+requests = None
+
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', 10))
+FETCH_CONNECT_TIMEOUT = float(os.environ.get('FETCH_CONNECT_TIMEOUT', 5))
+# Downloads stop after FETCH_MAX_BYTES; the page is then marked as truncated.
+FETCH_MAX_BYTES = int(os.environ.get('FETCH_MAX_BYTES', 2 * 1024 * 1024))
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 8))
+FETCH_POOL_SIZE = int(os.environ.get('FETCH_POOL_SIZE', 16))
+FETCH_USER_AGENT = os.environ.get('FETCH_USER_AGENT', 'Mozilla/5.0 (compatible; AiAppFetcher/1.0)')
+# Pages without a Cache-Control max-age stay fresh for FETCH_CACHE_TTL seconds; after
+# that they are revalidated with If-None-Match / If-Modified-Since when they had validators.
+FETCH_CACHE_TTL = float(os.environ.get('FETCH_CACHE_TTL', 300))
+FETCH_CACHE_ENTRIES = int(os.environ.get('FETCH_CACHE_ENTRIES', 2000))
+CHUNK_BYTES = 64 * 1024
+
+FETCHES = instrumentation.Counter(
+    'web_fetch_total', "Page fetches by outcome: fetched, cached (served without a request), revalidated "
+    "(304 Not Modified) or error.", ('outcome',))
+FETCH_SECONDS = instrumentation.Histogram('web_fetch_duration_seconds', "Duration of each page fetch.", ('outcome',))
+
+Page = namedtuple('Page', 'url status content_type title text size truncated source')
+
+class FetchError(Exception):
+    """Raised when a page cannot be fetched; carries the HTTP status code when there was one."""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+# --- HTML to text ---
+_SKIPPED_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'iframe', 'canvas', 'nav', 'footer', 'aside', 'form'}
+_BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'header', 'table', 'tr', 'ul', 'ol', 'dl', 'dt', 'dd',
+               'blockquote', 'pre', 'figure', 'figcaption', 'hr', 'br', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+_MAIN_TAGS = {'main', 'article'}
+_MIN_MAIN_CHARS = 200
+
+class _TextExtractor(HTMLParser):
+    """
+    Collects a page's readable text: scripts, styles, navigation and footers are dropped,
+    block elements become line breaks, headings and list items keep a Markdown marker.
+    Text inside <main>/<article> is also collected separately so it can replace the
+    whole page when there is enough of it.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.chunks = []
+        self.main_chunks = []
+        self._skip = 0
+        self._main = 0
+        self._pre = 0
+        self._in_title = False
+
+    def _emit(self, text):
+        self.chunks.append(text)
+        if self._main:
+            self.main_chunks.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title':
+            self._in_title = True
+        elif tag in _SKIPPED_TAGS:
+            self._skip += 1
+        elif self._skip:
+            return
+        elif tag in _MAIN_TAGS:
+            self._main += 1
+        if tag == 'pre':
+            self._pre += 1
+        if tag in _BLOCK_TAGS and not self._skip:
+            self._emit("\n")
+            if tag[0] == 'h' and tag[1:].isdigit():
+                self._emit("#" * int(tag[1]) + " ")
+            elif tag == 'li':
+                self._emit("- ")
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self._in_title = False
+        elif tag in _SKIPPED_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _MAIN_TAGS and not self._skip:
+            self._main = max(0, self._main - 1)
+        if tag == 'pre':
+            self._pre = max(0, self._pre - 1)
+        if tag in _BLOCK_TAGS and tag != 'li' and not self._skip:
+            self._emit("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self._emit(data if self._pre else _SPACE_RE.sub(" ", data))
+
+    def text(self):
+        main = _tidy("".join(self.main_chunks))
+        return main if len(main) >= _MIN_MAIN_CHARS else _tidy("".join(self.chunks))
+
+def _tidy(text):
+    # Collapsed text has at most one leading space, so an indent of four or more comes from <pre>.
+    lines = (line.rstrip() if line.startswith('    ') else line.strip() for line in text.replace('\r', '').split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+# Scripts, styles and comments are usually most of a page's bytes; cutting them out with
+# one regex pass is far cheaper than feeding them through html.parser.
+_NOISE_RE = re.compile(r"<!--.*?-->|<(script|style|noscript|svg|template)\b[^>]*>.*?</\1\s*>", re.S | re.I)
+_SPACE_RE = re.compile(r"\s+")
+
+def html_to_text(html):
+    """(title, text) of an HTML document."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(_NOISE_RE.sub(" ", html))
+        parser.close()
+    except AssertionError:  # html.parser gives up on some malformed markup; keep what was read
+        pass
+    return " ".join(parser.title.split()), parser.text()
+
+# --- Cache ---
+class FetchCache:
+    """
+    Extracted page text keyed on URL in a SQLite file, with the response's ETag and
+    Last-Modified so stale entries can be revalidated instead of downloaded again. The
+    least recently used entries beyond `max_entries` are dropped.
+    """
+
+    def __init__(self, db_path, max_entries=FETCH_CACHE_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS fetch_cache (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                content_type TEXT NOT NULL,
+                title TEXT NOT NULL,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                truncated INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires REAL NOT NULL,
+                used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_fetch_cache_used ON fetch_cache (used);
+        """)
+
+    def get(self, url):
+        with self._lock:
+            rows = self._db.execute("UPDATE fetch_cache SET used = ? WHERE url = ? RETURNING *",
+                                    (time.time(), url)).fetchall()
+        return rows[0] if rows else None
+
+    def set(self, url, page, etag, last_modified, expires):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO fetch_cache (url, status, content_type, title, text, size, truncated, etag, "
+                "last_modified, expires, used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, page.status, page.content_type, page.title, page.text, page.size, int(page.truncated),
+                 etag, last_modified, expires, time.time()))
+            self._db.execute("DELETE FROM fetch_cache WHERE url IN "
+                             "(SELECT url FROM fetch_cache ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def refresh(self, url, expires):
+        """Extends the freshness of an entry the server confirmed is unchanged (304)."""
+        with self._lock:
+            self._db.execute("UPDATE fetch_cache SET expires = ?, used = ? WHERE url = ?", (expires, time.time(), url))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM fetch_cache")
+
+_cache = None
+_session = None
+_lock = threading.Lock()
+
+def get_cache():
+    """The shared cache at FETCH_CACHE_DB (default: fetch-cache.db under the workspaces root); None if set empty."""
+    global _cache
+    with _lock:
+        if _cache is None:
+            default = os.path.join(os.environ.get('WORKSPACES_ROOT', 'workspaces'), 'fetch-cache.db')
+            path = os.environ.get('FETCH_CACHE_DB', default)
+            _cache = FetchCache(path) if path else False
+        return _cache or None
+
+def get_session():
+    """The process's pooled, keep-alive session, created on first use."""
+    global _session, requests
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=FETCH_POOL_SIZE, pool_maxsize=FETCH_POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _session.headers.update({'User-Agent': FETCH_USER_AGENT,
+                                     'Accept': 'text/html,application/xhtml+xml,text/plain;q=0.9,*/*;q=0.5'})
+        return _session
+
+# --- Fetching ---
+_TEXT_TYPES = ('text/', 'application/json', 'application/xml', 'application/javascript', 'application/ld+json')
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+
+def _expires(headers, now):
+    cache_control = headers.get('Cache-Control', '').lower()
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return now
+    match = re.search(r"max-age=(\d+)", cache_control)
+    return now + (int(match.group(1)) if match else FETCH_CACHE_TTL)
+
+def _read_capped(response, deadline):
+    """The body, up to FETCH_MAX_BYTES or the deadline, and why it was cut short: 'size', 'deadline' or None."""
+    chunks, size = [], 0
+    for chunk in response.iter_content(CHUNK_BYTES):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= FETCH_MAX_BYTES:
+            return b"".join(chunks)[:FETCH_MAX_BYTES], 'size'
+        if time.monotonic() > deadline:
+            return b"".join(chunks), 'deadline'
+    return b"".join(chunks), None
+
+def _decode(body, response, content_type):
+    charset = re.search(r"charset=([\w-]+)", response.headers.get('Content-Type', ''), re.I)
+    if charset is None and 'html' in content_type:
+        charset = _META_CHARSET_RE.search(body[:4096])
+    encoding = charset.group(1) if charset else 'utf-8'
+    if isinstance(encoding, bytes):
+        encoding = encoding.decode('ascii')
+    try:
+        return body.decode(encoding, errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
+
+def _to_page(url, response, body, truncated):
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower() or 'application/octet-stream'
+    title, text = "", ""
+    if 'html' in content_type:
+        title, text = html_to_text(_decode(body, response, content_type))
+    elif content_type.startswith(_TEXT_TYPES) or content_type.endswith(('+json', '+xml')):
+        text = _decode(body, response, content_type)
+    return Page(url, response.status_code, content_type, title, text, len(body), truncated, 'fetched')
+
+def _from_cache(url, entry, source):
+    return Page(url, entry['status'], entry['content_type'], entry['title'], entry['text'], entry['size'],
+                bool(entry['truncated']), source)
+
+def fetch(url, use_cache=True):
+    """
+    Fetches a page and returns it as a Page whose text is extracted from HTML. Fresh
+    cache entries are returned without a request; stale ones are revalidated. The body
+    is streamed and cut off at FETCH_MAX_BYTES, or after FETCH_TIMEOUT; a body cut off by
+    the timeout is not cached, since the next fetch may get all of it. Raises FetchError.
+    """
+    if not re.match(r"https?://", url, re.I):
+        raise FetchError("only http:// and https:// URLs can be fetched")
+    cache = get_cache() if use_cache else None
+    entry = cache.get(url) if cache else None
+    now = time.time()
+    if entry is not None and entry['expires'] > now:
+        FETCHES.inc(outcome='cached')
+        return _from_cache(url, entry, 'cached')
+
+    headers = {}
+    if entry is not None and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry is not None and entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+    session = get_session()
+    outcome = 'error'
+    started = time.perf_counter()
+    try:
+        with instrumentation.span('fetch', url=url[:200]) as current:
+            try:
+                response = session.get(url, headers=headers, stream=True,
+                                       timeout=(FETCH_CONNECT_TIMEOUT, FETCH_TIMEOUT))
+                if response.status_code == 304 and entry is None:
+                    # Not Modified, but there is no cached copy to reuse (e.g. an intermediary
+                    # cache answered): ask again unconditionally rather than return an empty page.
+                    response.close()
+                    response = session.get(url, headers={'Cache-Control': 'no-cache'}, stream=True,
+                                           timeout=(FETCH_CONNECT_TIMEOUT, FETCH_TIMEOUT))
+                with response:
+                    if response.status_code == 304:
+                        if entry is None:
+                            raise FetchError(f"304 Not Modified from {url} for an unconditional request",
+                                             status_code=304)
+                        cache.refresh(url, _expires(response.headers, now))
+                        outcome = 'revalidated'
+                        return _from_cache(url, entry, 'revalidated')
+                    if response.status_code >= 400:
+                        raise FetchError(f"{response.status_code} {response.reason} from {url}",
+                                         status_code=response.status_code)
+                    body, cut = _read_capped(response, time.monotonic() + FETCH_TIMEOUT)
+                    page = _to_page(url, response, body, cut is not None)
+                    if cache is not None and cut != 'deadline' \
+                            and 'no-store' not in response.headers.get('Cache-Control', '').lower():
+                        cache.set(url, page, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                                  _expires(response.headers, now))
+            except requests.RequestException as e:
+                raise FetchError(str(e)) from e
+            current.set(bytes=page.size, truncated=page.truncated)
+            outcome = 'fetched'
+            return page
+    finally:
+        FETCHES.inc(outcome=outcome)
+        FETCH_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+def fetch_many(urls, use_cache=True):
+    """
+    Fetches several pages concurrently (up to FETCH_WORKERS at a time) and returns a
+    (url, Page or FetchError) pair per distinct URL, in the order given.
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return []
+
+    def attempt(url):
+        try:
+            return url, fetch(url, use_cache)
+        except FetchError as e:
+            return url, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(urls))), thread_name_prefix="fetch") as pool:
+        return list(pool.map(attempt, urls))
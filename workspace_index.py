@@ -0,0 +1,262 @@
+import os
+import re
+import math
+import time
+import heapq
+import zlib
+import threading
+from collections import Counter
+
+# numpy is only needed for embeddings, so it is imported by embedder_from_env() when they
+# are enabled; BM25 search works without it, and processes that never search skip the import.
+np = None
+
+CHUNK_LINES = 40
+MAX_FILE_BYTES = int(os.environ.get('WORKSPACE_INDEX_MAX_FILE_BYTES', 2 * 1024 * 1024))
+REFRESH_INTERVAL = float(os.environ.get('WORKSPACE_INDEX_REFRESH', 0))
+SKIPPED_DIRS = {'__pycache__', 'node_modules', '.git', '.sandbox', '.outputs', '.venv', 'venv'}
+SNIPPET_LINES = 3
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+
+def tokenize(text):
+    """Lower-cased alphanumeric runs; snake_case and camelCase identifiers also yield their parts."""
+    tokens = []
+    for word in re.findall(r"[A-Za-z0-9_]+", text):
+        word = word.strip("_")
+        if not word:
+            continue
+        tokens.append(word.lower())
+        parts = re.findall(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", word)
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+    return tokens
+
+class HashingEmbedder:
+    """
+    An offline stand-in for a sentence-embedding model: character trigrams hashed into a
+    fixed-size, L2-normalised vector. It catches near-miss spellings and word forms that
+    exact-term BM25 misses.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _TOKEN_RE.findall(text.lower()):
+                padded = f" {word} "
+                for index in range(len(padded) - 2):
+                    vectors[row, zlib.crc32(padded[index:index + 3].encode()) % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+class SentenceTransformerEmbedder:
+    """Embeddings from a locally installed sentence-transformers model; no network access at query time."""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def embed(self, texts):
+        return np.asarray(self.model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+def embedder_from_env():
+    """WORKSPACE_INDEX_EMBEDDINGS: unset/'off', 'hash', or the name or path of a sentence-transformers model."""
+    global np
+    setting = os.environ.get('WORKSPACE_INDEX_EMBEDDINGS', 'off')
+    if setting == 'off':
+        return None
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    if setting == 'hash':
+        return HashingEmbedder()
+    try:
+        return SentenceTransformerEmbedder(setting)
+    except Exception as e:
+        print(f"Workspace index: embedding model '{setting}' unavailable ({e}); using hashed trigrams.")
+        return HashingEmbedder()
+
+class WorkspaceIndex:
+    """
+    An in-memory BM25 index over the text files under `root`, split into passages of
+    CHUNK_LINES lines. It is refreshed incrementally: before a search (at most every
+    REFRESH_INTERVAL seconds) the tree is walked and only files whose (mtime, size)
+    changed are re-read. With an embedder, passages also get vectors, and results
+    blend BM25 with cosine similarity.
+    """
+
+    def __init__(self, root, embedder=None, k1=1.2, b=0.75):
+        self.root = os.path.abspath(root)
+        self.embedder = embedder
+        self.k1 = k1
+        self.b = b
+        self._files = {}      # relative path -> ((mtime_ns, size), [passage ids])
+        self._passages = {}   # passage id -> (path, start_line, lines, term counts, length)
+        self._postings = {}   # term -> {passage id: term frequency}
+        self._vectors = {}    # passage id -> embedding
+        self._matrix = None
+        self._next_id = 0
+        self._total_length = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    # --- Indexing ---
+    def _walk(self):
+        for directory, subdirs, files in os.walk(self.root):
+            subdirs[:] = [name for name in subdirs if name not in SKIPPED_DIRS]
+            for name in files:
+                full_path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                if stat.st_size <= MAX_FILE_BYTES:
+                    yield os.path.relpath(full_path, self.root), (stat.st_mtime_ns, stat.st_size)
+
+    def _read_text(self, path):
+        try:
+            with open(os.path.join(self.root, path), 'rb') as f:
+                data = f.read(MAX_FILE_BYTES + 1)
+        except OSError:
+            return None
+        if b"\0" in data[:8192]:
+            return None  # binary
+        return data.decode('utf-8', 'replace')
+
+    def _remove_file(self, path):
+        _, passage_ids = self._files.pop(path)
+        for passage_id in passage_ids:
+            _, _, _, counts, length = self._passages.pop(passage_id)
+            self._total_length -= length
+            for term in counts:
+                postings = self._postings[term]
+                del postings[passage_id]
+                if not postings:
+                    del self._postings[term]
+            self._vectors.pop(passage_id, None)
+        self._matrix = None
+
+    def _add_file(self, path, signature):
+        text = self._read_text(path)
+        passage_ids = []
+        if text:
+            lines = text.splitlines()
+            new_passages = []
+            for start in range(0, len(lines), CHUNK_LINES):
+                chunk = lines[start:start + CHUNK_LINES]
+                # The path is indexed with every passage so file names are searchable too.
+                counts = Counter(tokenize(path + "\n" + "\n".join(chunk)))
+                if not counts:
+                    continue
+                passage_id = self._next_id
+                self._next_id += 1
+                length = sum(counts.values())
+                self._passages[passage_id] = (path, start + 1, chunk, counts, length)
+                self._total_length += length
+                for term, frequency in counts.items():
+                    self._postings.setdefault(term, {})[passage_id] = frequency
+                passage_ids.append(passage_id)
+                new_passages.append((passage_id, path + "\n" + "\n".join(chunk)))
+            if self.embedder is not None and new_passages:
+                vectors = self.embedder.embed([text for _, text in new_passages])
+                for (passage_id, _), vector in zip(new_passages, vectors):
+                    self._vectors[passage_id] = vector
+                self._matrix = None
+        self._files[path] = (signature, passage_ids)
+
+    def refresh(self, force=False):
+        """Re-indexes changed files and drops deleted ones. Returns the number of files updated."""
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed_at < REFRESH_INTERVAL:
+                return 0
+            seen, updated = set(), 0
+            for path, signature in self._walk():
+                seen.add(path)
+                current = self._files.get(path)
+                if current is not None and current[0] == signature:
+                    continue
+                if current is not None:
+                    self._remove_file(path)
+                self._add_file(path, signature)
+                updated += 1
+            for path in [path for path in self._files if path not in seen]:
+                self._remove_file(path)
+                updated += 1
+            self._refreshed_at = time.monotonic()
+            return updated
+
+    # --- Searching ---
+    def _bm25(self, query_terms):
+        count = len(self._passages)
+        average_length = self._total_length / count
+        scores = {}
+        for term in set(query_terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, frequency in postings.items():
+                length = self._passages[passage_id][4]
+                norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * frequency * (self.k1 + 1) / norm
+        return scores
+
+    def _semantic(self, query):
+        if self._matrix is None:
+            ids = list(self._vectors)
+            self._matrix = (ids, np.vstack([self._vectors[passage_id] for passage_id in ids]) if ids else None)
+        ids, matrix = self._matrix
+        if matrix is None:
+            return {}
+        similarities = matrix @ self.embedder.embed([query])[0]
+        top = np.argsort(similarities)[::-1][:200]
+        return {ids[index]: float(similarities[index]) for index in top if similarities[index] > 0}
+
+    def search(self, query, limit=10, semantic_weight=0.5):
+        """Returns up to `limit` (score, path, start_line, snippet) results, best first."""
+        self.refresh()
+        terms = tokenize(query)
+        with self._lock:
+            if not self._passages or not terms:
+                return []
+            scores = self._bm25(terms)
+            if self.embedder is not None:
+                best = max(scores.values(), default=0.0) or 1.0
+                semantic = self._semantic(query)
+                scores = {passage_id: scores.get(passage_id, 0.0) / best + semantic_weight * semantic.get(passage_id, 0.0)
+                          for passage_id in set(scores) | set(semantic)}
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [(score, *self._snippet(passage_id, set(terms))) for passage_id, score in top]
+
+    def _snippet(self, passage_id, terms):
+        path, start_line, lines, _, _ = self._passages[passage_id]
+        ranked = sorted(range(len(lines)), key=lambda index: -len(terms & set(tokenize(lines[index]))))
+        chosen = sorted(ranked[:SNIPPET_LINES])
+        snippet = "\n".join(f"{start_line + index}: {lines[index].strip()[:200]}" for index in chosen)
+        return path, start_line + chosen[0] if chosen else start_line, snippet
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._files), 'passages': len(self._passages), 'terms': len(self._postings),
+                    'embeddings': self.embedder is not None}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(root):
+    """The shared index for a workspace root, created on first use."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = WorkspaceIndex(root, embedder=embedder_from_env())
+        return index
+
+def drop_index(root):
+    """Forgets the index for a workspace root, e.g. once the workspace is deleted."""
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(root), None)
@@ -0,0 +1,392 @@
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+import workspace_index
+import task_store
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; forks then copy
+    fcntl = None
+
+# Each conversation gets its own workspace under WORKSPACES_ROOT/user-<id>/conversation-<id>.
+# Runs without a user (CLI, scripts) keep using the shared ./workspace directory.
+WORKSPACES_ROOT = os.path.abspath(os.environ.get('WORKSPACES_ROOT', 'workspaces'))
+SHARED_WORKSPACE = os.path.abspath("workspace")
+QUOTA_BYTES = int(float(os.environ.get('WORKSPACE_QUOTA_MB', 200)) * 1024 * 1024)
+QUOTA_FILES = int(os.environ.get('WORKSPACE_QUOTA_FILES', 2000))
+# LRU reclamation: workspaces idle for WORKSPACE_IDLE_DAYS are deleted, and beyond
+# WORKSPACE_MAX_COUNT the least recently used ones go first (never one used in the last
+# WORKSPACE_MIN_IDLE seconds). Last use is the mtime of LAST_USED_FILE in the workspace,
+# so every process on the host sees it; a process re-touches the workspaces it has runs
+# in every WORKSPACE_REAP_INTERVAL, which must stay below WORKSPACE_MIN_IDLE.
+IDLE_SECONDS = float(os.environ.get('WORKSPACE_IDLE_DAYS', 30)) * 86400
+MAX_WORKSPACES = int(os.environ.get('WORKSPACE_MAX_COUNT', 1000))
+MIN_IDLE_SECONDS = float(os.environ.get('WORKSPACE_MIN_IDLE', 3600))
+REAP_INTERVAL = float(os.environ.get('WORKSPACE_REAP_INTERVAL', 600))
+LAST_USED_FILE = ".last-used"
+TOUCH_INTERVAL = 60
+# How forks copy files: auto (reflink where the filesystem supports it, else a plain copy),
+# hardlink or copy. Hardlinked workspaces are marked with SHARED_MARKER and give every shared
+# file its own copy before code next runs in them (see unshare_links).
+FORK_MODE = os.environ.get('WORKSPACE_FORK_MODE', 'auto').lower()
+SHARED_MARKER = ".shared-links"
+# Spilled tool output (see output_capture) and sandbox scratch files.
+OUTPUTS_DIR = ".outputs"
+SANDBOX_DIR = ".sandbox"
+# Bookkeeping at the top of a workspace: hidden from list_directory and not charged to the
+# quota. Spill files have their own cap (TOOL_OUTPUTS_MAX_MB).
+INTERNAL_NAMES = frozenset({LAST_USED_FILE, SHARED_MARKER, OUTPUTS_DIR, SANDBOX_DIR})
+FICLONE = 0x40049409  # linux/fs.h: share the source file's extents, copy-on-write
+
+class QuotaExceeded(ValueError):
+    """A write that would take a workspace over its disk or file-count quota."""
+
+class Workspace:
+    """
+    One workspace directory and its usage. Usage comes from a single walk the first time
+    it is needed; after that the file tools update it as they write, so quota checks cost
+    nothing. After a code run, refresh() re-lists only the directories whose mtime changed
+    and re-stats the known files, so runs are charged for what they wrote without a full walk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.scope = scope_of(path)
+        self.last_used = 0.0
+        self.active_runs = 0
+        self._usage = None  # [bytes, files]
+        self._tree = None  # {directory: (mtime_ns, file names, subdirectory names)} as of the last walk
+        self._lock = threading.Lock()
+
+    def _list(self, directory, known):
+        """(mtime_ns, files, subdirs) of a directory, reusing `known` when its mtime is unchanged."""
+        mtime = os.stat(directory).st_mtime_ns
+        if known is not None and known[0] == mtime:
+            return known
+        files, subdirs = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                (subdirs if entry.is_dir(follow_symlinks=False) else files).append(entry.name)
+        return mtime, files, subdirs
+
+    def _scan(self):
+        """
+        Walks the workspace, re-listing only directories changed since the last walk, and
+        returns [bytes, files], leaving out INTERNAL_NAMES.
+        """
+        previous, tree = self._tree or {}, {}
+        size = files = 0
+        pending = [self.path]
+        while pending:
+            directory = pending.pop()
+            try:
+                listing = tree[directory] = self._list(directory, previous.get(directory))
+            except OSError:
+                continue
+            top = directory == self.path
+            for name in listing[1]:
+                if top and name in INTERNAL_NAMES:
+                    continue
+                try:
+                    size += os.lstat(os.path.join(directory, name)).st_size
+                    files += 1
+                except OSError:
+                    continue
+            pending.extend(os.path.join(directory, name) for name in listing[2] if not (top and name in INTERNAL_NAMES))
+        self._tree = tree
+        return [size, files]
+
+    def usage(self):
+        """(bytes, files) in the workspace. Forked files count at full size even when their storage is shared."""
+        with self._lock:
+            if self._usage is None:
+                self._usage = self._scan()
+            return tuple(self._usage)
+
+    def invalidate(self):
+        """Forgets the usage and the directory listings; the next check walks the whole workspace."""
+        with self._lock:
+            self._usage = None
+            self._tree = None
+
+    def refresh(self):
+        """Re-measures usage after code has run in the workspace; returns (bytes, files)."""
+        with self._lock:
+            self._usage = self._scan()
+            return tuple(self._usage)
+
+    def room(self):
+        """Bytes left under the quota (0 when full: code may still delete files but not grow any)."""
+        return max(0, QUOTA_BYTES - self.usage()[0])
+
+    def over_quota_note(self):
+        """An error line for a tool's output if the workspace is over its quota, else ""."""
+        size, files = self.usage()
+        if size <= QUOTA_BYTES and files <= QUOTA_FILES:
+            return ""
+        return (f"\nError: the workspace is over its quota ({size / 2**20:.1f} MB in {files} files; the limits are "
+                f"{QUOTA_BYTES / 2**20:.1f} MB and {QUOTA_FILES} files). Delete files before writing more.")
+
+    def reserve(self, full_path, new_bytes, append=False):
+        """
+        Accounts for writing `new_bytes` to full_path (appended, or replacing the file) and
+        raises QuotaExceeded instead if that would go over WORKSPACE_QUOTA_MB or _FILES.
+        """
+        try:
+            old_bytes, exists = os.stat(full_path).st_size, True
+        except OSError:
+            old_bytes, exists = 0, False
+        with self._lock:
+            if self._usage is None:
+                self._usage = self._scan()
+            size = self._usage[0] + new_bytes - (0 if append else old_bytes)
+            files = self._usage[1] + (0 if exists else 1)
+            if size > QUOTA_BYTES and new_bytes:
+                raise QuotaExceeded(f"Workspace quota exceeded: this write needs {size / 2**20:.1f} MB "
+                                    f"of the {QUOTA_BYTES / 2**20:.1f} MB allowed.")
+            if files > QUOTA_FILES:
+                raise QuotaExceeded(f"Workspace file limit reached ({QUOTA_FILES} files).")
+            self._usage = [size, files]
+
+    def write(self, full_path, content, mode='w'):
+        """Writes text to a file in the workspace within its quota, without touching a fork's shared copy."""
+        data = content.encode('utf-8')
+        self.reserve(full_path, len(data), append=mode == 'a')
+        try:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            _unshare(full_path, keep_content=mode == 'a')
+            with open(full_path, mode + 'b') as f:
+                f.write(data)
+        except BaseException:
+            self.invalidate()
+            raise
+
+    def touch(self, force=False):
+        """Records a use in LAST_USED_FILE; at most once a TOUCH_INTERVAL unless forced."""
+        now = time.time()
+        if self.path == SHARED_WORKSPACE or (not force and now - self.last_used < TOUCH_INTERVAL):
+            return
+        self.last_used = now
+        marker = os.path.join(self.path, LAST_USED_FILE)
+        try:
+            os.utime(marker)
+        except FileNotFoundError:
+            open(marker, 'a').close()
+        except OSError:
+            pass
+
+    @contextmanager
+    def in_use(self):
+        """Marks an agent run in the workspace; the reaper keeps it alive until the run ends."""
+        with _lock:
+            self.active_runs += 1
+        self.touch(force=True)
+        try:
+            yield self
+        finally:
+            with _lock:
+                self.active_runs -= 1
+            self.touch(force=True)
+
+    def unshare_links(self):
+        """
+        Before code runs here: if a hardlink fork left this workspace sharing inodes with
+        another one, gives each shared file its own copy so the code cannot change both.
+        """
+        marker = os.path.join(self.path, SHARED_MARKER)
+        if not os.path.exists(marker):
+            return
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(directory, name)
+                if path != marker and not os.path.islink(path):
+                    _unshare(path, keep_content=True)
+        os.remove(marker)
+        self.invalidate()
+
+def _unshare(full_path, keep_content):
+    """
+    Gives full_path its own inode if a fork still shares it through a hardlink, so the
+    write does not show up in the other workspace. Reflinked files need nothing: the
+    filesystem copies their blocks on write.
+    """
+    try:
+        info = os.stat(full_path)
+    except OSError:
+        return
+    if info.st_nlink > 1:
+        if keep_content:
+            private = f"{full_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copy2(full_path, private)
+            os.replace(private, full_path)
+        else:
+            os.unlink(full_path)
+
+# --- Registry ---
+_workspaces = {}
+_lock = threading.Lock()
+_reaper = None
+
+def scope_of(path):
+    """A stable name for a workspace, e.g. 'user-1/conversation-3', used to key its tasks."""
+    if path == SHARED_WORKSPACE:
+        return 'shared'
+    return os.path.relpath(path, WORKSPACES_ROOT).replace(os.sep, '/')
+
+def path_for(user_id, conversation_id):
+    return os.path.join(WORKSPACES_ROOT, f"user-{int(user_id)}", f"conversation-{int(conversation_id)}")
+
+def _get_path(path):
+    global _reaper
+    with _lock:
+        workspace = _workspaces.get(path)
+        if workspace is not None and not workspace.active_runs and not os.path.isdir(path):
+            # Reaped by another process: start over rather than trust the old usage and index.
+            workspace = None
+            workspace_index.drop_index(path)
+        if workspace is None:
+            os.makedirs(path, exist_ok=True)
+            workspace = _workspaces[path] = Workspace(path)
+        if _reaper is None and REAP_INTERVAL > 0 and path != SHARED_WORKSPACE:
+            _reaper = threading.Thread(target=_reap_loop, name="workspace-reaper", daemon=True)
+            _reaper.start()
+    workspace.touch()
+    return workspace
+
+def get(user_id=None, conversation_id=None):
+    """The workspace of a conversation, created on first use; the shared one without a user and conversation."""
+    if user_id is None or conversation_id is None:
+        return _get_path(SHARED_WORKSPACE)
+    return _get_path(path_for(user_id, conversation_id))
+
+def for_context(context):
+    """The workspace for a TOOL_CONTEXT dict ({'user_id': ..., 'conversation_id': ...})."""
+    return get(context.get('user_id'), context.get('conversation_id'))
+
+# --- Forks ---
+def _clone_file(source, target, mode):
+    """Copies one file the cheapest way `mode` allows; returns the method used."""
+    if mode == 'auto' and fcntl is not None:
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(source, target)
+            return 'reflink'
+        except OSError:
+            if os.path.exists(target):
+                os.unlink(target)
+    if mode == 'hardlink':
+        try:
+            os.link(source, target)
+            return 'hardlink'
+        except OSError:
+            pass
+    shutil.copy2(source, target)
+    return 'copy'
+
+def fork(user_id, source_conversation_id, target_conversation_id, mode=None):
+    """
+    Snapshots a conversation's workspace into a new conversation's workspace. Files are
+    reflinked (or, in hardlink mode, hardlinked) rather than copied where possible, so a
+    fork takes time and space per file, not per byte. The source's files are never
+    modified. Returns {'files': n, 'reflink': n, 'hardlink': n, 'copy': n}.
+    """
+    source = get(user_id, source_conversation_id)
+    target = get(user_id, target_conversation_id)
+    mode = mode or FORK_MODE
+    counts = {'files': 0, 'reflink': 0, 'hardlink': 0, 'copy': 0}
+    for directory, subdirs, names in os.walk(source.path):
+        relative = os.path.relpath(directory, source.path)
+        target_dir = os.path.normpath(os.path.join(target.path, relative))
+        if directory == source.path:
+            subdirs[:] = [name for name in subdirs if name != SANDBOX_DIR]
+        for name in subdirs:
+            os.makedirs(os.path.join(target_dir, name), exist_ok=True)
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.islink(path) or (directory == source.path and name in (LAST_USED_FILE, SHARED_MARKER)):
+                continue
+            counts[_clone_file(path, os.path.join(target_dir, name), mode)] += 1
+            counts['files'] += 1
+    if counts['hardlink']:
+        for workspace in (source, target):
+            open(os.path.join(workspace.path, SHARED_MARKER), 'a').close()
+        source.invalidate()
+    target.invalidate()
+    task_store.get_store().copy_scope(source.scope, target.scope)
+    return counts
+
+# --- LRU reclamation ---
+def all_paths():
+    """Every per-conversation workspace directory on disk."""
+    try:
+        return [os.path.join(WORKSPACES_ROOT, user, conversation)
+                for user in os.listdir(WORKSPACES_ROOT) if user.startswith('user-')
+                for conversation in os.listdir(os.path.join(WORKSPACES_ROOT, user))]
+    except OSError:
+        return []
+
+def _last_used(path):
+    """When any process last used the workspace: LAST_USED_FILE's mtime, else the directory's."""
+    for candidate in (os.path.join(path, LAST_USED_FILE), path):
+        try:
+            return os.stat(candidate).st_mtime
+        except OSError:
+            continue
+    return 0.0
+
+def remove(path):
+    """Deletes a workspace and forgets its usage and search index."""
+    with _lock:
+        workspace = _workspaces.get(path)
+        if workspace is not None and workspace.active_runs:
+            raise RuntimeError(f"Workspace {scope_of(path)} has an active run.")
+        _workspaces.pop(path, None)
+    workspace_index.drop_index(path)
+    task_store.get_store().drop_scope(scope_of(path))
+    shutil.rmtree(path, ignore_errors=True)
+
+def reap(now=None):
+    """Deletes idle workspaces, least recently used first; returns how many were removed."""
+    now = now or time.time()
+    by_age = sorted(all_paths(), key=_last_used)
+    excess = len(by_age) - MAX_WORKSPACES
+    removed = 0
+    for path in by_age:
+        idle = now - _last_used(path)
+        if idle < MIN_IDLE_SECONDS:
+            break
+        if idle > IDLE_SECONDS or removed < excess:
+            # Re-read just before deleting, in case a run in any process touched it meanwhile.
+            if now - _last_used(path) < MIN_IDLE_SECONDS:
+                continue
+            try:
+                remove(path)
+            except RuntimeError:
+                continue
+            removed += 1
+    if removed:
+        print(f"Workspace reaper: removed {removed} idle workspaces")
+    return removed
+
+def _reap_loop():
+    while True:
+        time.sleep(REAP_INTERVAL)
+        try:
+            with _lock:
+                active = [workspace for workspace in _workspaces.values() if workspace.active_runs]
+                # Forget workspaces another process has reaped.
+                gone = [path for path, workspace in _workspaces.items()
+                        if not workspace.active_runs and path != SHARED_WORKSPACE and not os.path.isdir(path)]
+                for path in gone:
+                    del _workspaces[path]
+            for path in gone:
+                workspace_index.drop_index(path)
+            for workspace in active:
+                workspace.touch(force=True)
+            reap()
+        except Exception as e:
+            print(f"Workspace reaper failed: {e}")